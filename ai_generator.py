@@ -923,24 +923,22 @@ class VideoGenerator:
             logger.info("توليد فيديو محلياً من الصورة...")
             
             from moviepy.editor import ImageClip
-            import numpy as np
+            from ken_burns import KenBurnsEngine
             
             settings = getattr(config, 'LOCAL_VIDEO_FROM_IMAGES', {})
             duration = settings.get('image_duration', 4.0)
             fps = settings.get('fps', 30)
             
-            # إنشاء مقطع من الصورة
-            clip = ImageClip(image_path, duration=duration)
-            
-            # تغيير الحجم
             video_width = getattr(config, 'VIDEO_WIDTH', 1920)
             video_height = getattr(config, 'VIDEO_HEIGHT', 1080)
-            clip = clip.resize((video_width, video_height))
             
-            # تطبيق تأثير Ken Burns إذا مفعل
+            # تطبيق تأثير Ken Burns إذا مفعل (يرسم مباشرة من الصورة الأصلية)
             if settings.get('ken_burns_enabled', True):
                 zoom = settings.get('ken_burns_zoom', 1.15)
-                clip = self._apply_ken_burns_effect(clip, zoom, duration)
+                engine = KenBurnsEngine(video_width, video_height, zoom)
+                clip = engine.image_clip(image_path, duration, fps)
+            else:
+                clip = ImageClip(image_path, duration=duration).resize((video_width, video_height))
             
             # حفظ الفيديو
             clip.write_videofile(
@@ -959,37 +957,6 @@ class VideoGenerator:
             logger.error(f"خطأ في التوليد المحلي: {str(e)}")
             return None
     
-    def _apply_ken_burns_effect(self, clip, zoom: float, duration: float):
-        """تطبيق تأثير Ken Burns"""
-        try:
-            def zoom_effect(get_frame, t):
-                frame = get_frame(t)
-                progress = t / duration
-                current_zoom = 1 + (zoom - 1) * progress
-                
-                h, w = frame.shape[:2]
-                new_h, new_w = int(h / current_zoom), int(w / current_zoom)
-                
-                y1 = (h - new_h) // 2
-                x1 = (w - new_w) // 2
-                
-                cropped = frame[y1:y1+new_h, x1:x1+new_w]
-                
-                try:
-                    import cv2
-                    return cv2.resize(cropped, (w, h), interpolation=cv2.INTER_LINEAR)
-                except:
-                    from PIL import Image
-                    import numpy as np
-                    img = Image.fromarray(cropped)
-                    img = img.resize((w, h), Image.Resampling.LANCZOS)
-                    return np.array(img)
-            
-            return clip.fl(zoom_effect)
-        except Exception as e:
-            logger.error(f"خطأ في تأثير Ken Burns: {str(e)}")
-            return clip
-    
     def _generate_with_kling(self, image_path: str, output_path: str, prompt: str) -> Optional[str]:
         """توليد فيديو باستخدام Kling AI"""
         try:
@@ -1369,7 +1336,7 @@ class LocalVideoGenerator:
                 ImageClip, concatenate_videoclips, CompositeVideoClip,
                 AudioFileClip, ColorClip
             )
-            import numpy as np
+            from ken_burns import KenBurnsEngine
             
             if not image_paths:
                 logger.error("لا توجد صور للتحويل")
@@ -1390,13 +1357,13 @@ class LocalVideoGenerator:
             clips = []
             
             for i, img_path in enumerate(image_paths):
-                # إنشاء مقطع من الصورة
-                clip = ImageClip(img_path, duration=image_duration)
-                clip = clip.resize((video_width, video_height))
-                
-                # تطبيق Ken Burns
+                # إنشاء مقطع من الصورة مع Ken Burns (تنويع الاتجاه بناءً على الفهرس)
                 if ken_burns:
-                    clip = self._apply_ken_burns(clip, zoom, image_duration, i)
+                    engine = KenBurnsEngine.for_index(i, video_width, video_height, zoom)
+                    clip = engine.image_clip(img_path, image_duration, fps)
+                else:
+                    clip = ImageClip(img_path, duration=image_duration)
+                    clip = clip.resize((video_width, video_height))
                 
                 clips.append(clip)
             
@@ -1439,56 +1406,6 @@ class LocalVideoGenerator:
             logger.error(traceback.format_exc())
             return None
     
-    def _apply_ken_burns(self, clip, zoom: float, duration: float, index: int):
-        """تطبيق تأثير Ken Burns مع اتجاهات مختلفة"""
-        try:
-            # تنويع الاتجاه بناءً على الفهرس
-            directions = ['zoom_in', 'zoom_out', 'pan_left', 'pan_right']
-            direction = directions[index % len(directions)]
-            
-            def effect(get_frame, t):
-                frame = get_frame(t)
-                progress = t / duration
-                
-                h, w = frame.shape[:2]
-                
-                if direction == 'zoom_in':
-                    current_zoom = 1 + (zoom - 1) * progress
-                elif direction == 'zoom_out':
-                    current_zoom = zoom - (zoom - 1) * progress
-                else:
-                    current_zoom = 1.1  # تكبير ثابت للتحريك
-                
-                new_h, new_w = int(h / current_zoom), int(w / current_zoom)
-                
-                # حساب الموقع
-                if direction == 'pan_left':
-                    x1 = int((w - new_w) * progress)
-                elif direction == 'pan_right':
-                    x1 = int((w - new_w) * (1 - progress))
-                else:
-                    x1 = (w - new_w) // 2
-                
-                y1 = (h - new_h) // 2
-                
-                cropped = frame[y1:y1+new_h, x1:x1+new_w]
-                
-                try:
-                    import cv2
-                    return cv2.resize(cropped, (w, h), interpolation=cv2.INTER_LINEAR)
-                except:
-                    from PIL import Image
-                    import numpy as np
-                    img = Image.fromarray(cropped)
-                    img = img.resize((w, h), Image.Resampling.LANCZOS)
-                    return np.array(img)
-            
-            return clip.fl(effect)
-            
-        except Exception as e:
-            logger.error(f"خطأ في Ken Burns: {str(e)}")
-            return clip
-    
     def _apply_transitions(self, clips: list, duration: float, transition_type: str) -> list:
         """تطبيق الانتقالات بين المقاطع"""
         if len(clips) <= 1:
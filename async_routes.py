@@ -189,14 +189,23 @@ def add_async_routes(app):
         API endpoint to get cache status
         """
         try:
-            from performance_manager import cache_manager, bg_video_cache
+            from performance_manager import (
+                cache_manager, bg_video_cache, enhanced_video_cache, tts_audio_cache, artifact_cache, expiry_sweeper,
+                async_video_generator
+            )
             
             status = {
                 'cache_enabled': True,
                 'memory_cache_items': len(cache_manager.memory_cache),
-                'memory_cache_max': cache_manager.max_size,
+                'memory_cache': cache_manager.memory_cache.stats(),
+                'disk_cache': cache_manager.index.stats(),
                 'bg_video_cache_items': len(bg_video_cache.cache_info),
-                'bg_video_cache_max': bg_video_cache.max_cache_size
+                'bg_video_cache_max': bg_video_cache.max_cache_size,
+                'enhanced_video_cache': enhanced_video_cache.store.stats(),
+                'tts_audio_cache': tts_audio_cache.store.stats(),
+                'stage_cache': {stage: artifact_cache.stores[stage].stats() for stage in ('overlay', 'final')},
+                'sweeper': expiry_sweeper.stats(),
+                'jobs': async_video_generator.jobs.stats()
             }
             
             return jsonify({
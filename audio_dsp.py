@@ -0,0 +1,543 @@
+# -*- coding: utf-8 -*-
+"""
+معالجة الصوت الرقمية المتجهة - Vectorized Audio DSP
+
+Every stage works on one float32 buffer shaped (samples, channels) with
+values in [-1, 1]. A file is decoded once, run through the chain and
+encoded once, with no AudioSegment rebuilds in between.
+"""
+
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import numpy as np
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# محاولة استيراد المكتبات المطلوبة
+try:
+    from pydub import AudioSegment
+    PYDUB_AVAILABLE = True
+except ImportError:
+    PYDUB_AVAILABLE = False
+
+try:
+    from scipy import signal
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+try:
+    import pyloudnorm
+    PYLOUDNORM_AVAILABLE = True
+except ImportError:
+    PYLOUDNORM_AVAILABLE = False
+
+# أحجام عينات PCM المدعومة؛ 8 بت بلا إشارة (الصمت = 128) و24 بت تخزن في 3 بايتات
+_INT_DTYPES = {1: np.uint8, 2: np.int16, 3: np.int32, 4: np.int32}
+
+
+def _check_sample_width(sample_width: int):
+    if sample_width not in _INT_DTYPES:
+        raise ValueError(f"unsupported PCM sample width: {sample_width} bytes")
+
+
+def _pcm_to_int(raw: bytes, sample_width: int) -> np.ndarray:
+    """
+    عينات PCM خام (little-endian) إلى أعداد صحيحة بإشارة
+    Signed integer samples from raw little-endian PCM
+    """
+    _check_sample_width(sample_width)
+    if sample_width == 3:
+        # توسيع كل عينة من 3 بايتات إلى int32 مع الحفاظ على الإشارة
+        packed = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        samples = packed[:, 0] | (packed[:, 1] << 8) | (packed[:, 2] << 16)
+        return np.where(samples >= 1 << 23, samples - (1 << 24), samples)
+    samples = np.frombuffer(raw, dtype=_INT_DTYPES[sample_width])
+    if sample_width == 1:
+        return samples.astype(np.int16) - 128
+    return samples
+
+
+def _int_to_pcm(samples: np.ndarray, sample_width: int) -> bytes:
+    """
+    أعداد صحيحة بإشارة إلى PCM خام بالحجم المطلوب
+    Raw little-endian PCM of the given width from signed integer samples
+    """
+    _check_sample_width(sample_width)
+    if sample_width == 3:
+        return samples.astype('<i4').view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    if sample_width == 1:
+        return (samples + 128).astype(np.uint8).tobytes()
+    return samples.astype(_INT_DTYPES[sample_width]).tobytes()
+
+
+def db_to_gain(db):
+    """تحويل الديسيبل إلى معامل خطي"""
+    return np.power(10.0, np.asarray(db, dtype=np.float32) / 20.0)
+
+
+def decode(input_path: str) -> Tuple[np.ndarray, int, int]:
+    """
+    فك ترميز ملف صوتي إلى مصفوفة float32
+    Decode an audio file to a float32 (samples, channels) buffer
+    
+    Returns:
+        (samples, sample_rate, sample_width)
+    """
+    audio = AudioSegment.from_file(input_path)
+    samples = _pcm_to_int(audio.raw_data, audio.sample_width).reshape(-1, audio.channels)
+    scale = 1.0 / float(2 ** (8 * audio.sample_width - 1))
+    return samples.astype(np.float32) * scale, audio.frame_rate, audio.sample_width
+
+
+def encode(samples: np.ndarray, sample_rate: int, output_path: str, sample_width: int = 2) -> str:
+    """
+    ترميز المصفوفة وحفظها بصيغة الملف حسب امتداده
+    Encode a float32 buffer to output_path (format taken from the extension)
+    """
+    _check_sample_width(sample_width)
+    peak = float(2 ** (8 * sample_width - 1) - 1)
+    data = np.round(np.clip(samples, -1.0, 1.0).astype(np.float64) * peak).astype(np.int64)
+    audio = AudioSegment(
+        _int_to_pcm(data, sample_width),
+        frame_rate=sample_rate,
+        sample_width=sample_width,
+        channels=samples.shape[1]
+    )
+    audio.export(output_path, format=os.path.splitext(output_path)[1][1:] or 'mp3')
+    return output_path
+
+
+def apply_gain(samples: np.ndarray, gain_db: float) -> np.ndarray:
+    """تطبيق كسب ثابت بالديسيبل"""
+    if gain_db:
+        samples *= db_to_gain(gain_db)
+    return samples
+
+
+def peak_db(samples: np.ndarray) -> float:
+    """مستوى القمة بالديسيبل (dBFS)"""
+    peak = float(np.max(np.abs(samples))) if samples.size else 0.0
+    return 20.0 * np.log10(peak) if peak > 0 else float('-inf')
+
+
+def normalize_peak(samples: np.ndarray, headroom_db: float = 0.1) -> np.ndarray:
+    """
+    تطبيع القمة إلى -headroom dBFS (مثل pydub.effects.normalize)
+    Peak-normalize to -headroom dBFS
+    """
+    peak = peak_db(samples)
+    if np.isfinite(peak):
+        samples = apply_gain(samples, -headroom_db - peak)
+    return samples
+
+
+def integrated_loudness(samples: np.ndarray, sample_rate: int) -> Optional[float]:
+    """
+    قياس الجهارة المتكاملة (LUFS) حسب ITU-R BS.1770
+    Integrated loudness in LUFS, or None when it cannot be measured
+    (pyloudnorm missing, audio shorter than one 400 ms block, or silence)
+    """
+    if not PYLOUDNORM_AVAILABLE or samples.shape[0] < int(0.4 * sample_rate):
+        return None
+    loudness = _loudness_meter(sample_rate).integrated_loudness(samples)
+    return float(loudness) if np.isfinite(loudness) else None
+
+
+@lru_cache(maxsize=8)
+def _loudness_meter(sample_rate: int):
+    """مقياس الجهارة لكل معدل عينات (تصميم مرشحات K-weighting مرة واحدة)"""
+    return pyloudnorm.Meter(sample_rate)
+
+
+def normalize_loudness(samples: np.ndarray, sample_rate: int, target_lufs: float = -16.0,
+                       peak_ceiling_db: float = -1.0) -> np.ndarray:
+    """
+    تطبيع الجهارة إلى target_lufs مع سقف للقمة
+    Normalize integrated loudness to target_lufs without pushing the peak
+    above peak_ceiling_db. Falls back to peak normalization at the ceiling
+    when loudness cannot be measured.
+    """
+    loudness = integrated_loudness(samples, sample_rate)
+    peak = peak_db(samples)
+    if not np.isfinite(peak):
+        return samples
+    if loudness is None:
+        return apply_gain(samples, peak_ceiling_db - peak)
+    gain = min(target_lufs - loudness, peak_ceiling_db - peak)
+    return apply_gain(samples, gain)
+
+
+def compress(samples: np.ndarray, sample_rate: int, threshold_db: float = -20.0, ratio: float = 4.0,
+             attack_ms: float = 5.0, release_ms: float = 50.0) -> np.ndarray:
+    """
+    ضاغط ديناميكي متجه مع نظرة مسبقة
+    Vectorized look-ahead compressor
+    
+    The level is the RMS over the next `attack_ms` (linked across channels),
+    so gain reduction is already in place when a loud passage starts. Above
+    the threshold the output rises 1/ratio dB per input dB. Gain recovery
+    follows a one-pole release with time constant `release_ms`.
+    """
+    if ratio <= 1 or not samples.size:
+        return samples
+    
+    n = samples.shape[0]
+    window = max(1, int(sample_rate * attack_ms / 1000.0))
+    
+    # RMS متحرك للأمام عبر المجموع التراكمي
+    power = np.mean(np.square(samples, dtype=np.float64), axis=1)
+    cumulative = np.concatenate(([0.0], np.cumsum(power)))
+    ends = np.minimum(np.arange(n) + window, n)
+    rms = np.sqrt(np.maximum((cumulative[ends] - cumulative[:n]) / (ends - np.arange(n)), 1e-20))
+    
+    level_db = 20.0 * np.log10(rms)
+    reduction = (1.0 - 1.0 / ratio) * np.maximum(level_db - threshold_db, 0.0)
+    
+    # النافذة الأمامية تبني التخفيض قبل بداية المقطع العالي، ثم تحرير تدريجي
+    release = np.exp(-1.0 / max(1.0, sample_rate * release_ms / 1000.0))
+    released = signal.lfilter([1.0 - release], [1.0, -release], reduction)
+    reduction = np.maximum(reduction, released)
+    
+    samples *= db_to_gain(-reduction).astype(np.float32)[:, None]
+    return samples
+
+
+def equalizer_bands(eq_settings: dict) -> tuple:
+    """
+    تحويل إعدادات المعادل إلى نطاقات (النوع، التردد، الكسب، Q)
+    Turn LOCAL_AUDIO_ENHANCEMENT['eq_settings'] into hashable bands.
+    'low_shelf' and 'high_shelf' keys are shelves, any other key is a
+    peaking band.
+    """
+    bands = []
+    for name, band in (eq_settings or {}).items():
+        if not band or not band.get('gain'):
+            continue
+        kind = name if name in ('low_shelf', 'high_shelf') else 'peaking'
+        q = band.get('q', 0.707 if kind != 'peaking' else 1.0)
+        bands.append((kind, float(band.get('freq', 1000)), float(band['gain']), float(q)))
+    return tuple(bands)
+
+
+def _biquad(kind: str, freq: float, gain_db: float, q: float, sample_rate: int) -> np.ndarray:
+    """معاملات مرشح biquad (Audio EQ Cookbook) كقسم SOS واحد"""
+    a = 10.0 ** (gain_db / 40.0)
+    w0 = 2 * np.pi * freq / sample_rate
+    cos_w0 = np.cos(w0)
+    alpha = np.sin(w0) / (2 * q)
+    
+    if kind == 'peaking':
+        b = [1 + alpha * a, -2 * cos_w0, 1 - alpha * a]
+        den = [1 + alpha / a, -2 * cos_w0, 1 - alpha / a]
+    else:
+        root = 2 * np.sqrt(a) * alpha
+        sign = 1 if kind == 'low_shelf' else -1
+        b = [a * ((a + 1) - sign * (a - 1) * cos_w0 + root),
+             sign * 2 * a * ((a - 1) - sign * (a + 1) * cos_w0),
+             a * ((a + 1) - sign * (a - 1) * cos_w0 - root)]
+        den = [(a + 1) + sign * (a - 1) * cos_w0 + root,
+               -sign * 2 * ((a - 1) + sign * (a + 1) * cos_w0),
+               (a + 1) + sign * (a - 1) * cos_w0 - root]
+    return np.concatenate([b, den]) / den[0]
+
+
+@lru_cache(maxsize=32)
+def design_equalizer(sample_rate: int, bands: tuple) -> np.ndarray:
+    """
+    تصميم بنك المرشحات مرة واحدة لكل معدل عينات
+    Design the cascaded SOS filter bank once per (sample_rate, bands).
+    Bands at or above Nyquist are skipped.
+    """
+    nyquist = sample_rate / 2.0
+    sections = [_biquad(kind, freq, gain, q, sample_rate)
+                for kind, freq, gain, q in bands if 0 < freq < nyquist]
+    if len(sections) < len(bands):
+        logger.debug(f"تم تجاهل نطاقات فوق تردد نايكويست ({nyquist} Hz)")
+    sos = np.array(sections, dtype=np.float64).reshape(-1, 6)
+    sos.setflags(write=False)
+    return sos
+
+
+def equalize(samples: np.ndarray, sample_rate: int, eq_settings: dict, gain_db: float = 0.0) -> np.ndarray:
+    """
+    تطبيق بنك المعادل والكسب في مرور واحد
+    Apply the cached SOS bank and a static gain in a single sosfilt pass
+    (the gain is folded into the first section's numerator).
+    """
+    sos = design_equalizer(sample_rate, equalizer_bands(eq_settings))
+    if not len(sos):
+        return apply_gain(samples, gain_db)
+    sos = sos.copy()
+    sos[0, :3] *= db_to_gain(gain_db)
+    # حالة ابتدائية مستقرة لتجنب نقرة في البداية
+    zi = signal.sosfilt_zi(sos)[:, :, None] * samples[0][None, None, :]
+    out, _ = signal.sosfilt(sos, samples, axis=0, zi=zi)
+    return out.astype(np.float32)
+
+
+def sidechain_envelope(samples: np.ndarray, sample_rate: int, threshold_db: float = -40.0,
+                       attack_ms: float = 80.0, release_ms: float = 600.0, window_ms: float = 20.0) -> np.ndarray:
+    """
+    غلاف التحكم الجانبي للخفض (0 = صمت، 1 = كلام)
+    Ducking envelope in [0, 1] computed from the narration.
+    
+    The RMS over window_ms is gated at threshold_db. The gate opens
+    attack_ms ahead of each onset (a backward one-pole pass) and closes
+    over release_ms (a forward one-pole pass), so the music dips just
+    before speech starts and recovers smoothly in pauses.
+    """
+    n = samples.shape[0]
+    if not n:
+        return np.zeros(0, dtype=np.float32)
+    window = max(1, int(sample_rate * window_ms / 1000.0))
+    power = np.mean(np.square(samples, dtype=np.float64), axis=1)
+    cumulative = np.concatenate(([0.0], np.cumsum(power)))
+    starts = np.maximum(np.arange(n) - window // 2, 0)
+    ends = np.minimum(starts + window, n)
+    rms = np.sqrt(np.maximum((cumulative[ends] - cumulative[starts]) / (ends - starts), 1e-20))
+    gate = (20.0 * np.log10(rms) > threshold_db).astype(np.float64)
+    
+    attack = np.exp(-1.0 / max(1.0, sample_rate * attack_ms / 1000.0))
+    release = np.exp(-1.0 / max(1.0, sample_rate * release_ms / 1000.0))
+    ahead = signal.lfilter([1.0 - attack], [1.0, -attack], gate[::-1])[::-1]
+    behind = signal.lfilter([1.0 - release], [1.0, -release], gate)
+    return np.clip(np.maximum(gate, np.maximum(ahead, behind)), 0.0, 1.0).astype(np.float32)
+
+
+class SpectralGate:
+    """
+    إزالة ضوضاء ثابتة بالبوابة الطيفية على كتل متداخلة
+    Stationary spectral-gate noise reduction over overlapping blocks.
+    
+    The noise profile (per channel and frequency bin) is estimated once,
+    from the leading silence when there is enough of it, otherwise from the
+    quietest frames. The file is then gated in blocks aligned to the STFT
+    hop, each read with enough context that its output matches a
+    whole-file pass, so memory is bounded by the block size and blocks can
+    run on a thread pool (numpy FFTs release the GIL).
+    """
+    
+    def __init__(self, sample_rate: int, strength: float = 0.7, n_fft: int = 1024,
+                 n_std: float = 1.5, block_seconds: float = 10.0,
+                 freq_smooth_hz: float = 500.0, time_smooth_ms: float = 50.0):
+        self.sample_rate = sample_rate
+        self.strength = min(max(float(strength), 0.0), 1.0)
+        self.n_fft = n_fft
+        self.hop = n_fft // 4
+        self.n_std = n_std
+        self.window = np.hanning(n_fft + 1)[:-1].astype(np.float32)
+        
+        # نواة تنعيم القناع عبر الزمن والتردد
+        half_t = max(0, int(time_smooth_ms / 1000.0 * sample_rate / self.hop))
+        half_f = max(0, int(freq_smooth_hz / (sample_rate / float(n_fft))))
+        kernel = np.outer(np.bartlett(2 * half_t + 3)[1:-1], np.bartlett(2 * half_f + 3)[1:-1])
+        self._kernel = (kernel / kernel.sum()).astype(np.float32)[:, None, :]
+        
+        self.block_size = max(1, int(block_seconds * sample_rate) // self.hop) * self.hop
+        self.context = (2 * n_fft // self.hop + half_t + 1) * self.hop
+        self.threshold = None
+    
+    def _spectrum(self, samples: np.ndarray, pad: int = 0) -> np.ndarray:
+        """STFT بالشكل (إطارات، قنوات، ترددات)"""
+        padded = np.pad(samples, ((pad, pad + (-(samples.shape[0] + 2 * pad) % self.hop)), (0, 0)))
+        if padded.shape[0] < self.n_fft:
+            padded = np.pad(padded, ((0, self.n_fft - padded.shape[0]), (0, 0)))
+        frames = np.lib.stride_tricks.sliding_window_view(padded, self.n_fft, axis=0)[::self.hop]
+        return np.fft.rfft(frames * self.window, axis=-1).astype(np.complex64)
+    
+    def estimate_profile(self, samples: np.ndarray, search_seconds: float = 5.0) -> np.ndarray:
+        """
+        تقدير عتبة الضوضاء مرة واحدة لكل ملف
+        Estimate the per-channel, per-bin gate threshold (dB)
+        """
+        region = samples[:max(self.n_fft, int(search_seconds * self.sample_rate))]
+        magnitude_db = 20.0 * np.log10(np.abs(self._spectrum(region)) + 1e-10)
+        energy = np.mean(magnitude_db, axis=(1, 2))
+        
+        # الصمت في البداية: الإطارات الأولى القريبة من أهدأ مستوى
+        loud = np.flatnonzero(energy > energy.min() + 10.0)
+        leading = loud[0] if loud.size else energy.size
+        if leading >= 8:
+            noise = magnitude_db[:leading]
+        else:
+            noise = magnitude_db[energy <= np.percentile(energy, 20)]
+        
+        self.threshold = noise.mean(axis=0) + self.n_std * noise.std(axis=0)
+        return self.threshold
+    
+    def _gate(self, segment: np.ndarray) -> np.ndarray:
+        """تطبيق البوابة على مقطع وإعادة تركيبه بالتداخل والجمع"""
+        n, channels = segment.shape
+        pad = self.n_fft
+        spectrum = self._spectrum(segment, pad)
+        magnitude_db = 20.0 * np.log10(np.abs(spectrum) + 1e-10)
+        
+        mask = (magnitude_db > self.threshold[None]).astype(np.float32)
+        mask = signal.fftconvolve(mask, self._kernel, mode='same', axes=(0, 2))
+        gain = 1.0 - self.strength * (1.0 - np.clip(mask, 0.0, 1.0))
+        frames = np.fft.irfft(spectrum * gain, self.n_fft, axis=-1) * self.window
+        
+        # التداخل والجمع: كل إطار يغطي n_fft / hop قطعة متتالية
+        ratio = self.n_fft // self.hop
+        count = frames.shape[0]
+        chunks = frames.reshape(count, channels, ratio, self.hop)
+        out = np.zeros((count + ratio - 1, channels, self.hop), dtype=np.float32)
+        norm = np.zeros((count + ratio - 1, 1, self.hop), dtype=np.float32)
+        squared = np.square(self.window).reshape(ratio, self.hop)
+        for k in range(ratio):
+            out[k:k + count] += chunks[:, :, k, :]
+            norm[k:k + count] += squared[k]
+        out /= np.maximum(norm, 1e-8)
+        return out.transpose(0, 2, 1).reshape(-1, channels)[pad:pad + n]
+    
+    def _process_block(self, samples: np.ndarray, start: int) -> np.ndarray:
+        end = min(start + self.block_size, samples.shape[0])
+        lo = max(0, start - self.context)
+        hi = min(samples.shape[0], end + self.context)
+        return self._gate(samples[lo:hi])[start - lo:end - lo]
+    
+    def process(self, samples: np.ndarray, workers: int = 1) -> np.ndarray:
+        """
+        إزالة الضوضاء من المخزن كاملاً على كتل
+        Denoise a (samples, channels) buffer block by block
+        """
+        if self.threshold is None or self.threshold.shape[0] != samples.shape[1]:
+            self.estimate_profile(samples)
+        
+        out = np.empty_like(samples)
+        starts = range(0, samples.shape[0], self.block_size)
+        if workers > 1 and len(starts) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for start, block in zip(starts, executor.map(lambda s: self._process_block(samples, s), starts)):
+                    out[start:start + block.shape[0]] = block
+        else:
+            for start in starts:
+                block = self._process_block(samples, start)
+                out[start:start + block.shape[0]] = block
+        return out
+
+
+def impulse_response(sample_rate: int, room_size: float = 0.3, impulse_path: Optional[str] = None) -> np.ndarray:
+    """
+    استجابة نبضية للصدى: من ملف أو مولدة حسب حجم الغرفة
+    Impulse response as float32 (taps, channels), normalized to unit energy.
+    
+    Without impulse_path, a room is synthesized: a short pre-delay, a few
+    early reflections and an exponentially decaying noise tail whose RT60
+    grows with room_size (0.0-1.0).
+    """
+    if impulse_path:
+        ir, ir_rate, _ = decode(impulse_path)
+        if ir_rate != sample_rate:
+            ir = signal.resample_poly(ir, sample_rate, ir_rate, axis=0).astype(np.float32)
+        # استجابة أحادية تطبق على كل القنوات
+        ir = ir.mean(axis=1, keepdims=True)
+    else:
+        room_size = min(max(float(room_size), 0.0), 1.0)
+        rt60 = 0.3 + 2.2 * room_size
+        rng = np.random.default_rng(int(room_size * 1000))
+        t = np.arange(int(rt60 * sample_rate)) / float(sample_rate)
+        # ذيل ضوضائي يتلاشى 60 dB خلال RT60
+        ir = rng.standard_normal(t.size) * np.exp(-6.9078 * t / rt60)
+        pre_delay = int((0.01 + 0.02 * room_size) * sample_rate)
+        ir[:pre_delay] = 0.0
+        for delay, gain in ((0.007, 0.8), (0.013, 0.6), (0.021, 0.45), (0.034, 0.3)):
+            ir[int((delay * (1 + room_size)) * sample_rate)] += gain * 4
+        ir = ir.astype(np.float32)[:, None]
+    energy = float(np.sqrt(np.sum(np.square(ir, dtype=np.float64))))
+    return ir / energy if energy > 0 else ir
+
+
+def _file_stamp(path: Optional[str]) -> Optional[tuple]:
+    """(الحجم، وقت التعديل) حتى تلاحظ الذاكرة المؤقتة تغير الملف بنفس المسار"""
+    if not path:
+        return None
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+@lru_cache(maxsize=8)
+def _reverb_spectrum(sample_rate: int, room_size: float, impulse_path: Optional[str],
+                     impulse_stamp: Optional[tuple] = None) -> tuple:
+    """
+    طيف الاستجابة النبضية محسوب مرة واحدة - (fft_size, taps, spectrum)
+    
+    impulse_stamp is only part of the cache key: replacing the impulse
+    file under the same path computes a fresh spectrum.
+    """
+    ir = impulse_response(sample_rate, room_size, impulse_path)
+    taps = ir.shape[0]
+    # كتلة بطول الاستجابة على الأقل لموازنة تكلفة FFT
+    fft_size = 1 << int(np.ceil(np.log2(2 * taps)))
+    spectrum = np.fft.rfft(ir, fft_size, axis=0).astype(np.complex64)
+    spectrum.setflags(write=False)
+    return fft_size, taps, spectrum
+
+
+class ReverbEngine:
+    """
+    صدى بالالتفاف عبر FFT (overlap-add) بكتل ثابتة الحجم
+    FFT-convolution reverb using overlap-add over fixed-size blocks.
+    
+    Working memory is bounded by the block and the impulse response; the
+    state between blocks is only the convolution tail, so process_block
+    can also be fed a stream.
+    """
+    
+    def __init__(self, sample_rate: int, room_size: float = 0.3, wet: float = 0.2,
+                 impulse_path: Optional[str] = None):
+        self.sample_rate = sample_rate
+        self.wet = min(max(float(wet), 0.0), 1.0)
+        self.fft_size, self.taps, self._spectrum = _reverb_spectrum(
+            sample_rate, round(float(room_size), 3), impulse_path, _file_stamp(impulse_path)
+        )
+        self.block_size = self.fft_size - self.taps + 1
+        self._tail = None
+    
+    def reset(self):
+        """مسح ذيل الالتفاف قبل ملف جديد"""
+        self._tail = None
+    
+    def process_block(self, block: np.ndarray) -> np.ndarray:
+        """معالجة كتلة (عينات، قنوات) لا تتجاوز block_size"""
+        m, channels = block.shape
+        if self._tail is None or self._tail.shape[1] != channels:
+            self._tail = np.zeros((self.taps - 1, channels), dtype=np.float32)
+        
+        spectrum = np.fft.rfft(block, self.fft_size, axis=0) * self._spectrum
+        reverb = np.fft.irfft(spectrum, self.fft_size, axis=0)[:m + self.taps - 1]
+        reverb[:self.taps - 1] += self._tail
+        self._tail = reverb[m:].astype(np.float32)
+        return (block * (1.0 - self.wet) + reverb[:m] * self.wet).astype(np.float32)
+    
+    def apply(self, samples: np.ndarray) -> np.ndarray:
+        """
+        تطبيق الصدى على المخزن في مكانه مع قص الذيل للحفاظ على المدة
+        Apply in place, block by block; the tail past the end is dropped so
+        the duration (and word timings) stay unchanged.
+        """
+        self.reset()
+        for start in range(0, samples.shape[0], self.block_size):
+            end = min(start + self.block_size, samples.shape[0])
+            samples[start:end] = self.process_block(samples[start:end])
+        self.reset()
+        return samples
+
+
+def fade(samples: np.ndarray, sample_rate: int, fade_in: float = 0.0, fade_out: float = 0.0) -> np.ndarray:
+    """تلاشي الدخول والخروج (منحنى خطي للسعة كما في pydub)"""
+    n = samples.shape[0]
+    for seconds, at_start in ((fade_in, True), (fade_out, False)):
+        length = min(n, int(seconds * sample_rate))
+        if length <= 0:
+            continue
+        ramp = np.linspace(0.0, 1.0, length, endpoint=False, dtype=np.float32)
+        if at_start:
+            samples[:length] *= ramp[:, None]
+        else:
+            samples[n - length:] *= ramp[::-1, None]
+    return samples
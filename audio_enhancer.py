@@ -13,7 +13,6 @@ logger = logging.getLogger(__name__)
 # محاولة استيراد المكتبات المطلوبة
 try:
     from pydub import AudioSegment
-    from pydub.effects import normalize, compress_dynamic_range
     PYDUB_AVAILABLE = True
 except ImportError:
     PYDUB_AVAILABLE = False
@@ -34,6 +33,8 @@ except ImportError:
     SCIPY_AVAILABLE = False
     logger.warning("scipy غير متوفر - بعض التحسينات معطلة")
 
+import audio_dsp
+
 
 class AudioEnhancer:
     """
@@ -79,61 +80,17 @@ class AudioEnhancer:
         try:
             logger.info(f"بدء تحسين الصوت: {input_path}")
             
-            # تحميل الملف الصوتي
-            audio = AudioSegment.from_file(input_path)
-            
-            # تحويل إلى numpy array للمعالجة المتقدمة
-            samples = np.array(audio.get_array_of_samples())
-            sample_rate = audio.frame_rate
-            
-            # إزالة الضوضاء
-            if self.settings.get('noise_reduction', True) and NOISEREDUCE_AVAILABLE:
-                logger.info("إزالة الضوضاء...")
-                strength = self.settings.get('noise_reduction_strength', 0.7)
-                samples = self._reduce_noise(samples, sample_rate, strength)
-            
-            # إعادة إنشاء AudioSegment من المصفوفة المعالجة
-            audio = AudioSegment(
-                samples.tobytes(),
-                frame_rate=sample_rate,
-                sample_width=audio.sample_width,
-                channels=audio.channels
-            )
-            
-            # تطبيع مستوى الصوت
-            if self.settings.get('normalize', True):
-                logger.info("تطبيع مستوى الصوت...")
-                audio = normalize(audio)
-            
-            # ضغط النطاق الديناميكي
-            if self.settings.get('compressor', True):
-                logger.info("تطبيق ضغط الصوت...")
-                threshold = self.settings.get('compressor_threshold', -20)
-                ratio = self.settings.get('compressor_ratio', 4)
-                audio = compress_dynamic_range(audio, threshold=threshold, ratio=ratio)
-            
-            # معادل الصوت (EQ)
-            if self.settings.get('equalizer', True) and SCIPY_AVAILABLE:
-                logger.info("تطبيق معادل الصوت...")
-                audio = self._apply_equalizer(audio)
-            
-            # تأثيرات التلاشي
-            fade_in = self.settings.get('fade_in', 0.5)
-            fade_out = self.settings.get('fade_out', 0.5)
-            
-            if fade_in > 0:
-                audio = audio.fade_in(int(fade_in * 1000))
-            
-            if fade_out > 0:
-                audio = audio.fade_out(int(fade_out * 1000))
+            # فك الترميز مرة واحدة إلى مخزن float32 واحد
+            samples, sample_rate, sample_width = audio_dsp.decode(input_path)
+            samples = self.process(samples, sample_rate)
             
             # تحديد مسار الإخراج
             if not output_path:
                 base, ext = os.path.splitext(input_path)
                 output_path = f"{base}_enhanced{ext}"
             
-            # حفظ الملف المحسن
-            audio.export(output_path, format=output_path.split('.')[-1])
+            # ترميز الملف المحسن مرة واحدة
+            audio_dsp.encode(samples, sample_rate, output_path, sample_width)
             
             logger.info(f"تم حفظ الصوت المحسن: {output_path}")
             return output_path
@@ -142,50 +99,111 @@ class AudioEnhancer:
             logger.error(f"خطأ في تحسين الصوت: {str(e)}")
             return input_path
     
+    def process(self, samples: np.ndarray, sample_rate: int) -> np.ndarray:
+        """
+        تطبيق سلسلة التحسين على مخزن float32 بالشكل (عينات، قنوات)
+        Run the enhancement chain on a float32 (samples, channels) buffer
+        """
+        # إزالة الضوضاء
+        if self.settings.get('noise_reduction', True):
+            logger.info("إزالة الضوضاء...")
+            strength = self.settings.get('noise_reduction_strength', 0.7)
+            samples = self._reduce_noise(samples, sample_rate, strength)
+        
+        normalize = self.settings.get('normalize', True)
+        
+        # ضبط مستوى الدخول قبل الضاغط (تُدمج في مرور المعادل)
+        gain_db = -0.1 - audio_dsp.peak_db(samples) if normalize else 0.0
+        if not np.isfinite(gain_db):
+            gain_db = 0.0
+        
+        # معادل الصوت (EQ)
+        if self.settings.get('equalizer', True) and SCIPY_AVAILABLE:
+            logger.info("تطبيق معادل الصوت...")
+            samples = self._apply_equalizer(samples, sample_rate, gain_db)
+        else:
+            samples = audio_dsp.apply_gain(samples, gain_db)
+        
+        # ضغط النطاق الديناميكي
+        if self.settings.get('compressor', True) and SCIPY_AVAILABLE:
+            logger.info("تطبيق ضغط الصوت...")
+            samples = audio_dsp.compress(
+                samples, sample_rate,
+                threshold_db=self.settings.get('compressor_threshold', -20),
+                ratio=self.settings.get('compressor_ratio', 4)
+            )
+        
+        # صدى خفيف بالالتفاف عبر FFT
+        if self.settings.get('reverb', False) and SCIPY_AVAILABLE:
+            logger.info("إضافة صدى خفيف...")
+            samples = self._reverb_engine(sample_rate).apply(samples)
+        
+        # تطبيع الجهارة إلى المستوى المستهدف (LUFS)
+        if normalize:
+            logger.info("تطبيع مستوى الصوت...")
+            samples = audio_dsp.normalize_loudness(
+                samples, sample_rate,
+                target_lufs=self.settings.get('target_loudness', -16.0),
+                peak_ceiling_db=self.settings.get('peak_ceiling', -1.0)
+            )
+        
+        # تأثيرات التلاشي
+        return audio_dsp.fade(
+            samples, sample_rate,
+            self.settings.get('fade_in', 0.5),
+            self.settings.get('fade_out', 0.5)
+        )
+    
     def _reduce_noise(self, samples: np.ndarray, sample_rate: int, strength: float) -> np.ndarray:
         """
         إزالة الضوضاء من الصوت
         Remove noise from audio
+        
+        'streaming' (default) gates overlapping blocks against a noise profile
+        estimated once; 'full' hands the whole buffer to noisereduce.
         """
         try:
-            # تحويل إلى float32
-            samples_float = samples.astype(np.float32)
+            if self.settings.get('noise_reduction_mode', 'streaming') == 'streaming' and SCIPY_AVAILABLE:
+                gate = audio_dsp.SpectralGate(
+                    sample_rate, strength,
+                    block_seconds=self.settings.get('noise_reduction_block_seconds', 10.0)
+                )
+                return gate.process(samples, workers=self.settings.get('noise_reduction_workers', 1))
             
-            # تطبيق إزالة الضوضاء
+            if not NOISEREDUCE_AVAILABLE:
+                return samples
+            
+            # noisereduce يتوقع (قنوات، عينات)
             reduced = nr.reduce_noise(
-                y=samples_float,
+                y=samples.T if samples.shape[1] > 1 else samples[:, 0],
                 sr=sample_rate,
                 prop_decrease=strength,
                 stationary=True
             )
-            
-            return reduced.astype(samples.dtype)
+            return np.asarray(reduced, dtype=np.float32).reshape(samples.shape[::-1]).T.copy()
         except Exception as e:
             logger.error(f"خطأ في إزالة الضوضاء: {str(e)}")
             return samples
     
-    def _apply_equalizer(self, audio: 'AudioSegment') -> 'AudioSegment':
+    def _apply_equalizer(self, samples: np.ndarray, sample_rate: int, gain_db: float = 0.0) -> np.ndarray:
         """
-        تطبيق معادل الصوت
-        Apply audio equalizer
+        تطبيق معادل الصوت (رفوف ونطاق متوسط) مع كسب الدخول
+        Apply the shelf/peaking EQ bank together with the input gain
         """
         try:
-            eq_settings = self.settings.get('eq_settings', {})
-            
-            # تعزيز الترددات المنخفضة (bass)
-            low_shelf = eq_settings.get('low_shelf', {})
-            if low_shelf:
-                audio = audio.low_pass_filter(low_shelf.get('freq', 100))
-            
-            # تعزيز الترددات العالية (treble)
-            high_shelf = eq_settings.get('high_shelf', {})
-            if high_shelf:
-                audio = audio.high_pass_filter(high_shelf.get('freq', 8000))
-            
-            return audio
+            return audio_dsp.equalize(samples, sample_rate, self.settings.get('eq_settings', {}), gain_db)
         except Exception as e:
             logger.error(f"خطأ في تطبيق المعادل: {str(e)}")
-            return audio
+            return audio_dsp.apply_gain(samples, gain_db)
+    
+    def _reverb_engine(self, sample_rate: int, room_size: Optional[float] = None) -> 'audio_dsp.ReverbEngine':
+        """محرك الصدى حسب الإعدادات (الاستجابة النبضية مخزنة مؤقتاً لكل معدل عينات)"""
+        return audio_dsp.ReverbEngine(
+            sample_rate,
+            room_size=self.settings.get('reverb_room_size', 0.3) if room_size is None else room_size,
+            wet=self.settings.get('reverb_wet', 0.2),
+            impulse_path=self.settings.get('reverb_impulse')
+        )
     
     def add_reverb(self, audio_path: str, room_size: float = 0.3) -> str:
         """
@@ -198,36 +216,12 @@ class AudioEnhancer:
         try:
             logger.info("إضافة صدى خفيف...")
             
-            audio = AudioSegment.from_file(audio_path)
-            samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
-            
-            # إنشاء مرشح صدى بسيط
-            delay_samples = int(audio.frame_rate * 0.05)  # تأخير 50 مللي ثانية
-            decay = room_size
-            
-            reverb_samples = np.zeros(len(samples) + delay_samples)
-            reverb_samples[:len(samples)] = samples
-            reverb_samples[delay_samples:] += samples * decay
-            
-            # قص إلى الطول الأصلي
-            reverb_samples = reverb_samples[:len(samples)]
-            
-            # إعادة التطبيع
-            reverb_samples = reverb_samples / np.max(np.abs(reverb_samples))
-            reverb_samples = (reverb_samples * 32767).astype(np.int16)
-            
-            result = AudioSegment(
-                reverb_samples.tobytes(),
-                frame_rate=audio.frame_rate,
-                sample_width=2,
-                channels=audio.channels
-            )
+            samples, sample_rate, sample_width = audio_dsp.decode(audio_path)
+            samples = self._reverb_engine(sample_rate, room_size).apply(samples)
             
             base, ext = os.path.splitext(audio_path)
             output_path = f"{base}_reverb{ext}"
-            result.export(output_path, format=ext[1:])
-            
-            return output_path
+            return audio_dsp.encode(samples, sample_rate, output_path, sample_width)
             
         except Exception as e:
             logger.error(f"خطأ في إضافة الصدى: {str(e)}")
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+قياس أداء مراحل المعالجة المحلية
+Benchmarks for local processing stages
+
+Usage:
+    python benchmark.py stabilization [--width 1920 --height 1080 --frames 120]
+    python benchmark.py color [--width 1920 --height 1080 --frames 120]
+    python benchmark.py ken_burns [--width 1920 --height 1080 --frames 120 --repeats 5]
+    python benchmark.py audio [--seconds 120 --sample-rate 24000]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import config
+
+# أدنى نسبة مقبولة لسرعة محرك Ken Burns مقارنة بالقص والتحجيم القديم (هامش للضجيج)
+KEN_BURNS_MIN_SPEED = 0.85
+
+
+def _synthetic_shaky_frames(width, height, count, seed=0):
+    """توليد إطارات اختبارية مهتزة من صورة ذات تفاصيل"""
+    import cv2
+    
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 255, (height + 80, width + 80, 3), dtype=np.uint8)
+    base = cv2.GaussianBlur(base, (0, 0), 3)
+    for _ in range(40):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.circle(base, center, int(rng.integers(10, 60)), color, -1)
+    
+    frames = []
+    for i in range(count):
+        jitter_x, jitter_y = rng.normal(0, 4, 2)
+        x = int(np.clip(40 + i * 0.2 + jitter_x, 0, 80))
+        y = int(np.clip(40 + jitter_y, 0, 80))
+        frames.append(np.ascontiguousarray(base[y:y + height, x:x + width]))
+    return frames
+
+
+def _fps(label, count, seconds):
+    fps = count / seconds if seconds > 0 else float('inf')
+    print(f"{label:<40} {fps:8.1f} fps  ({seconds * 1000 / count:6.2f} ms/frame)")
+    return fps
+
+
+def bench_stabilization(args):
+    """سرعة التثبيت مقارنة بباقي مراحل التحسين"""
+    from video_enhancer import VideoEnhancer, VideoStabilizer
+    
+    settings = dict(getattr(config, 'LOCAL_VIDEO_ENHANCEMENT', {}))
+    frames = _synthetic_shaky_frames(args.width, args.height, args.frames)
+    print(f"Frames: {len(frames)} @ {args.width}x{args.height}")
+    
+    stabilizer = VideoStabilizer(
+        args.width, args.height,
+        radius=settings.get('stabilization_radius', 12),
+        analysis_width=settings.get('stabilization_analysis_width', 320),
+        crop=settings.get('stabilization_crop', 1.04)
+    )
+    start = time.perf_counter()
+    emitted = 0
+    for frame in frames:
+        emitted += len(stabilizer.push(frame))
+    emitted += len(stabilizer.flush())
+    _fps("stabilization only", emitted, time.perf_counter() - start)
+    
+    enhancer = VideoEnhancer(dict(settings, denoise=False))
+    start = time.perf_counter()
+    for frame in frames:
+        enhancer._enhance_frame(frame)
+    _fps("per-frame enhancements (no denoise)", len(frames), time.perf_counter() - start)
+
+
+def bench_color(args):
+    """تصحيح الألوان: CLAHE كامل الدقة مقابل التحليل المصغر"""
+    from video_enhancer import VideoEnhancer
+    
+    frames = _synthetic_shaky_frames(args.width, args.height, args.frames)
+    print(f"Frames: {len(frames)} @ {args.width}x{args.height}")
+    
+    for mode in ('full', 'proxy'):
+        enhancer = VideoEnhancer({'color_analysis_mode': mode})
+        enhancer._color_corrector = enhancer._create_color_corrector()
+        start = time.perf_counter()
+        for frame in frames:
+            enhancer._color_correction(frame)
+        _fps(f"color correction ({mode})", len(frames), time.perf_counter() - start)
+
+
+def bench_ken_burns(args):
+    """Ken Burns: القص والتحجيم عبر MoviePy مقابل المحرك الموحد"""
+    import cv2
+    from moviepy.editor import ImageClip
+    from ken_burns import KenBurnsEngine
+    
+    source = cv2.cvtColor(_synthetic_shaky_frames(1792, 1024, 1)[0], cv2.COLOR_BGR2RGB)
+    fps = config.VIDEO_FPS
+    duration = args.frames / float(fps)
+    zoom = 1.15
+    times = [i / float(fps) for i in range(args.frames)]
+    print(f"Frames: {args.frames} @ {args.width}x{args.height} from a 1792x1024 still")
+    
+    def legacy_effect(get_frame, t):
+        frame = get_frame(t)
+        current_zoom = 1 + (zoom - 1) * (t / duration)
+        h, w = frame.shape[:2]
+        new_h, new_w = int(h / current_zoom), int(w / current_zoom)
+        y1, x1 = (h - new_h) // 2, (w - new_w) // 2
+        return cv2.resize(frame[y1:y1 + new_h, x1:x1 + new_w], (w, h), interpolation=cv2.INTER_LINEAR)
+    
+    def timed(clip):
+        start = time.perf_counter()
+        for t in times:
+            clip.get_frame(t)
+        return time.perf_counter() - start
+    
+    legacy = ImageClip(source, duration=duration).resize((args.width, args.height)).fl(legacy_effect)
+    clip = KenBurnsEngine(args.width, args.height, zoom).image_clip(source, duration, fps)
+    # جولات متناوبة وأفضل زمن لكل مسار حتى لا يحسم ضجيج الجهاز المقارنة
+    rounds = [(timed(legacy), timed(clip)) for _ in range(args.repeats)]
+    legacy_fps = _fps("legacy crop + resize (moviepy)", args.frames, min(r[0] for r in rounds))
+    engine_fps = _fps("engine, precomputed matrices", args.frames, min(r[1] for r in rounds))
+    
+    if engine_fps < legacy_fps * KEN_BURNS_MIN_SPEED:
+        raise SystemExit(f"Ken Burns engine regressed: {engine_fps:.1f} fps vs legacy {legacy_fps:.1f} fps")
+
+
+def _synthetic_recitation(seconds, sample_rate, seed=0):
+    """توليد إشارة شبيهة بالتلاوة: نغمات متغيرة بمقاطع عالية ومنخفضة"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / float(sample_rate)
+    pitch = 140 + 40 * np.sin(2 * np.pi * 0.3 * t)
+    voice = sum(np.sin(2 * np.pi * k * np.cumsum(pitch) / sample_rate) / k for k in range(1, 6))
+    envelope = 0.05 + 0.4 * (np.sin(2 * np.pi * 0.5 * t) > 0)
+    samples = voice * envelope / 3 + rng.normal(0, 0.01, t.size)
+    return np.clip(samples, -1, 1).astype(np.float32)[:, None]
+
+
+def bench_audio(args):
+    """تحسين الصوت: سلسلة pydub السابقة مقابل السلسلة المتجهة"""
+    import os
+    import tempfile
+    from pydub import AudioSegment
+    from pydub.effects import normalize, compress_dynamic_range
+    import audio_dsp
+    from audio_enhancer import AudioEnhancer
+    
+    # إزالة الضوضاء مشتركة بين المسارين، لذا تستبعد من المقارنة
+    settings = dict(getattr(config, 'LOCAL_AUDIO_ENHANCEMENT', {}), noise_reduction=False)
+    eq = settings.get('eq_settings', {})
+    print(f"Audio: {args.seconds}s mono @ {args.sample_rate} Hz (noise reduction excluded)")
+    
+    def legacy(input_path, output_path):
+        audio = AudioSegment.from_file(input_path)
+        samples = np.array(audio.get_array_of_samples())
+        audio = AudioSegment(samples.tobytes(), frame_rate=audio.frame_rate,
+                             sample_width=audio.sample_width, channels=audio.channels)
+        audio = normalize(audio)
+        audio = compress_dynamic_range(audio, threshold=settings.get('compressor_threshold', -20),
+                                       ratio=settings.get('compressor_ratio', 4))
+        audio = audio.low_pass_filter(eq.get('low_shelf', {}).get('freq', 100))
+        audio = audio.high_pass_filter(eq.get('high_shelf', {}).get('freq', 8000))
+        audio = audio.fade_in(int(settings.get('fade_in', 0.5) * 1000))
+        audio = audio.fade_out(int(settings.get('fade_out', 0.5) * 1000))
+        audio.export(output_path, format='wav')
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'source.wav')
+        samples = _synthetic_recitation(args.seconds, args.sample_rate)
+        audio_dsp.encode(samples, args.sample_rate, source)
+        
+        for label, run in (
+            ("legacy pydub chain", lambda out: legacy(source, out)),
+            ("vectorized float32 chain", lambda out: AudioEnhancer(settings).enhance(source, out)),
+        ):
+            start = time.perf_counter()
+            run(os.path.join(tmp, 'out.wav'))
+            seconds = time.perf_counter() - start
+            print(f"{label:<40} {seconds:8.2f} s  ({args.seconds / seconds:7.1f}x realtime)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hadith video generator benchmarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    stab = subparsers.add_parser('stabilization', help='video stabilization throughput')
+    stab.add_argument('--width', type=int, default=config.VIDEO_WIDTH)
+    stab.add_argument('--height', type=int, default=config.VIDEO_HEIGHT)
+    stab.add_argument('--frames', type=int, default=120)
+    stab.set_defaults(func=bench_stabilization)
+    
+    color = subparsers.add_parser('color', help='colour correction: full-res CLAHE vs proxy analysis')
+    color.add_argument('--width', type=int, default=config.VIDEO_WIDTH)
+    color.add_argument('--height', type=int, default=config.VIDEO_HEIGHT)
+    color.add_argument('--frames', type=int, default=120)
+    color.set_defaults(func=bench_color)
+    
+    ken_burns = subparsers.add_parser('ken_burns', help='Ken Burns: legacy crop/resize vs unified engine')
+    ken_burns.add_argument('--width', type=int, default=config.VIDEO_WIDTH)
+    ken_burns.add_argument('--height', type=int, default=config.VIDEO_HEIGHT)
+    ken_burns.add_argument('--frames', type=int, default=120)
+    ken_burns.add_argument('--repeats', type=int, default=5)
+    ken_burns.set_defaults(func=bench_ken_burns)
+    
+    audio = subparsers.add_parser('audio', help='audio enhancement: pydub chain vs vectorized chain')
+    audio.add_argument('--seconds', type=float, default=120)
+    audio.add_argument('--sample-rate', type=int, default=24000)
+    audio.set_defaults(func=bench_audio)
+    
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+أداة تسخين التخزين المؤقت وتصديره واستيراده
+Cache warming, export and import
+
+Warming runs the normal pipeline functions for each hadith, so it fills
+exactly the entries a request would: search results (CacheManager), the
+synthesized and enhanced speech (tts_audio, tts_phrases) and the rendered
+text overlays (stage_overlay). An archive carries all of them to another
+node, which then serves its first requests without calling dorar.net,
+Pexels or the TTS providers.
+
+Usage:
+    python cache_tool.py warm KEYWORD [KEYWORD#ID ...] [--file keywords.txt] [--limit 10]
+                                     [--no-audio] [--no-overlays]
+    python cache_tool.py export ARCHIVE [--compress]
+    python cache_tool.py import ARCHIVE [--overwrite]
+    python cache_tool.py status
+
+A target is a search keyword, optionally followed by #ID to warm a single
+result of that search (the 'id' field returned by /api/search).
+"""
+
+import argparse
+import json
+import os
+import sys
+
+
+def _read_targets(args):
+    """الكلمات من سطر الأوامر ومن الملف (سطر لكل كلمة، # للتعليقات في أول السطر)"""
+    targets = list(args.targets)
+    if args.file:
+        with open(args.file, 'r', encoding='utf-8') as f:
+            targets.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    return targets
+
+
+def _narration_length(audio_path, default=60.0):
+    """مدة التلاوة من توقيتات الكلمات، لتغطية كل العبارات المتزامنة"""
+    from tts_service import load_timings
+    
+    timings = load_timings(audio_path) if audio_path else None
+    ends = [word['end'] for word in (timings or {}).get('words', [])]
+    return max(ends) + 1.0 if ends else default
+
+
+def warm(args):
+    """تسخين البحث والصوت والطبقات النصية لكل هدف"""
+    import main
+    
+    targets = _read_targets(args)
+    if not targets:
+        sys.exit('no keywords given')
+    
+    totals = {'hadiths': 0, 'audio': 0, 'overlays': 0, 'failed': 0}
+    with main.job_work_dir() as work_dir:
+        audio_path = os.path.join(work_dir, 'audio.mp3')
+        for target in targets:
+            keyword, _, hadith_id = target.partition('#')
+            hadiths = main.search_hadith(keyword.strip())
+            if hadith_id:
+                hadiths = [h for h in hadiths if h.get('id') == hadith_id.strip()]
+            print(f"{target}: {len(hadiths)} result(s)")
+            
+            for hadith in hadiths[:args.limit]:
+                totals['hadiths'] += 1
+                audio = None
+                if not args.no_audio:
+                    audio = main.generate_audio(None, audio_path, hadith_data=hadith)
+                    if audio:
+                        totals['audio'] += 1
+                    else:
+                        totals['failed'] += 1
+                if not args.no_overlays:
+                    clips = main.create_text_clips(hadith, audio, _narration_length(audio), work_dir)
+                    totals['overlays'] += len(clips)
+    print(json.dumps(totals))
+
+
+def export(args):
+    """تصدير كل المخازن إلى أرشيف واحد"""
+    from performance_manager import export_cache_archive
+    
+    counts = export_cache_archive(args.archive, compress=args.compress)
+    print(f"exported to {args.archive}: {json.dumps(counts)}")
+
+
+def import_(args):
+    """استيراد أرشيف مصدر"""
+    from performance_manager import import_cache_archive
+    
+    counts = import_cache_archive(args.archive, overwrite=args.overwrite)
+    print(f"imported from {args.archive}: {json.dumps(counts)}")
+
+
+def status(args):
+    """أحجام المخازن وعدد مرات الاستخدام"""
+    from performance_manager import cache_manager, cache_stores
+    
+    report = {'cache': cache_manager.index.stats()}
+    report.update({namespace: store.stats() for namespace, store in cache_stores().items()})
+    print(json.dumps(report, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hadith video generator cache tool')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    warm_parser = subparsers.add_parser('warm', help='pre-warm caches from keywords or KEYWORD#ID targets')
+    warm_parser.add_argument('targets', nargs='*')
+    warm_parser.add_argument('--file', help='file with one target per line')
+    warm_parser.add_argument('--limit', type=int, default=10, help='results warmed per keyword')
+    warm_parser.add_argument('--no-audio', action='store_true', help='skip speech synthesis')
+    warm_parser.add_argument('--no-overlays', action='store_true', help='skip text overlay rendering')
+    warm_parser.set_defaults(func=warm)
+    
+    export_parser = subparsers.add_parser('export', help='write every cache into one archive')
+    export_parser.add_argument('archive')
+    export_parser.add_argument('--compress', action='store_true', help='gzip the archive')
+    export_parser.set_defaults(func=export)
+    
+    import_parser = subparsers.add_parser('import', help='load an exported archive')
+    import_parser.add_argument('archive')
+    import_parser.add_argument('--overwrite', action='store_true', help='replace existing entries')
+    import_parser.set_defaults(func=import_)
+    
+    status_parser = subparsers.add_parser('status', help='cache sizes and hit counts')
+    status_parser.set_defaults(func=status)
+    
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
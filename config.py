@@ -94,6 +94,43 @@ PERFORMANCE_SETTINGS = {
     'retry_delay': 2,
     'enable_compression': True,
     'memory_limit_mb': 2048,
+    'memory_cache_mb': 256,  # ميزانية طبقة الذاكرة في CacheManager (ضمن memory_limit_mb)
+    'cache_memory_threshold_kb': 256,  # العناصر الأكبر تقرأ من القرص ولا تحفظ في الذاكرة
+    'search_cache_hours': 24,  # مدة تخزين نتائج البحث في الدرر
+    'use_x_sendfile': False,  # ترك إرسال الملفات لخادم الويب الأمامي (nginx/Apache) عبر X-Sendfile
+}
+
+# مجدول إزالة العناصر المنتهية في الخلفية - Background expiry sweeper
+CACHE_SWEEPER = {
+    'enabled': True,
+    'rescan_interval': 600,         # اكتشاف الملفات الجديدة على القرص (ثانية)
+    'batch_size': 500,              # أقصى عدد من العناصر في كل دورة
+    'job_retention_hours': 24,      # مدة الاحتفاظ بسجلات المهام
+    'bg_video_ttl_hours': 24,       # صلاحية فيديوهات الخلفية المخزنة
+    'temp_retention_hours': 6,      # مدة الاحتفاظ بالملفات المؤقتة
+    'output_retention_hours': None, # مدة الاحتفاظ بالفيديوهات النهائية (None = دائماً)
+    'final_stage_retention_hours': 72,  # مدة الاحتفاظ بالفيديوهات النهائية في مخزن المراحل
+}
+
+# سجل المهام الدائم المشترك بين العمال - Durable job queue shared by all workers
+JOB_QUEUE = {
+    'db_path': 'cache/jobs.db',  # قاعدة SQLite للمهام (خارج المجلد المؤقت)
+    'lease_seconds': 120,        # مدة عقد العامل على المهمة قبل اعتبارها يتيمة
+    'heartbeat_interval': 30,    # تجديد العقود كل (ثانية)
+    'poll_interval': 5,          # فحص المهام المنتظرة واليتيمة كل (ثانية)
+    'max_attempts': 3,           # أقصى عدد لإعادة تشغيل مهمة توقف عاملها
+    'worker_mode': 'thread',     # 'thread' داخل عملية الخادم أو 'process' عمليات عرض مستقلة
+    'worker_max_jobs': 20,       # إعادة تشغيل عملية العرض بعد هذا العدد من المهام (تسرب moviepy)
+    'worker_memory_limit_mb': 0,     # حد مساحة العناوين (RLIMIT_AS) لكل عملية عرض وليس الذاكرة الفعلية (0 = بلا حد)
+    'worker_recycle_rss_mb': 2048,   # إعادة تشغيل عملية العرض إذا تجاوزت ذروة ذاكرتها هذا الحد
+}
+
+# ===========================
+# Stage Scheduler - جدولة مراحل المعالجة
+# ===========================
+STAGE_SCHEDULER = {
+    'io_workers': 8,             # خيوط المراحل الشبكية (الصوت وتحميل الخلفية) لكل عملية
+    'cpu_workers': 2,            # خيوط المراحل الثقيلة (التحسين والتركيب) لكل عملية
 }
 
 # ===========================
@@ -154,8 +191,12 @@ LOCAL_AUDIO_ENHANCEMENT = {
     'enabled': True,                    # تفعيل التحسين المحلي
     'noise_reduction': True,            # إزالة الضوضاء
     'noise_reduction_strength': 0.7,    # قوة إزالة الضوضاء (0.0-1.0)
+    'noise_reduction_mode': 'streaming', # 'streaming' على كتل أو 'full' عبر noisereduce
+    'noise_reduction_block_seconds': 10.0, # طول الكتلة في وضع البث (ثواني)
+    'noise_reduction_workers': 2,       # عدد خيوط معالجة الكتل
     'normalize': True,                  # تطبيع مستوى الصوت
     'target_loudness': -16.0,           # مستوى الصوت المستهدف (LUFS)
+    'peak_ceiling': -1.0,               # الحد الأقصى للقمة بعد التطبيع (dBFS)
     'compressor': True,                 # ضغط النطاق الديناميكي
     'compressor_threshold': -20,        # عتبة الضغط (dB)
     'compressor_ratio': 4,              # نسبة الضغط
@@ -167,6 +208,8 @@ LOCAL_AUDIO_ENHANCEMENT = {
     },
     'reverb': False,                    # إضافة صدى خفيف
     'reverb_room_size': 0.3,           # حجم الغرفة للصدى
+    'reverb_wet': 0.2,                  # نسبة الصدى في المزيج (0.0-1.0)
+    'reverb_impulse': None,             # ملف استجابة نبضية اختياري بدلاً من الغرفة المولدة
     'fade_in': 0.5,                     # تلاشي الدخول (ثواني)
     'fade_out': 0.5                     # تلاشي الخروج (ثواني)
 }
@@ -177,7 +220,14 @@ LOCAL_AUDIO_ENHANCEMENT = {
 LOCAL_VIDEO_ENHANCEMENT = {
     'enabled': True,                    # تفعيل التحسين المحلي
     'stabilization': True,              # تثبيت الفيديو
+    'stabilization_radius': 12,         # نصف نافذة تنعيم مسار الكاميرا (إطارات)
+    'stabilization_analysis_width': 320, # عرض الإطار المصغر لتقدير الحركة
+    'stabilization_crop': 1.04,         # تكبير خفيف لإخفاء حواف التثبيت
     'color_correction': True,           # تصحيح الألوان
+    'color_analysis_mode': 'proxy',     # proxy: تحليل مصغر كل عدة إطارات، full: CLAHE لكل إطار
+    'color_analysis_width': 480,        # عرض النسخة المصغرة للتحليل
+    'color_analysis_interval': 30,      # إعادة التحليل كل N إطار
+    'scene_change_threshold': 0.4,      # حد اكتشاف تغير المشهد (0.0-1.0)
     'brightness': 1.05,                 # سطوع (1.0 = طبيعي)
     'contrast': 1.1,                    # تباين (1.0 = طبيعي)
     'saturation': 1.15,                 # تشبع الألوان (1.0 = طبيعي)
@@ -257,6 +307,19 @@ TTS_SLOW = False
 EDGE_TTS_VOICE = 'ar-SA-HamedNeural'  # صوت سعودي واضح جداً
 EDGE_TTS_RATE = '-15%'  # أبطأ للوضوح والفهم
 EDGE_TTS_PITCH = '-2Hz'  # طبقة طبيعية
+EDGE_TTS_MAX_CONCURRENCY = 4  # أقصى عدد من طلبات Edge TTS المتزامنة
+EDGE_TTS_TIMEOUT = 60  # مهلة الطلب الواحد (ثانية)
+
+# توجيه مزودي الصوت: طلب تحوطي للمزود التالي بعد زمن p95 للمزود الحالي
+TTS_ROUTER = {
+    'window': 50,                # عدد الطلبات الأخيرة المحسوبة لكل مزود
+    'min_delay': 1.0,            # أقل مهلة قبل الطلب التحوطي (ثانية)
+    'max_delay': 20.0,           # أقصى مهلة قبل الطلب التحوطي (ثانية)
+    'default_delay': 8.0,        # المهلة قبل توفر قياسات كافية (ثانية)
+    'error_threshold': 0.5,      # نسبة الأخطاء التي تؤخر المزود في الترتيب
+    'hedge': False,              # بدء المزود التالي (الأقل جودة) بعد مهلة التحوط دون انتظار المهلة الكاملة
+    'attempt_timeout': 60.0      # الانتقال للمزود التالي إذا تجاوزت المحاولة هذه المدة (ثانية)
+}
 
 # إعدادات البحث في Pexels - Pexels Search Settings
 PEXELS_SEARCH_QUERIES = [
@@ -279,6 +342,22 @@ PEXELS_MUSIC_QUERIES = [
     'relaxing piano'
 ]
 
+# خلفية موسيقية مخفضة تحت التلاوة - Music bed ducked under the narration
+# ملفات الموسيقى توضع في source_folder (مجلد فرعي باسم كل استعلام أعلاه)
+MUSIC_BED = {
+    'enabled': True,                # تفعيل المزج (لا أثر إذا كانت المكتبة فارغة)
+    'source_folder': 'music',       # مجلد ملفات الموسيقى المصدرية
+    'sample_rate': 24000,           # معدل العينات في المكتبة
+    'library_loudness': -20.0,      # جهارة الخلفيات المخزنة (LUFS)
+    'volume': -14.0,                # مستوى الموسيقى في الصمت (dB)
+    'duck_db': 10.0,                # خفض إضافي أثناء الكلام (dB)
+    'duck_threshold': -40.0,        # عتبة اكتشاف الكلام (dBFS)
+    'duck_attack_ms': 80.0,         # بدء الخفض قبل الكلام
+    'duck_release_ms': 600.0,       # عودة الموسيقى بعد الكلام
+    'fade': 2.0,                    # تلاشي الموسيقى في البداية والنهاية (ثواني)
+    'loop_crossfade': 1.0           # تداخل عند تكرار الخلفية القصيرة (ثواني)
+}
+
 # إعدادات تأثيرات الفيديو - Video Effects Settings
 VIDEO_EFFECTS = {
     'fade_duration': 2.0,        # مدة تأثير الظهور/الاختفاء أطول
@@ -310,6 +389,8 @@ HADITH_DISPLAY = {
     'source_prefix': 'المحدث',     # نص قبل اسم المحدث
     'grade_prefix': 'الحكم',       # نص قبل درجة الصحة
     'info_separator': ' - ',       # فاصل بين المعلومات
+    'text_sync': 'phrases',       # phrases: عرض النص عبارة بعبارة مع القراءة، static: النص كاملاً
+    'phrase_max_chars': 60,       # أقصى طول للعبارة المعروضة
 }
 
 # إعدادات قراءة الصوت - Audio Reading Settings
@@ -321,11 +402,14 @@ AUDIO_READING = {
     'narrator_intro': 'رواه',      # مقدمة الراوي
     'grade_intro': 'والحديث',      # مقدمة الحكم
     'pause_duration': 0.8,        # مدة الوقفة بين الأجزاء (ثانية)
+    'segmented': True,            # توليد كل جزء على حدة مع تخزين العبارات الثابتة
+    'max_parallel_segments': 4,   # أقصى عدد من الأجزاء المولدة في نفس الوقت
 }
 
 # إعدادات المجلدات - Folder Settings
 TEMP_FOLDER = 'temp'
 OUTPUT_FOLDER = 'outputs'
+CACHE_FOLDER = 'cache'  # مخزن دائم للنتائج المحسوبة (لا يُمسح مع المجلد المؤقت)
 
 # إعدادات السجل - Logging Settings
 LOG_FILE = 'hadith_video_generator.log'
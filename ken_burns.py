@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+محرك تأثير Ken Burns - Ken Burns Effect Engine
+
+All zoom/pan variants are expressed as one affine transform per output
+frame. The matrices are precomputed for the whole clip and each frame is
+rendered in a single pass into a new frame. cv2.resize only maps whole
+pixels, so each frame is resized from an integer source window into a
+slightly larger image (up to _RESIZE_MARGIN extra pixels per axis) whose
+size and slice are chosen so the result matches the matrix to within
+_SUBPIXEL_TOLERANCE of a pixel: zooms and pans keep their sub-pixel
+motion at the cost of one resize. Matrices no resize can reproduce
+(rotation, or a fractional pan within _UNITY_BAND of 1:1 scale, which
+_prescale keeps image sources out of) fall back to warpAffine, which is
+several times slower.
+"""
+
+import math
+import logging
+import numpy as np
+from typing import Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# أقصى خطأ (بالبكسل) مسموح عند استبدال warpAffine بـ cv2.resize
+_SUBPIXEL_TOLERANCE = 0.1
+# أقصى عدد بكسلات إضافية لكل محور في صورة cv2.resize قبل القص
+_RESIZE_MARGIN = 32
+# قرب النسبة 1:1 لا تكفي الهوامش لإزاحة كسرية؛ التحجيم المسبق يبقي المصدر خارج هذا النطاق
+_UNITY_BAND = 0.05
+# علامة "لم تحسب الخطة بعد" في render
+_UNPLANNED = object()
+
+# محاولة استيراد OpenCV
+try:
+    import cv2
+    CV2_AVAILABLE = True
+except ImportError:
+    CV2_AVAILABLE = False
+
+# محاولة استيراد Pillow (للبديل عند غياب OpenCV ولفك ترميز الصور)
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+
+class KenBurnsEngine:
+    """
+    محرك موحد لتأثير Ken Burns (تكبير وتحريك)
+    Unified Ken Burns engine (zoom and pan)
+    
+    Directions:
+        zoom_in   - تكبير تدريجي من 1.0 إلى zoom
+        zoom_out  - تصغير تدريجي من zoom إلى 1.0
+        pan_left  - تحريك أفقي بتكبير ثابت
+        pan_right - تحريك أفقي بالاتجاه المعاكس
+    """
+    
+    DIRECTIONS = ('zoom_in', 'zoom_out', 'pan_left', 'pan_right')
+    
+    def __init__(self, width: int, height: int, zoom: float = 1.1,
+                 direction: str = 'zoom_in', pan_zoom: float = 1.1):
+        if direction not in self.DIRECTIONS:
+            raise ValueError(f"اتجاه غير مدعوم: {direction}")
+        self.width = int(width)
+        self.height = int(height)
+        self.zoom = max(1.0, float(zoom))
+        self.direction = direction
+        self.pan_zoom = max(1.0, float(pan_zoom))
+    
+    @classmethod
+    def for_index(cls, index: int, width: int, height: int, zoom: float = 1.1) -> 'KenBurnsEngine':
+        """تنويع الاتجاه حسب ترتيب المقطع"""
+        return cls(width, height, zoom, cls.DIRECTIONS[index % len(cls.DIRECTIONS)])
+    
+    def matrices(self, frame_count: int, source_size: Optional[tuple] = None) -> np.ndarray:
+        """
+        حساب مصفوفات التحويل لكل الإطارات دفعة واحدة
+        Precompute inverse affine matrices (output -> source) for every frame
+        
+        Args:
+            frame_count: عدد الإطارات
+            source_size: أبعاد المصدر (عرض، ارتفاع)، افتراضياً أبعاد الإخراج
+        
+        Returns:
+            مصفوفة بالشكل (frame_count, 2, 3)
+        """
+        w, h = self.width, self.height
+        src_w, src_h = source_size or (w, h)
+        progress = np.linspace(0.0, 1.0, max(1, frame_count)) if frame_count > 1 else np.zeros(1)
+        
+        if self.direction == 'zoom_in':
+            zoom = 1 + (self.zoom - 1) * progress
+        elif self.direction == 'zoom_out':
+            zoom = self.zoom - (self.zoom - 1) * progress
+        else:
+            zoom = np.full_like(progress, self.pan_zoom)
+        
+        # نافذة القص داخل إطار بأبعاد الإخراج
+        crop_w = w / zoom
+        crop_h = h / zoom
+        if self.direction == 'pan_left':
+            x1 = (w - crop_w) * progress
+        elif self.direction == 'pan_right':
+            x1 = (w - crop_w) * (1 - progress)
+        else:
+            x1 = (w - crop_w) / 2
+        y1 = (h - crop_h) / 2
+        
+        # تحويل إحداثيات الإخراج إلى إحداثيات المصدر (مع مراعاة مراكز البكسلات)
+        sx = src_w / float(w)
+        sy = src_h / float(h)
+        result = np.zeros((len(progress), 2, 3), dtype=np.float32)
+        result[:, 0, 0] = sx / zoom
+        result[:, 0, 2] = sx * (x1 + 0.5 / zoom) - 0.5
+        result[:, 1, 1] = sy / zoom
+        result[:, 1, 2] = sy * (y1 + 0.5 / zoom) - 0.5
+        return result
+    
+    def plan(self, matrix: np.ndarray, source_size: tuple) -> Optional[tuple]:
+        """
+        خطة cv2.resize لمصفوفة واحدة، أو None إذا لزم warpAffine
+        Resize plan for one matrix and (width, height) source, or None
+        """
+        if matrix[0, 1] != 0 or matrix[1, 0] != 0:
+            return None
+        x_plan = self._resize_plan(matrix[0, 0], matrix[0, 2], self.width, source_size[0])
+        y_plan = self._resize_plan(matrix[1, 1], matrix[1, 2], self.height, source_size[1])
+        return (x_plan, y_plan) if x_plan and y_plan else None
+    
+    def render(self, source: np.ndarray, matrix: np.ndarray, plan: Optional[tuple] = _UNPLANNED) -> np.ndarray:
+        """
+        رسم إطار واحد من المصدر
+        Render one frame from the source
+        
+        plan is plan(matrix, source size), computed here when omitted; the
+        clip builders precompute it with the matrices. Every call returns a
+        new array (possibly a view into a slightly larger resize result),
+        so frames stay valid after the next call.
+        """
+        if not CV2_AVAILABLE:
+            return self._render_pil(source, matrix)
+        
+        if plan is _UNPLANNED:
+            plan = self.plan(matrix, (source.shape[1], source.shape[0]))
+        
+        if plan:
+            # تكبير وتحريك فقط: cv2.resize أسرع بعدة مرات من warpAffine بنفس الدقة تقريباً
+            (x0, width, resized_w, left), (y0, height, resized_h, top) = plan
+            src_h, src_w = source.shape[:2]
+            window = source[max(0, y0):min(src_h, y0 + height), max(0, x0):min(src_w, x0 + width)]
+            if x0 < 0 or y0 < 0 or x0 + width > src_w or y0 + height > src_h:
+                # النافذة تتجاوز حافة المصدر: تكرار الحافة كما يفعل BORDER_REPLICATE
+                window = cv2.copyMakeBorder(window, max(0, -y0), max(0, y0 + height - src_h),
+                                            max(0, -x0), max(0, x0 + width - src_w), cv2.BORDER_REPLICATE)
+            resized = cv2.resize(window, (resized_w, resized_h), interpolation=cv2.INTER_LINEAR)
+            return resized[top:top + self.height, left:left + self.width]
+        
+        return cv2.warpAffine(source, matrix, (self.width, self.height),
+                              flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REPLICATE)
+    
+    @staticmethod
+    def _resize_plan(scale: float, offset: float, out_size: int, src_size: int) -> Optional[tuple]:
+        """
+        خطة cv2.resize لمحور واحد تطابق التحويل بدقة أقل من بكسل
+        Resize plan for one axis, or None if none is accurate enough
+        
+        cv2.resize maps pixel x of a (start, length) window resized to
+        `size` to start + (x + 0.5) * length / size - 0.5. Resizing into a
+        few extra pixels and slicing from `skip` adds two more integers,
+        enough to land within _SUBPIXEL_TOLERANCE of scale * x + offset
+        over the whole output for most scales. Windows inside the source
+        are preferred; near its edges the window may overhang it and the
+        caller pads it by edge replication.
+        
+        Returns:
+            (start, length, size, skip) or None
+        """
+        margin = np.arange(_RESIZE_MARGIN + 1)
+        sizes = (out_size + margin)[:, None]
+        skips = margin[None, :]
+        lengths = np.maximum(1, np.round(scale * sizes))
+        steps = lengths / sizes
+        
+        origin = offset + 0.5 - (skips + 0.5) * steps
+        starts = np.round(origin)
+        error = origin - starts
+        # الخطأ خطي على امتداد الإطار: يكفي فحص طرفيه
+        error = np.maximum(np.abs(error), np.abs((steps - scale) * (out_size - 1) - error))
+        accurate = (error <= _SUBPIXEL_TOLERANCE) & (skips <= sizes - out_size) & (starts + lengths > 0) & (starts < src_size)
+        inside = accurate & (starts >= 0) & (starts + lengths <= src_size)
+        
+        for candidates in (inside, accurate):
+            rows = np.flatnonzero(candidates.any(axis=1))
+            if rows.size:
+                # أصغر صورة وسيطة تحقق الدقة المطلوبة
+                row = rows[0]
+                col = int(np.argmin(np.where(candidates[row], error[row], np.inf)))
+                return int(starts[row, col]), int(lengths[row, 0]), int(sizes[row, 0]), col
+        return None
+    
+    def _render_pil(self, source: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+        """بديل Pillow عند غياب OpenCV"""
+        a, b, c = matrix[0]
+        d, e, f = matrix[1]
+        # Pillow يطبق مراكز البكسلات داخلياً
+        c += 0.5 - 0.5 * (a + b)
+        f += 0.5 - 0.5 * (d + e)
+        img = Image.fromarray(source).transform(
+            (self.width, self.height), Image.AFFINE, (a, b, c, d, e, f), resample=Image.BILINEAR
+        )
+        return np.asarray(img)
+    
+    def apply_to_clip(self, clip, fps: Optional[float] = None):
+        """
+        تطبيق التأثير على مقطع MoviePy موجود
+        Apply the effect to an existing MoviePy clip
+        """
+        fps = fps or getattr(clip, 'fps', None) or config.VIDEO_FPS
+        duration = clip.duration
+        frame_count = max(1, int(math.ceil(duration * fps)) + 1)
+        src_w, src_h = clip.size
+        matrices = self.matrices(frame_count, (src_w, src_h))
+        plans = [self.plan(matrix, (src_w, src_h)) for matrix in matrices]
+        
+        def effect(get_frame, t):
+            index = min(frame_count - 1, int(round(t / duration * (frame_count - 1)))) if duration else 0
+            return self.render(get_frame(t), matrices[index], plans[index])
+        
+        return clip.fl(effect)
+    
+    def image_clip(self, image, duration: float, fps: Optional[float] = None):
+        """
+        إنشاء مقطع من صورة ثابتة مع فك ترميزها مرة واحدة فقط
+        Build a clip from a still image, decoding it once
+        
+        Args:
+            image: مسار الصورة أو مصفوفة RGB
+            duration: مدة المقطع بالثواني
+            fps: معدل الإطارات
+        """
+        from moviepy.editor import VideoClip
+        
+        fps = fps or config.VIDEO_FPS
+        source = load_image(image) if isinstance(image, str) else np.ascontiguousarray(image)
+        source = self._prescale(source)
+        
+        frame_count = max(1, int(math.ceil(duration * fps)) + 1)
+        matrices = self.matrices(frame_count, (source.shape[1], source.shape[0]))
+        plans = [self.plan(matrix, (source.shape[1], source.shape[0])) for matrix in matrices]
+        
+        def make_frame(t):
+            index = min(frame_count - 1, int(round(t / duration * (frame_count - 1)))) if duration else 0
+            return self.render(source, matrices[index], plans[index])
+        
+        clip = VideoClip(make_frame, duration=duration)
+        clip.fps = fps
+        return clip
+    
+    def _prescale(self, source: np.ndarray) -> np.ndarray:
+        """
+        تحجيم المصدر مرة واحدة قبل رسم الإطارات
+        Resize the source once before rendering its frames
+        
+        Sources larger than the output are worked at _UNITY_BAND below the
+        output size: downscaled once so the bilinear resampling does not
+        alias, and kept just off 1:1, where no resize plan exists and
+        frames would need warpAffine. Smaller sources are left as they are.
+        """
+        src_h, src_w = source.shape[:2]
+        new_size = (self._prescaled_length(src_w, self.width),
+                    self._prescaled_length(src_h, self.height))
+        if new_size == (src_w, src_h):
+            return source
+        
+        if CV2_AVAILABLE:
+            return cv2.resize(source, new_size, interpolation=cv2.INTER_AREA)
+        return np.asarray(Image.fromarray(source).resize(new_size, Image.Resampling.LANCZOS))
+    
+    @staticmethod
+    def _prescaled_length(src_size: int, out_size: int) -> int:
+        """طول محور المصدر بعد التحجيم المسبق"""
+        if src_size > out_size * (1 - _UNITY_BAND):
+            return int(out_size * (1 - _UNITY_BAND))
+        return src_size
+
+
+def load_image(path: str) -> np.ndarray:
+    """فك ترميز صورة إلى مصفوفة RGB - Decode an image to an RGB array"""
+    if PIL_AVAILABLE:
+        with Image.open(path) as img:
+            return np.asarray(img.convert('RGB'))
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"تعذر قراءة الصورة: {path}")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
@@ -11,8 +11,12 @@ import requests
 import shutil
 import random
 import re
+import io
 import json
 import time
+import threading
+import uuid
+from contextlib import contextmanager
 from datetime import datetime
 from flask import Flask, render_template, request, jsonify, send_file
 from gtts import gTTS
@@ -24,6 +28,8 @@ import arabic_reshaper
 from bidi.algorithm import get_display
 import numpy as np
 import config
+from ken_burns import KenBurnsEngine
+from stage_graph import StageGraph
 
 # إعداد نظام السجلات - Setup logging system
 logging.basicConfig(
@@ -75,12 +81,39 @@ except ImportError as e:
     logger.warning(f"مولدات AI غير متوفرة: {e}")
     AI_GENERATOR_AVAILABLE = False
 
+try:
+    from tts_service import (
+        SegmentedSynthesizer,
+        synthesize_segments,
+        edge_tts_service,
+        tts_router,
+        copy_timings,
+        load_timings,
+        group_phrases
+    )
+    TTS_SERVICE_AVAILABLE = True
+except ImportError as e:
+    logger.warning(f"خدمة تحويل النص إلى كلام غير متوفرة: {e}")
+    TTS_SERVICE_AVAILABLE = False
+
+try:
+    from music_bed import mix_music_bed, music_bed_signature
+    from moviepy.audio.AudioClip import AudioArrayClip
+    MUSIC_BED_AVAILABLE = True
+except ImportError as e:
+    logger.warning(f"الموسيقى الخلفية غير متوفرة: {e}")
+    MUSIC_BED_AVAILABLE = False
+
 # استيراد نظام إدارة الأداء
 try:
     from performance_manager import (
         cache_manager,
         async_video_generator,
         bg_video_cache,
+        enhanced_video_cache,
+        tts_audio_cache,
+        artifact_cache,
+        start_background_services,
         AsyncVideoGenerator,
         BackgroundVideoCache
     )
@@ -103,6 +136,14 @@ if ASYNC_ROUTES_AVAILABLE:
 else:
     logger.warning("المسارات غير المتزامنة غير متوفرة")
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500 MB max
+# إرسال الملفات الكبيرة دون نسخها عبر Python: sendfile من خادم WSGI، أو X-Sendfile من الخادم الأمامي
+app.config['USE_X_SENDFILE'] = getattr(config, 'PERFORMANCE_SETTINGS', {}).get('use_x_sendfile', False)
+
+if PERFORMANCE_MANAGER_AVAILABLE:
+    @app.before_request
+    def _start_background_services():
+        """المنظف ومراقب المهام يبدآن مع أول طلب في كل عملية (gunicorn وغيره)"""
+        start_background_services()
 
 # إعداد السجل - Logging Setup
 logging.basicConfig(
@@ -124,17 +165,21 @@ os.makedirs(config.OUTPUT_FOLDER, exist_ok=True)
 # وظائف مساعدة - Helper Functions
 # ===========================
 
-def clean_temp_folder():
-    """تنظيف المجلد المؤقت - Clean temporary folder"""
+@contextmanager
+def job_work_dir(job_id=None):
+    """
+    مجلد عمل مؤقت خاص بمهمة واحدة، يحذف عند انتهائها
+    Per-job scratch directory under TEMP_FOLDER/jobs, removed afterwards
+    
+    Every intermediate of a job lives here, so concurrent jobs never
+    delete each other's files.
+    """
+    work_dir = os.path.join(config.TEMP_FOLDER, 'jobs', job_id or uuid.uuid4().hex)
+    os.makedirs(work_dir, exist_ok=True)
     try:
-        if os.path.exists(config.TEMP_FOLDER):
-            for file in os.listdir(config.TEMP_FOLDER):
-                file_path = os.path.join(config.TEMP_FOLDER, file)
-                if os.path.isfile(file_path):
-                    os.unlink(file_path)
-            logger.info("تم تنظيف المجلد المؤقت")
-    except Exception as e:
-        logger.error(f"خطأ في تنظيف المجلد المؤقت: {str(e)}")
+        yield work_dir
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
 
 def format_arabic_text(text):
@@ -152,10 +197,15 @@ def format_arabic_text(text):
 # API Functions - وظائف التواصل مع APIs
 # ===========================
 
+def _search_cache_key(keyword):
+    """مفتاح نتائج البحث في CacheManager - search results cache key"""
+    return cache_manager._generate_key({'search_hadith': keyword.strip()})
+
+
 def search_hadith(keyword):
     """
-    البحث عن الأحاديث من موقع dorar.net
-    Search for hadiths from dorar.net
+    البحث عن الأحاديث من موقع dorar.net (مع تخزين النتائج مؤقتاً)
+    Search for hadiths from dorar.net, caching non-empty results
     
     Args:
         keyword (str): الكلمة المفتاحية للبحث
@@ -163,6 +213,24 @@ def search_hadith(keyword):
     Returns:
         list: قائمة بالأحاديث المطابقة
     """
+    if not PERFORMANCE_MANAGER_AVAILABLE:
+        return _search_dorar(keyword)
+    
+    cache_key = _search_cache_key(keyword)
+    cached = cache_manager.get(cache_key)
+    if cached:
+        logger.info(f"استخدام نتائج بحث محفوظة: {keyword}")
+        return json.loads(cached)
+    
+    hadiths = _search_dorar(keyword)
+    if hadiths:
+        ttl = getattr(config, 'PERFORMANCE_SETTINGS', {}).get('search_cache_hours', 24) * 3600
+        cache_manager.set(cache_key, json.dumps(hadiths, ensure_ascii=False), ttl)
+    return hadiths
+
+
+def _search_dorar(keyword):
+    """طلب البحث من dorar.net وتحليل النتائج - query dorar.net and parse the results"""
     try:
         logger.info(f"البحث عن الحديث: {keyword}")
         
@@ -295,17 +363,19 @@ def search_hadith(keyword):
         return []
 
 
-def download_background_video(query=None):
+def download_background_video(query=None, work_dir=None):
     """
     تحميل فيديو خلفية من Pexels أو توليده بالذكاء الاصطناعي
     Download background video from Pexels or generate with AI
     
     Args:
         query (str): نوع الفيديو المطلوب
+        work_dir (str): مجلد عمل المهمة (افتراضياً المجلد المؤقت)
         
     Returns:
         str: مسار الفيديو المحمل أو None
     """
+    work_dir = work_dir or config.TEMP_FOLDER
     try:
         # محاولة توليد صورة بالذكاء الاصطناعي أولاً ثم تحويلها لفيديو
         if AI_GENERATOR_AVAILABLE:
@@ -315,12 +385,12 @@ def download_background_video(query=None):
                 prompt_gen = PromptGenerator()
                 prompt = prompt_gen.generate_image_prompt("", query or 'nature')
                 
-                image_path = os.path.join(config.TEMP_FOLDER, 'ai_background.png')
+                image_path = os.path.join(work_dir, 'ai_background.png')
                 result = openai_gen.generate_image(prompt, image_path)
                 
                 if result:
                     # تحويل الصورة إلى فيديو بسيط
-                    video_path = os.path.join(config.TEMP_FOLDER, 'background.mp4')
+                    video_path = os.path.join(work_dir, 'background.mp4')
                     if _image_to_video(result, video_path, duration=30):
                         return video_path
         
@@ -366,7 +436,7 @@ def download_background_video(query=None):
                 video_response = requests.get(video_url, stream=True, timeout=60)
                 video_response.raise_for_status()
                 
-                video_path = os.path.join(config.TEMP_FOLDER, 'background.mp4')
+                video_path = os.path.join(work_dir, 'background.mp4')
                 
                 with open(video_path, 'wb') as f:
                     for chunk in video_response.iter_content(chunk_size=8192):
@@ -384,6 +454,33 @@ def download_background_video(query=None):
         return None
 
 
+def enhance_background(background_video, enhance_locally=True):
+    """
+    تحسين فيديو الخلفية المحمل محلياً (اختياري)
+    Optionally enhance a downloaded background video locally
+    
+    Args:
+        background_video (str): مسار الفيديو المحمل أو None
+        enhance_locally (bool): تطبيق LOCAL_VIDEO_ENHANCEMENT
+        
+    Returns:
+        str: مسار الفيديو الجاهز للتركيب أو None
+    """
+    if not background_video:
+        return None
+    
+    if enhance_locally and VIDEO_ENHANCER_AVAILABLE:
+        settings = getattr(config, 'LOCAL_VIDEO_ENHANCEMENT', {})
+        if settings.get('enabled', True):
+            logger.info("تحسين الفيديو محلياً...")
+            if PERFORMANCE_MANAGER_AVAILABLE:
+                # إعادة استخدام النتيجة المحسنة إذا سبق تحسين نفس الخلفية بنفس الإعدادات
+                background_video = enhanced_video_cache.get_or_enhance(background_video, settings, enhance_video)
+            else:
+                background_video = enhance_video(background_video, settings) or background_video
+    return background_video
+
+
 def _image_to_video(image_path, output_path, duration=30):
     """
     تحويل صورة إلى فيديو مع تأثير Ken Burns
@@ -392,19 +489,15 @@ def _image_to_video(image_path, output_path, duration=30):
     try:
         from moviepy.editor import ImageClip
         
-        # إنشاء مقطع من الصورة
-        clip = ImageClip(image_path, duration=duration)
-        
-        # تغيير الحجم إلى دقة الفيديو
-        clip = clip.resize((config.VIDEO_WIDTH, config.VIDEO_HEIGHT))
-        
-        # تطبيق تأثير Ken Burns (تكبير تدريجي)
-        if VIDEO_ENHANCER_AVAILABLE:
-            enhancer = VideoEnhancer(getattr(config, 'LOCAL_VIDEO_ENHANCEMENT', {}))
-            advanced_settings = getattr(config, 'ADVANCED_VISUAL_EFFECTS', {})
-            if advanced_settings.get('ken_burns', True):
-                zoom = advanced_settings.get('ken_burns_zoom', 1.1)
-                clip = enhancer.apply_ken_burns(clip, zoom)
+        # تطبيق تأثير Ken Burns (تكبير تدريجي) مباشرة من الصورة المفكوكة مرة واحدة
+        advanced_settings = getattr(config, 'ADVANCED_VISUAL_EFFECTS', {})
+        if advanced_settings.get('ken_burns', True):
+            zoom = advanced_settings.get('ken_burns_zoom', 1.1)
+            engine = KenBurnsEngine(config.VIDEO_WIDTH, config.VIDEO_HEIGHT, zoom)
+            clip = engine.image_clip(image_path, duration, config.VIDEO_FPS)
+        else:
+            clip = ImageClip(image_path, duration=duration)
+            clip = clip.resize((config.VIDEO_WIDTH, config.VIDEO_HEIGHT))
         
         # حفظ الفيديو
         clip.write_videofile(
@@ -477,6 +570,113 @@ def prepare_audio_text(hadith_data):
     return full_text
 
 
+def prepare_audio_segments(hadith_data):
+    """
+    تقسيم النص الصوتي إلى مقاطع تُولد كل منها على حدة
+    Split the reading into separately synthesized segments
+    
+    العبارات الثابتة (المقدمة والبادئات) وأسماء الرواة والمصادر تتكرر بين
+    الأحاديث، فتُعلَّم كقابلة للتخزين الدائم. الوقفة بين الأجزاء من
+    AUDIO_READING['pause_duration'].
+    
+    Args:
+        hadith_data (dict): بيانات الحديث
+        
+    Returns:
+        list: مقاطع بالشكل {'text', 'cacheable', 'pause_after'}
+    """
+    audio_settings = getattr(config, 'AUDIO_READING', {})
+    pause = audio_settings.get('pause_duration', 0.8)
+    segments = []
+    
+    def add_part(*pieces):
+        for i, (text, cacheable) in enumerate(pieces):
+            segments.append({
+                'text': text,
+                'cacheable': cacheable,
+                'pause_after': pause if i == len(pieces) - 1 else 0
+            })
+    
+    # مقدمة الحديث
+    add_part((audio_settings.get('intro_text', 'قال رسول الله صلى الله عليه وسلم'), True))
+    
+    # نص الحديث
+    hadith_text = hadith_data.get('text', '').strip()
+    if hadith_text:
+        add_part((hadith_text, False))
+    
+    # الراوي
+    narrator = hadith_data.get('narrator', '').strip()
+    if narrator and audio_settings.get('include_narrator', True):
+        add_part((audio_settings.get('narrator_intro', 'رواه'), True), (narrator, True))
+    
+    # المحدث/المصدر
+    source = hadith_data.get('source', '').strip()
+    if source and audio_settings.get('include_source', True):
+        add_part(('أخرجه', True), (source, True))
+    
+    # درجة الحديث
+    grade = hadith_data.get('grade', '').strip()
+    if grade and audio_settings.get('include_grade', True):
+        add_part((audio_settings.get('grade_intro', 'والحديث'), True), (grade, True))
+    
+    return segments
+
+
+def _audio_enhancement_settings():
+    """إعدادات التحسين المحلي للصوت إذا كان مفعلاً - Active local audio enhancement settings"""
+    if AUDIO_ENHANCER_AVAILABLE:
+        settings = getattr(config, 'LOCAL_AUDIO_ENHANCEMENT', {})
+        if settings.get('enabled', True):
+            return settings
+    return None
+
+
+def _audio_cache_key(text, provider, voice_settings, segments=None):
+    """مفتاح التخزين الدائم للصوت المولد - Persistent TTS cache key"""
+    if not PERFORMANCE_MANAGER_AVAILABLE:
+        return None
+    if segments:
+        # التوليد المجزأ يضيف وقفات، فالناتج يختلف عن التوليد الكامل
+        voice_settings = dict(voice_settings, pauses=[s['pause_after'] for s in segments])
+    return tts_audio_cache.make_key(text, provider, voice_settings, _audio_enhancement_settings())
+
+
+def _finish_audio(result, cache_key):
+    """تحسين الصوت محلياً ثم حفظه في التخزين الدائم - Enhance locally, then cache"""
+    settings = _audio_enhancement_settings()
+    if settings is not None:
+        logger.info("تحسين الصوت محلياً...")
+        enhanced = enhance_audio(result, settings)
+        if TTS_SERVICE_AVAILABLE:
+            # التحسين لا يغير التوقيت، فتنتقل توقيتات الكلمات كما هي
+            copy_timings(result, enhanced)
+        result = enhanced
+    
+    if cache_key:
+        result = tts_audio_cache.put(cache_key, result)
+    return result
+
+
+def _route_tts(attempts, output_path):
+    """
+    تشغيل مزودي الصوت عبر الموجه (طلبات تحوطية) أو بالتتابع عند غيابه
+    Run the provider attempts through the hedging router, or in sequence
+    """
+    if TTS_SERVICE_AVAILABLE:
+        return tts_router.run(attempts, output_path)
+    
+    for provider, attempt in attempts:
+        try:
+            result = attempt(output_path)
+        except Exception as e:
+            logger.error(f"خطأ في توليد الصوت بـ {provider}: {str(e)}")
+            continue
+        if result:
+            return provider, result
+    return None, None
+
+
 def generate_audio(text, output_path, hadith_data=None):
     """
     توليد ملف صوتي من النص بصوت رجولي واضح
@@ -494,61 +694,104 @@ def generate_audio(text, output_path, hadith_data=None):
         logger.info("توليد الملف الصوتي بصوت رجولي واضح")
         
         # إذا تم تمرير بيانات الحديث، استخدم التحضير المحسن
+        segments = None
         if hadith_data:
             text = prepare_audio_text(hadith_data)
             logger.info("تم تحضير النص مع معلومات الحديث الكاملة")
+            
+            # توليد مجزأ: مقاطع متوازية مع تخزين دائم للعبارات الثابتة
+            if (getattr(config, 'AUDIO_READING', {}).get('segmented', True)
+                    and TTS_SERVICE_AVAILABLE and SegmentedSynthesizer.is_available()):
+                segments = prepare_audio_segments(hadith_data)
         
-        # محاولة استخدام ElevenLabs أولاً
+        attempts = []
+        finishers = {}
+        
+        # ElevenLabs أولاً (الأعلى جودة)
         if AI_GENERATOR_AVAILABLE:
             elevenlabs = ElevenLabsGenerator()
             if elevenlabs.is_available():
-                logger.info("استخدام ElevenLabs لتوليد الصوت...")
-                result = elevenlabs.generate_speech(text, output_path)
-                if result:
-                    # تحسين الصوت محلياً
-                    if AUDIO_ENHANCER_AVAILABLE:
-                        settings = getattr(config, 'LOCAL_AUDIO_ENHANCEMENT', {})
-                        if settings.get('enabled', True):
-                            logger.info("تحسين الصوت محلياً...")
-                            result = enhance_audio(result, settings)
-                    return result
-        
-        # استخدام Edge TTS للحصول على صوت رجولي عربي
+                elevenlabs_settings = {
+                    'voice_id': elevenlabs.voice_id,
+                    'model_id': elevenlabs.model_id,
+                    'settings': elevenlabs.settings
+                }
+                elevenlabs_key = _audio_cache_key(text, 'elevenlabs', elevenlabs_settings, segments)
+                cached = tts_audio_cache.get(elevenlabs_key) if elevenlabs_key else None
+                if cached:
+                    return cached
+                
+                def _elevenlabs(path):
+                    if segments:
+                        return synthesize_segments(segments, path, elevenlabs.generate_speech,
+                                                   'elevenlabs', elevenlabs_settings)
+                    return elevenlabs.generate_speech(text, path)
+                
+                attempts.append(('elevenlabs', _elevenlabs))
+                finishers['elevenlabs'] = lambda result: _finish_audio(result, elevenlabs_key)
+        
+        # Edge TTS للحصول على صوت رجولي عربي
         voice = getattr(config, 'EDGE_TTS_VOICE', 'ar-SA-HamedNeural')
         rate = getattr(config, 'EDGE_TTS_RATE', '-15%')
         pitch = getattr(config, 'EDGE_TTS_PITCH', '-2Hz')
         
         logger.info(f"إعدادات الصوت: Voice={voice}, Rate={rate}, Pitch={pitch}")
         
-        async def _generate():
-            communicate = edge_tts.Communicate(text, voice, rate=rate, pitch=pitch)
-            await communicate.save(output_path)
+        edge_settings = {'voice': voice, 'rate': rate, 'pitch': pitch}
+        edge_key = _audio_cache_key(text, 'edge_tts', edge_settings, segments)
+        cached = tts_audio_cache.get(edge_key) if edge_key else None
+        if cached:
+            return cached
         
-        # تشغيل الدالة المتزامنة
-        asyncio.run(_generate())
+        def _edge_tts_to_file(segment_text, path):
+            if TTS_SERVICE_AVAILABLE:
+                # حلقة أحداث دائمة مشتركة بين كل الطلبات
+                return edge_tts_service.synthesize(segment_text, path, voice, rate, pitch)
+            
+            async def _generate():
+                communicate = edge_tts.Communicate(segment_text, voice, rate=rate, pitch=pitch)
+                await communicate.save(path)
+            
+            # تشغيل الدالة المتزامنة
+            asyncio.run(_generate())
+            return path
+        
+        def _edge(path):
+            if segments:
+                return synthesize_segments(segments, path, _edge_tts_to_file, 'edge_tts', edge_settings)
+            return _edge_tts_to_file(text, path)
+        
+        attempts.append(('edge_tts', _edge))
+        finishers['edge_tts'] = lambda result: _finish_audio(result, edge_key)
+        
+        # gTTS كخيار احتياطي
+        gtts_key = _audio_cache_key(text, 'gtts', {'lang': config.TTS_LANG, 'slow': config.TTS_SLOW})
+        
+        def _gtts(path):
+            cached = tts_audio_cache.get(gtts_key) if gtts_key else None
+            if cached:
+                return cached
+            gTTS(text=text, lang=config.TTS_LANG, slow=config.TTS_SLOW).save(path)
+            return path
+        
+        attempts.append(('gtts', _gtts))
+        # مسار gTTS لا يطبق التحسين المحلي
+        finishers['gtts'] = lambda result: (
+            tts_audio_cache.put(gtts_key, result) if gtts_key and result == output_path else result
+        )
         
-        # تحسين الصوت محلياً
-        if AUDIO_ENHANCER_AVAILABLE:
-            settings = getattr(config, 'LOCAL_AUDIO_ENHANCEMENT', {})
-            if settings.get('enabled', True):
-                logger.info("تحسين الصوت محلياً...")
-                output_path = enhance_audio(output_path, settings)
+        provider, result = _route_tts(attempts, output_path)
+        if not result:
+            logger.error("فشل توليد الصوت بكل المزودين")
+            return None
         
-        logger.info(f"تم حفظ الملف الصوتي: {output_path}")
+        output_path = finishers[provider](result)
+        logger.info(f"تم حفظ الملف الصوتي ({provider}): {output_path}")
         return output_path
         
     except Exception as e:
-        logger.error(f"خطأ في توليد الصوت بـ Edge TTS: {str(e)}")
-        # الرجوع إلى gTTS كخيار احتياطي
-        try:
-            logger.info("استخدام gTTS كخيار احتياطي")
-            tts = gTTS(text=text, lang=config.TTS_LANG, slow=config.TTS_SLOW)
-            tts.save(output_path)
-            logger.info(f"تم حفظ الملف الصوتي (gTTS): {output_path}")
-            return output_path
-        except Exception as e2:
-            logger.error(f"خطأ في توليد الصوت: {str(e2)}")
-            return None
+        logger.error(f"خطأ في توليد الصوت: {str(e)}")
+        return None
 
 
 def draw_rounded_rectangle(draw, coords, radius, fill):
@@ -749,7 +992,45 @@ def create_text_clip(text, duration, fontsize, position, color='white', bg_color
         return None
 
 
-def create_hadith_video(hadith_data, background_video_path, audio_path, output_path):
+def _narration_clip(audio_path, music_seed=None):
+    """
+    مقطع التلاوة، ممزوجاً مع خلفية موسيقية مخفضة من المكتبة المحلية
+    Narration clip, mixed with a ducked music bed from the local library
+    """
+    if MUSIC_BED_AVAILABLE:
+        try:
+            mixed = mix_music_bed(audio_path, seed=music_seed)
+            if mixed is not None:
+                samples, sample_rate = mixed
+                return AudioArrayClip(samples, fps=sample_rate)
+        except Exception as e:
+            logger.error(f"خطأ في مزج الموسيقى الخلفية: {str(e)}")
+    return AudioFileClip(audio_path)
+
+
+def video_render_signature(hadith_data, music_seed=None):
+    """
+    كل مدخلات التركيب النهائي غير الملفات (لمفتاح مرحلة الفيديو النهائي)
+    Every non-file input of the final render, for the final stage key
+    
+    The audio and background files enter the key through their content hash.
+    """
+    return {
+        'text': hadith_data.get('text', ''),
+        'narrator': hadith_data.get('narrator', '').strip(),
+        'source': hadith_data.get('source', '').strip(),
+        'grade': hadith_data.get('grade', '').strip(),
+        'overlay_style': _overlay_style(),
+        'hadith_display': getattr(config, 'HADITH_DISPLAY', {}),
+        'text_sync': TTS_SERVICE_AVAILABLE,
+        'video': [config.VIDEO_WIDTH, config.VIDEO_HEIGHT, config.VIDEO_FPS,
+                  getattr(config, 'VIDEO_BITRATE', '8000k'), getattr(config, 'VIDEO_PRESET', 'medium')],
+        'video_effects': getattr(config, 'VIDEO_EFFECTS', {}),
+        'music_bed': music_bed_signature(music_seed) if MUSIC_BED_AVAILABLE and music_seed is not None else None
+    }
+
+
+def create_hadith_video(hadith_data, background_video_path, audio_path, output_path, music_seed=None, work_dir=None):
     """
     إنشاء فيديو الحديث النهائي مع تصميم محسن ومنظم
     Create final hadith video with improved and organized design
@@ -759,6 +1040,8 @@ def create_hadith_video(hadith_data, background_video_path, audio_path, output_p
         background_video_path (str): مسار فيديو الخلفية
         audio_path (str): مسار الملف الصوتي
         output_path (str): مسار حفظ الفيديو النهائي
+        music_seed (int): بذرة اختيار الموسيقى الخلفية (عشوائية إذا لم تحدد)
+        work_dir (str): مجلد عمل المهمة للملفات الوسيطة
         
     Returns:
         str: مسار الفيديو النهائي أو None
@@ -769,8 +1052,8 @@ def create_hadith_video(hadith_data, background_video_path, audio_path, output_p
         # تحميل فيديو الخلفية
         video_clip = VideoFileClip(background_video_path)
         
-        # تحميل الملف الصوتي
-        audio_clip = AudioFileClip(audio_path)
+        # تحميل الملف الصوتي (مع الموسيقى الخلفية إن وجدت)
+        audio_clip = _narration_clip(audio_path, music_seed)
         audio_duration = audio_clip.duration
         
         # استخدام مدة الصوت فقط (بدون إضافة وقت إضافي لتجنب مشاكل المزامنة)
@@ -808,42 +1091,7 @@ def create_hadith_video(hadith_data, background_video_path, audio_path, output_p
         darkened_video = darkened_video.set_duration(final_duration)
         
         # إنشاء النصوص
-        clips = [darkened_video]
-        
-        # ========== نص الحديث (في المنتصف) ==========
-        hadith_text = hadith_data.get('text', '')
-        if hadith_text and len(hadith_text) > 10:
-            logger.info("إضافة نص الحديث...")
-            # تقصير النص إذا كان طويلاً جداً
-            if len(hadith_text) > 400:
-                hadith_text = hadith_text[:400] + "..."
-            
-            hadith_clip = create_hadith_text_clip(
-                hadith_text,
-                final_duration,
-                config.HADITH_FONT_SIZE,
-                'hadith'
-            )
-            if hadith_clip:
-                clips.append(hadith_clip)
-        
-        # ========== معلومات الحديث (في الأسفل) ==========
-        narrator = hadith_data.get('narrator', '').strip()
-        source = hadith_data.get('source', '').strip()
-        grade = hadith_data.get('grade', '').strip()
-        
-        hadith_display = getattr(config, 'HADITH_DISPLAY', {})
-        
-        # إنشاء شريط المعلومات السفلي
-        info_clip = create_info_bar_clip(
-            narrator=narrator,
-            source=source,
-            grade=grade,
-            duration=final_duration,
-            settings=hadith_display
-        )
-        if info_clip:
-            clips.append(info_clip)
+        clips = [darkened_video] + create_text_clips(hadith_data, audio_path, final_duration, work_dir)
         
         # دمج جميع المقاطع
         logger.info("دمج المقاطع...")
@@ -864,7 +1112,7 @@ def create_hadith_video(hadith_data, background_video_path, audio_path, output_p
             fps=config.VIDEO_FPS,
             codec='libx264',
             audio_codec='aac',
-            temp_audiofile=os.path.join(config.TEMP_FOLDER, 'temp_audio.m4a'),
+            temp_audiofile=os.path.join(work_dir or config.TEMP_FOLDER, 'temp_audio.m4a'),
             remove_temp=True,
             threads=6,
             preset=video_preset,
@@ -901,90 +1149,257 @@ def create_hadith_video(hadith_data, background_video_path, audio_path, output_p
         return None
 
 
-def create_hadith_text_clip(text, duration, fontsize, text_type='hadith'):
+def create_text_clips(hadith_data, audio_path, duration, work_dir=None):
     """
-    إنشاء مقطع نص الحديث بتصميم محسن
-    Create hadith text clip with improved design
-    """
-    try:
-        text_settings = getattr(config, 'TEXT_SETTINGS', {})
-        video_effects = getattr(config, 'VIDEO_EFFECTS', {})
-        
-        # تنسيق النص العربي
-        formatted_text = format_arabic_text(text)
-        
-        # حساب أبعاد الصورة
-        img_width = config.VIDEO_WIDTH - 200
-        img_height = 700
-        
-        # إنشاء صورة شفافة
-        img = Image.new('RGBA', (img_width, img_height), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(img)
-        
-        # تحميل الخط
-        font = load_font(fontsize)
-        
-        # تقسيم النص إلى أسطر
-        max_chars = text_settings.get('max_chars_per_line', 30)
-        lines = split_text_to_lines(formatted_text, max_chars)
-        
-        # حساب الأبعاد
-        line_spacing = text_settings.get('line_spacing', 1.9)
-        line_height = int(fontsize * line_spacing)
-        total_height = len(lines) * line_height
-        
-        # إعدادات الخلفية
-        padding = text_settings.get('background_padding', 50)
-        bg_opacity = text_settings.get('background_opacity', 210)
-        bg_radius = text_settings.get('background_radius', 25)
-        
-        # رسم خلفية شبه شفافة
-        bg_x1 = 30
-        bg_y1 = 20
-        bg_x2 = img_width - 30
-        bg_y2 = total_height + padding * 2 + 20
-        
-        draw_rounded_rectangle(
-            draw,
-            (bg_x1, bg_y1, bg_x2, bg_y2),
-            bg_radius,
-            (20, 20, 40, bg_opacity)  # لون أزرق داكن شبه شفاف
-        )
-        
-        # رسم حدود ذهبية للإطار
-        draw_frame_border(draw, (bg_x1, bg_y1, bg_x2, bg_y2), bg_radius, (255, 215, 0, 180))
-        
-        # رسم النص
-        y_position = padding + 30
-        use_shadow = video_effects.get('text_shadow', True)
-        use_outline = video_effects.get('text_outline', True)
+    طبقات النص فوق الفيديو: نص الحديث (متزامناً إن أمكن) وشريط المعلومات
+    Text layers over the video: hadith text (synced when possible) and info bar
+    
+    Args:
+        hadith_data (dict): بيانات الحديث
+        audio_path (str): مسار الملف الصوتي (لتوقيتات الكلمات)
+        duration (float): مدة الفيديو
+        work_dir (str): مجلد عمل المهمة للملفات الوسيطة
         
-        for line in lines:
-            try:
-                bbox = draw.textbbox((0, 0), line, font=font)
-                text_width = bbox[2] - bbox[0]
-            except:
-                text_width = len(line) * (fontsize // 2)
-            
-            x_position = (img_width - text_width) // 2
+    Returns:
+        list: مقاطع ImageClip
+    """
+    clips = []
+    
+    hadith_display = getattr(config, 'HADITH_DISPLAY', {})
+    
+    # ========== نص الحديث (في المنتصف) ==========
+    hadith_text = hadith_data.get('text', '')
+    if hadith_text and len(hadith_text) > 10:
+        logger.info("إضافة نص الحديث...")
+        
+        # عرض النص عبارة بعبارة متزامناً مع القراءة إذا توفرت توقيتات الكلمات
+        synced_clips = None
+        if TTS_SERVICE_AVAILABLE and hadith_display.get('text_sync', 'phrases') == 'phrases':
+            synced_clips = create_synced_hadith_clips(hadith_text, load_timings(audio_path), duration, work_dir)
+        
+        if synced_clips:
+            clips.extend(synced_clips)
+        else:
+            # تقصير النص إذا كان طويلاً جداً
+            if len(hadith_text) > 400:
+                hadith_text = hadith_text[:400] + "..."
             
-            draw_text_with_effects(
-                draw, 
-                (x_position, y_position), 
-                line, 
-                font, 
-                (255, 255, 255, 255),
-                shadow=use_shadow,
-                outline=use_outline
+            hadith_clip = create_hadith_text_clip(
+                hadith_text,
+                duration,
+                config.HADITH_FONT_SIZE,
+                'hadith',
+                work_dir=work_dir
             )
-            y_position += line_height
+            if hadith_clip:
+                clips.append(hadith_clip)
+    
+    # ========== معلومات الحديث (في الأسفل) ==========
+    narrator = hadith_data.get('narrator', '').strip()
+    source = hadith_data.get('source', '').strip()
+    grade = hadith_data.get('grade', '').strip()
+    
+    # إنشاء شريط المعلومات السفلي
+    info_clip = create_info_bar_clip(
+        narrator=narrator,
+        source=source,
+        grade=grade,
+        duration=duration,
+        settings=hadith_display,
+        work_dir=work_dir
+    )
+    if info_clip:
+        clips.append(info_clip)
+    
+    return clips
+
+
+def create_synced_hadith_clips(hadith_text, timings, duration, work_dir=None):
+    """
+    إنشاء مقاطع نص الحديث عبارة بعبارة حسب توقيتات القراءة
+    Create phrase-by-phrase hadith text clips timed to the narration
+    
+    Args:
+        hadith_text (str): نص الحديث
+        timings (dict): توقيتات الكلمات والمقاطع من خدمة TTS
+        duration (float): مدة الفيديو
+        work_dir (str): مجلد عمل المهمة للملفات الوسيطة
         
-        # قص الصورة للحجم الفعلي
-        final_height = total_height + padding * 2 + 50
-        img = img.crop((0, 0, img_width, final_height))
+    Returns:
+        list: مقاطع ImageClip مرتبة زمنياً أو None إذا تعذرت المزامنة
+    """
+    if not timings:
+        return None
+    
+    # تحديد مقطع نص الحديث داخل القراءة الكاملة
+    hadith_text = hadith_text.strip()
+    span = next((s for s in timings.get('segments', []) if s.get('text', '').strip() == hadith_text), None)
+    if not span:
+        return None
+    
+    words = [w for w in timings.get('words', []) if span['start'] <= w['start'] < span['end']]
+    if not words:
+        return None
+    
+    max_chars = getattr(config, 'HADITH_DISPLAY', {}).get('phrase_max_chars', 60)
+    phrases = group_phrases(words, max_chars, tokens=hadith_text.split())
+    
+    clips = []
+    for i, phrase in enumerate(phrases):
+        # العبارة الأولى تظهر منذ البداية والأخيرة تبقى حتى النهاية
+        start = 0 if i == 0 else phrase['start']
+        end = phrases[i + 1]['start'] if i + 1 < len(phrases) else duration
+        if end <= start:
+            continue
         
-        # تحويل إلى ImageClip
-        img_array = np.array(img)
+        clip = create_hadith_text_clip(phrase['text'], end - start, config.HADITH_FONT_SIZE, 'hadith', work_dir)
+        if not clip:
+            return None
+        clips.append(clip.set_start(start))
+    
+    logger.info(f"عرض نص الحديث متزامناً في {len(clips)} عبارة")
+    return clips
+
+
+def _overlay_style():
+    """إعدادات التنسيق المؤثرة في رسم الطبقات النصية - settings that affect overlay rendering"""
+    return {
+        'width': config.VIDEO_WIDTH,
+        'fonts': [config.FONT_PATH, getattr(config, 'FONT_PATH_BACKUP', None)],
+        'font_sizes': [getattr(config, 'RAWI_FONT_SIZE', 34), getattr(config, 'GRADE_FONT_SIZE', 36)],
+        'text_settings': getattr(config, 'TEXT_SETTINGS', {}),
+        'video_effects': getattr(config, 'VIDEO_EFFECTS', {}),
+        'info_colors': getattr(config, 'INFO_COLORS', {}),
+        'grade_colors': getattr(config, 'GRADE_COLORS', {})
+    }
+
+
+def _overlay_image(kind, params, render, work_dir=None):
+    """
+    صورة طبقة نصية من مخزن المراحل، أو رسمها وحفظها عند عدم وجودها
+    Overlay image from the overlay stage cache, rendered and stored on a miss
+    
+    Args:
+        kind (str): نوع الطبقة
+        params (list): مدخلات الرسم
+        render (callable): دالة الرسم، تعيد مصفوفة RGBA
+        work_dir (str): مجلد عمل المهمة (افتراضياً المجلد المؤقت)
+        
+    Returns:
+        np.ndarray: صورة RGBA
+    """
+    if not PERFORMANCE_MANAGER_AVAILABLE:
+        return render()
+    
+    key = artifact_cache.key('overlay', kind, params, _overlay_style())
+    cached = artifact_cache.get('overlay', key, '.png')
+    if cached:
+        try:
+            with Image.open(cached) as img:
+                return np.array(img.convert('RGBA'))
+        except Exception as e:
+            logger.error(f"خطأ في قراءة طبقة نصية محفوظة: {str(e)}")
+    
+    img_array = render()
+    try:
+        tmp_path = os.path.join(work_dir or config.TEMP_FOLDER, f'overlay_{key[:16]}_{threading.get_ident()}.png')
+        Image.fromarray(img_array).save(tmp_path)
+        artifact_cache.put('overlay', key, tmp_path, '.png', move=True)
+    except Exception as e:
+        logger.error(f"خطأ في حفظ الطبقة النصية: {str(e)}")
+    return img_array
+
+
+def _render_hadith_text_image(text, fontsize):
+    """رسم صورة نص الحديث (RGBA) - Render the hadith text image (RGBA)"""
+    text_settings = getattr(config, 'TEXT_SETTINGS', {})
+    video_effects = getattr(config, 'VIDEO_EFFECTS', {})
+    
+    # تنسيق النص العربي
+    formatted_text = format_arabic_text(text)
+    
+    # حساب أبعاد الصورة
+    img_width = config.VIDEO_WIDTH - 200
+    img_height = 700
+    
+    # إنشاء صورة شفافة
+    img = Image.new('RGBA', (img_width, img_height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    
+    # تحميل الخط
+    font = load_font(fontsize)
+    
+    # تقسيم النص إلى أسطر
+    max_chars = text_settings.get('max_chars_per_line', 30)
+    lines = split_text_to_lines(formatted_text, max_chars)
+    
+    # حساب الأبعاد
+    line_spacing = text_settings.get('line_spacing', 1.9)
+    line_height = int(fontsize * line_spacing)
+    total_height = len(lines) * line_height
+    
+    # إعدادات الخلفية
+    padding = text_settings.get('background_padding', 50)
+    bg_opacity = text_settings.get('background_opacity', 210)
+    bg_radius = text_settings.get('background_radius', 25)
+    
+    # رسم خلفية شبه شفافة
+    bg_x1 = 30
+    bg_y1 = 20
+    bg_x2 = img_width - 30
+    bg_y2 = total_height + padding * 2 + 20
+    
+    draw_rounded_rectangle(
+        draw,
+        (bg_x1, bg_y1, bg_x2, bg_y2),
+        bg_radius,
+        (20, 20, 40, bg_opacity)  # لون أزرق داكن شبه شفاف
+    )
+    
+    # رسم حدود ذهبية للإطار
+    draw_frame_border(draw, (bg_x1, bg_y1, bg_x2, bg_y2), bg_radius, (255, 215, 0, 180))
+    
+    # رسم النص
+    y_position = padding + 30
+    use_shadow = video_effects.get('text_shadow', True)
+    use_outline = video_effects.get('text_outline', True)
+    
+    for line in lines:
+        try:
+            bbox = draw.textbbox((0, 0), line, font=font)
+            text_width = bbox[2] - bbox[0]
+        except:
+            text_width = len(line) * (fontsize // 2)
+        
+        x_position = (img_width - text_width) // 2
+        
+        draw_text_with_effects(
+            draw, 
+            (x_position, y_position), 
+            line, 
+            font, 
+            (255, 255, 255, 255),
+            shadow=use_shadow,
+            outline=use_outline
+        )
+        y_position += line_height
+    
+    # قص الصورة للحجم الفعلي
+    final_height = total_height + padding * 2 + 50
+    img = img.crop((0, 0, img_width, final_height))
+    
+    return np.array(img)
+
+
+def create_hadith_text_clip(text, duration, fontsize, text_type='hadith', work_dir=None):
+    """
+    إنشاء مقطع نص الحديث بتصميم محسن
+    Create hadith text clip with improved design
+    """
+    try:
+        # الصورة من مخزن المراحل إذا سبق رسم نفس النص بنفس التنسيق
+        img_array = _overlay_image('hadith_text', [text, fontsize], lambda: _render_hadith_text_image(text, fontsize),
+                                   work_dir)
         img_clip = ImageClip(img_array, duration=duration, ismask=False)
         
         # وضع النص في المنتصف
@@ -999,106 +1414,114 @@ def create_hadith_text_clip(text, duration, fontsize, text_type='hadith'):
         return None
 
 
-def create_info_bar_clip(narrator, source, grade, duration, settings):
-    """
-    إنشاء شريط المعلومات السفلي (الراوي، المحدث، درجة الصحة)
-    Create bottom info bar (narrator, source, grade)
-    """
-    try:
-        text_settings = getattr(config, 'TEXT_SETTINGS', {})
-        info_colors = getattr(config, 'INFO_COLORS', {})
-        grade_colors = getattr(config, 'GRADE_COLORS', {})
+def _render_info_bar_image(narrator, source, grade, settings):
+    """رسم صورة شريط المعلومات (RGBA) - Render the info bar image (RGBA)"""
+    text_settings = getattr(config, 'TEXT_SETTINGS', {})
+    info_colors = getattr(config, 'INFO_COLORS', {})
+    grade_colors = getattr(config, 'GRADE_COLORS', {})
+    
+    # أبعاد الشريط
+    bar_width = config.VIDEO_WIDTH - 100
+    bar_height = 200
+    
+    img = Image.new('RGBA', (bar_width, bar_height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    
+    # خط أصغر للمعلومات
+    info_fontsize = getattr(config, 'RAWI_FONT_SIZE', 34)
+    grade_fontsize = getattr(config, 'GRADE_FONT_SIZE', 36)
+    
+    info_font = load_font(info_fontsize)
+    grade_font = load_font(grade_fontsize)
+    
+    # رسم خلفية الشريط
+    draw_rounded_rectangle(
+        draw,
+        (10, 10, bar_width - 10, bar_height - 10),
+        20,
+        (0, 0, 0, 200)
+    )
+    
+    y_offset = 30
+    line_height = 55
+    
+    # عرض الراوي
+    if narrator and settings.get('show_narrator', True):
+        narrator_prefix = settings.get('narrator_prefix', 'الراوي')
+        narrator_text = f"📜 {narrator_prefix}: {narrator}"
+        formatted_narrator = format_arabic_text(narrator_text)
         
-        # أبعاد الشريط
-        bar_width = config.VIDEO_WIDTH - 100
-        bar_height = 200
+        try:
+            bbox = draw.textbbox((0, 0), formatted_narrator, font=info_font)
+            text_width = bbox[2] - bbox[0]
+        except:
+            text_width = len(formatted_narrator) * (info_fontsize // 2)
         
-        img = Image.new('RGBA', (bar_width, bar_height), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(img)
+        x_pos = (bar_width - text_width) // 2
         
-        # خط أصغر للمعلومات
-        info_fontsize = getattr(config, 'RAWI_FONT_SIZE', 34)
-        grade_fontsize = getattr(config, 'GRADE_FONT_SIZE', 36)
+        # لون أزرق سماوي للراوي
+        narrator_color = hex_to_rgba(info_colors.get('narrator', '#87CEEB'))
+        draw_text_with_effects(draw, (x_pos, y_offset), formatted_narrator, info_font, narrator_color)
+        y_offset += line_height
+    
+    # عرض المحدث
+    if source and settings.get('show_source', True):
+        source_prefix = settings.get('source_prefix', 'المحدث')
+        source_text = f"📚 {source_prefix}: {source}"
+        formatted_source = format_arabic_text(source_text)
         
-        info_font = load_font(info_fontsize)
-        grade_font = load_font(grade_fontsize)
+        try:
+            bbox = draw.textbbox((0, 0), formatted_source, font=info_font)
+            text_width = bbox[2] - bbox[0]
+        except:
+            text_width = len(formatted_source) * (info_fontsize // 2)
         
-        # رسم خلفية الشريط
-        draw_rounded_rectangle(
-            draw,
-            (10, 10, bar_width - 10, bar_height - 10),
-            20,
-            (0, 0, 0, 200)
-        )
+        x_pos = (bar_width - text_width) // 2
         
-        y_offset = 30
-        line_height = 55
+        # لون أخضر فاتح للمصدر
+        source_color = hex_to_rgba(info_colors.get('source', '#98FB98'))
+        draw_text_with_effects(draw, (x_pos, y_offset), formatted_source, info_font, source_color)
+        y_offset += line_height
+    
+    # عرض درجة الصحة بشكل بارز
+    if grade and settings.get('show_grade', True):
+        grade_prefix = settings.get('grade_prefix', 'الحكم')
+        grade_text = f"⭐ {grade_prefix}: {grade}"
+        formatted_grade = format_arabic_text(grade_text)
         
-        # عرض الراوي
-        if narrator and settings.get('show_narrator', True):
-            narrator_prefix = settings.get('narrator_prefix', 'الراوي')
-            narrator_text = f"📜 {narrator_prefix}: {narrator}"
-            formatted_narrator = format_arabic_text(narrator_text)
-            
-            try:
-                bbox = draw.textbbox((0, 0), formatted_narrator, font=info_font)
-                text_width = bbox[2] - bbox[0]
-            except:
-                text_width = len(formatted_narrator) * (info_fontsize // 2)
-            
-            x_pos = (bar_width - text_width) // 2
-            
-            # لون أزرق سماوي للراوي
-            narrator_color = hex_to_rgba(info_colors.get('narrator', '#87CEEB'))
-            draw_text_with_effects(draw, (x_pos, y_offset), formatted_narrator, info_font, narrator_color)
-            y_offset += line_height
-        
-        # عرض المحدث
-        if source and settings.get('show_source', True):
-            source_prefix = settings.get('source_prefix', 'المحدث')
-            source_text = f"📚 {source_prefix}: {source}"
-            formatted_source = format_arabic_text(source_text)
-            
-            try:
-                bbox = draw.textbbox((0, 0), formatted_source, font=info_font)
-                text_width = bbox[2] - bbox[0]
-            except:
-                text_width = len(formatted_source) * (info_fontsize // 2)
-            
-            x_pos = (bar_width - text_width) // 2
-            
-            # لون أخضر فاتح للمصدر
-            source_color = hex_to_rgba(info_colors.get('source', '#98FB98'))
-            draw_text_with_effects(draw, (x_pos, y_offset), formatted_source, info_font, source_color)
-            y_offset += line_height
-        
-        # عرض درجة الصحة بشكل بارز
-        if grade and settings.get('show_grade', True):
-            grade_prefix = settings.get('grade_prefix', 'الحكم')
-            grade_text = f"⭐ {grade_prefix}: {grade}"
-            formatted_grade = format_arabic_text(grade_text)
-            
-            try:
-                bbox = draw.textbbox((0, 0), formatted_grade, font=grade_font)
-                text_width = bbox[2] - bbox[0]
-            except:
-                text_width = len(formatted_grade) * (grade_fontsize // 2)
-            
-            x_pos = (bar_width - text_width) // 2
-            
-            # تحديد لون الدرجة حسب نوعها
-            grade_color = get_grade_color(grade, grade_colors)
-            draw_text_with_effects(draw, (x_pos, y_offset), formatted_grade, grade_font, grade_color, shadow=True, outline=True)
+        try:
+            bbox = draw.textbbox((0, 0), formatted_grade, font=grade_font)
+            text_width = bbox[2] - bbox[0]
+        except:
+            text_width = len(formatted_grade) * (grade_fontsize // 2)
         
-        # قص الصورة
-        img = img.crop((0, 0, bar_width, y_offset + 50))
+        x_pos = (bar_width - text_width) // 2
         
-        # تحويل إلى ImageClip
-        img_array = np.array(img)
+        # تحديد لون الدرجة حسب نوعها
+        grade_color = get_grade_color(grade, grade_colors)
+        draw_text_with_effects(draw, (x_pos, y_offset), formatted_grade, grade_font, grade_color, shadow=True, outline=True)
+    
+    # قص الصورة
+    img = img.crop((0, 0, bar_width, y_offset + 50))
+    
+    return np.array(img)
+
+
+def create_info_bar_clip(narrator, source, grade, duration, settings, work_dir=None):
+    """
+    إنشاء شريط المعلومات السفلي (الراوي، المحدث، درجة الصحة)
+    Create bottom info bar (narrator, source, grade)
+    """
+    try:
+        img_array = _overlay_image(
+            'info_bar', [narrator, source, grade, settings],
+            lambda: _render_info_bar_image(narrator, source, grade, settings),
+            work_dir
+        )
         img_clip = ImageClip(img_array, duration=duration, ismask=False)
         
         # وضع الشريط في الأسفل
-        img_clip = img_clip.set_position(('center', config.VIDEO_HEIGHT - img.height - 30))
+        img_clip = img_clip.set_position(('center', config.VIDEO_HEIGHT - img_array.shape[0] - 30))
         
         return img_clip
         
@@ -1304,62 +1727,62 @@ def api_generate():
         
         logger.info(f"بدء توليد فيديو للحديث: {hadith_data.get('text', '')[:50]}...")
         
-        # تنظيف المجلد المؤقت
-        clean_temp_folder()
-        
-        # توليد الملف الصوتي مع المعلومات الكاملة
-        audio_path = os.path.join(config.TEMP_FOLDER, 'audio.mp3')
-        
-        logger.info("توليد الملف الصوتي...")
-        audio_result = generate_audio(None, audio_path, hadith_data=hadith_data)
-        
-        if not audio_result:
-            return jsonify({
-                'success': False,
-                'error': 'فشل في توليد الصوت. الرجاء المحاولة مرة أخرى.'
-            }), 500
-        
-        # تحميل فيديو الخلفية
-        logger.info("تحميل فيديو الخلفية...")
-        background_video = download_background_video(video_type)
-        
-        if not background_video:
-            return jsonify({
-                'success': False,
-                'error': 'فشل في تحميل فيديو الخلفية. تحقق من اتصال الإنترنت.'
-            }), 500
-        
-        # تحسين الفيديو محلياً (اختياري)
-        if enhance_locally and VIDEO_ENHANCER_AVAILABLE:
-            settings = getattr(config, 'LOCAL_VIDEO_ENHANCEMENT', {})
-            if settings.get('enabled', True):
-                logger.info("تحسين الفيديو محلياً...")
-                enhanced_path = os.path.join(config.TEMP_FOLDER, 'background_enhanced.mp4')
-                background_video = enhance_video(background_video, settings) or background_video
-        
-        # إنشاء الفيديو النهائي
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        output_filename = f"hadith_video_{timestamp}.mp4"
-        output_path = os.path.join(config.OUTPUT_FOLDER, output_filename)
-        
-        logger.info("إنشاء الفيديو النهائي...")
-        video_result = create_hadith_video(hadith_data, background_video, audio_path, output_path)
-        
-        if not video_result:
-            return jsonify({
-                'success': False,
-                'error': 'فشل في إنشاء الفيديو النهائي. الرجاء المحاولة مرة أخرى.'
-            }), 500
-        
-        # تنظيف الملفات المؤقتة
-        clean_temp_folder()
+        # مجلد عمل خاص بهذا الطلب (يحذف مع ملفاته الوسيطة عند الانتهاء)
+        with job_work_dir() as work_dir:
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            output_filename = f"hadith_video_{timestamp}_{os.path.basename(work_dir)[-8:]}.mp4"
+            output_path = os.path.join(config.OUTPUT_FOLDER, output_filename)
+            
+            def render(audio_result, background_video):
+                if not (audio_result and background_video):
+                    return None
+                logger.info("إنشاء الفيديو النهائي...")
+                if not PERFORMANCE_MANAGER_AVAILABLE:
+                    return create_hadith_video(hadith_data, background_video, audio_result, output_path,
+                                               work_dir=work_dir)
+                # نفس مخزن المرحلة النهائية الذي تستخدمه المهام غير المتزامنة
+                return artifact_cache.render_final(
+                    audio_result, background_video, output_path,
+                    lambda music_seed: video_render_signature(hadith_data, music_seed),
+                    lambda music_seed: create_hadith_video(hadith_data, background_video, audio_result, output_path,
+                                                           music_seed=music_seed, work_dir=work_dir)
+                )
+            
+            # الصوت وتحميل الخلفية مستقلان فيعملان بالتوازي، والتركيب بعد انتهائهما
+            graph = StageGraph()
+            graph.add('audio', lambda: generate_audio(None, os.path.join(work_dir, 'audio.mp3'),
+                                                      hadith_data=hadith_data))
+            graph.add('download', lambda: download_background_video(video_type, work_dir))
+            graph.add('enhance', lambda video: enhance_background(video, enhance_locally),
+                      deps=('download',), pool='cpu')
+            graph.add('render', render, deps=('audio', 'enhance'), pool='cpu')
+            results = graph.run()
+            
+            if not results['audio']:
+                return jsonify({
+                    'success': False,
+                    'error': 'فشل في توليد الصوت. الرجاء المحاولة مرة أخرى.'
+                }), 500
+            
+            if not results['enhance']:
+                return jsonify({
+                    'success': False,
+                    'error': 'فشل في تحميل فيديو الخلفية. تحقق من اتصال الإنترنت.'
+                }), 500
+            
+            if not results['render']:
+                return jsonify({
+                    'success': False,
+                    'error': 'فشل في إنشاء الفيديو النهائي. الرجاء المحاولة مرة أخرى.'
+                }), 500
         
         logger.info(f"✅ تم إنشاء الفيديو بنجاح: {output_filename}")
         
         return jsonify({
             'success': True,
             'video_path': output_filename,
-            'message': 'تم إنشاء الفيديو بنجاح'
+            'message': 'تم إنشاء الفيديو بنجاح',
+            'timings': graph.report()
         })
         
     except MemoryError:
@@ -1698,6 +2121,11 @@ def api_get_providers():
             providers['prompt']['openrouter']['available'] = OpenRouterImageGenerator().is_available()
             providers['prompt']['ollama']['available'] = OllamaGenerator().is_available()
         
+        # زمن الاستجابة لكل مزود صوت (مدرج تراكمي بالثواني)
+        if TTS_SERVICE_AVAILABLE:
+            for name, stats in tts_router.stats().items():
+                providers['voice'].setdefault(name, {'name': name, 'available': True})['latency'] = stats
+        
         return jsonify({
             'success': True,
             'providers': providers
@@ -1777,6 +2205,84 @@ def api_preview(filename):
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/preview_enhancement', methods=['POST'])
+def api_preview_enhancement():
+    """
+    API لمعاينة إعدادات تحسين الفيديو على إطارات مختارة فقط
+    API endpoint for previewing enhancement settings on sampled frames
+    """
+    try:
+        if not VIDEO_ENHANCER_AVAILABLE:
+            return jsonify({'error': 'محسن الفيديو غير متوفر'}), 503
+        
+        data = request.get_json(silent=True) or {}
+        
+        # دمج الإعدادات المرسلة مع الإعدادات الافتراضية
+        settings = dict(getattr(config, 'LOCAL_VIDEO_ENHANCEMENT', {}))
+        settings.update(data.get('settings', {}))
+        
+        try:
+            max_frames = int(data.get('max_frames', 8))
+            stride = data.get('stride')
+            stride = int(stride) if stride is not None else None
+            scale = float(data.get('scale', 0.25))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'قيم المعاينة غير صالحة'}), 400
+        if max_frames < 1 or (stride is not None and stride < 1) or not 0 < scale <= 1:
+            return jsonify({'error': 'قيم المعاينة خارج النطاق المسموح'}), 400
+        
+        video_path = data.get('video_path')
+        if video_path:
+            video_path = os.path.realpath(video_path)
+            allowed_roots = [os.path.realpath(folder) for folder in
+                             (config.TEMP_FOLDER, config.OUTPUT_FOLDER, config.CACHE_FOLDER)]
+            if not any(video_path.startswith(root + os.sep) for root in allowed_roots):
+                return jsonify({'error': 'مسار الفيديو غير مسموح'}), 400
+        else:
+            # استخدام أحدث خلفية محملة
+            bg_dir = os.path.join(config.TEMP_FOLDER, 'bg_videos')
+            candidates = [os.path.join(bg_dir, f) for f in os.listdir(bg_dir)] if os.path.isdir(bg_dir) else []
+            candidates = [f for f in candidates if f.endswith('.mp4')]
+            video_path = max(candidates, key=os.path.getmtime) if candidates else None
+        
+        if not video_path or not os.path.exists(video_path):
+            return jsonify({'error': 'الملف غير موجود'}), 404
+        
+        mode = 'clip' if data.get('mode') == 'clip' else 'sheet'
+        preview_dir = os.path.join(config.TEMP_FOLDER, 'previews')
+        os.makedirs(preview_dir, exist_ok=True)
+        output_path = os.path.join(
+            preview_dir,
+            f"preview_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}." + ('mp4' if mode == 'clip' else 'jpg')
+        )
+        
+        enhancer = VideoEnhancer(settings)
+        result = enhancer.preview(
+            video_path,
+            output_path,
+            mode=mode,
+            max_frames=min(max_frames, 48),
+            stride=stride,
+            scale=scale
+        )
+        
+        if not result:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            return jsonify({'error': 'فشل في إنشاء المعاينة'}), 500
+        
+        # المعاينة للاستخدام مرة واحدة: تقرأ في الذاكرة ثم تحذف من القرص
+        # (لا يمكن الحذف بعد send_file لأن X-Sendfile قد يقرأ الملف لاحقاً)
+        with open(result, 'rb') as f:
+            payload = io.BytesIO(f.read())
+        os.remove(result)
+        return send_file(payload, mimetype='video/mp4' if mode == 'clip' else 'image/jpeg')
+        
+    except Exception as e:
+        logger.error(f"خطأ في معاينة التحسين: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
 # ===========================
 # Main - التشغيل الرئيسي
 # ===========================
@@ -1792,5 +2298,9 @@ if __name__ == '__main__':
         logger.warning("تحذير: لم يتم تعيين مفتاح Pexels API")
         logger.warning("الرجاء تعديل ملف config.py وإضافة مفتاح API")
     
+    # المنظف واستئناف المهام في عملية الخادم (لا في عملية إعادة التحميل في وضع التطوير)
+    if PERFORMANCE_MANAGER_AVAILABLE and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
+    
     # تشغيل التطبيق
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+الموسيقى الخلفية - Background Music Bed
+
+Music files placed under MUSIC_BED['source_folder'] (a subfolder per query
+from PEXELS_MUSIC_QUERIES, or any file whose name contains the query) are
+ingested once into a local library: decoded, resampled to the library rate,
+trimmed of leading and trailing silence, loudness-normalized and stored as
+a float32 .npy file. A job memory-maps the bed, loops or slices it to the
+narration length and ducks it under the speech with a sidechain envelope,
+so per-job mixing is one vectorized multiply-add with no decoding.
+"""
+
+import os
+import json
+import random
+import hashlib
+import logging
+import threading
+import numpy as np
+from typing import Dict, List, Optional
+
+import config
+import audio_dsp
+
+logger = logging.getLogger(__name__)
+
+# محاولة استيراد scipy لإعادة التشكيل
+try:
+    from scipy import signal
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.ogg', '.flac', '.m4a', '.aac')
+
+
+class MusicLibrary:
+    """
+    مكتبة محلية لخلفيات موسيقية جاهزة للمزج
+    Local library of pre-normalized music beds
+    """
+    
+    def __init__(self, source_dir: str, library_dir: str, sample_rate: int = 24000,
+                 loudness: float = -20.0, silence_db: float = -50.0):
+        self.source_dir = source_dir
+        self.library_dir = library_dir
+        self.sample_rate = sample_rate
+        self.loudness = loudness
+        self.silence_db = silence_db
+        self.index_path = os.path.join(library_dir, 'index.json')
+        self._lock = threading.Lock()
+        self._index = None
+        self._scanned_folders = None
+    
+    def _load_index(self) -> Dict:
+        if self._index is None:
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+        return self._index
+    
+    def _save_index(self):
+        os.makedirs(self.library_dir, exist_ok=True)
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.index_path)
+    
+    @staticmethod
+    def _signature(path: str) -> str:
+        stat = os.stat(path)
+        return f"{stat.st_size}:{int(stat.st_mtime)}"
+    
+    def _tags(self, path: str) -> List[str]:
+        """الوسوم من اسم الملف ومجلداته - tags from the relative path"""
+        relative = os.path.splitext(os.path.relpath(path, self.source_dir))[0]
+        return [part.replace('_', ' ').replace('-', ' ').lower() for part in relative.split(os.sep)]
+    
+    def scan(self) -> int:
+        """
+        إدخال الملفات الجديدة أو المعدلة فقط
+        Ingest new or changed source files; returns how many were ingested
+        """
+        if not os.path.isdir(self.source_dir):
+            return 0
+        
+        ingested = 0
+        with self._lock:
+            index = self._load_index()
+            known = {entry['source']: entry for entry in index.values()}
+            for root, _, files in os.walk(self.source_dir):
+                for name in sorted(files):
+                    if not name.lower().endswith(AUDIO_EXTENSIONS):
+                        continue
+                    path = os.path.join(root, name)
+                    entry = known.get(path)
+                    if entry and entry.get('signature') == self._signature(path):
+                        continue
+                    try:
+                        self._ingest(path)
+                        ingested += 1
+                    except Exception as e:
+                        logger.error(f"خطأ في إدخال الموسيقى {path}: {str(e)}")
+            if ingested:
+                self._save_index()
+        return ingested
+    
+    def _folder_times(self) -> Optional[tuple]:
+        """أزمنة تعديل المجلد المصدر ومجلداته الفرعية - mtimes of the source folder and its subfolders"""
+        try:
+            with os.scandir(self.source_dir) as entries:
+                folders = sorted((e.name, e.stat().st_mtime_ns) for e in entries if e.is_dir())
+            return os.stat(self.source_dir).st_mtime_ns, tuple(folders)
+        except OSError:
+            return None
+    
+    def refresh(self) -> int:
+        """
+        إعادة المسح فقط إذا تغيرت المجلدات منذ آخر مسح
+        Rescan only when the source folder or one of its query subfolders changed
+        
+        Adding, removing or renaming a file updates its folder's mtime, so a
+        render costs a few stat calls instead of a walk over the library. A
+        file overwritten in place is picked up by an explicit scan().
+        """
+        folders = self._folder_times()
+        if folders is None or folders == self._scanned_folders:
+            return 0
+        ingested = self.scan()
+        self._scanned_folders = folders
+        return ingested
+    
+    def _ingest(self, path: str) -> Dict:
+        """فك الترميز والتحضير مرة واحدة - decode, trim, resample and normalize once"""
+        samples, sample_rate, _ = audio_dsp.decode(path)
+        if sample_rate != self.sample_rate:
+            samples = signal.resample_poly(samples, self.sample_rate, sample_rate, axis=0)
+            samples = samples.astype(np.float32)
+        
+        # قص الصمت في البداية والنهاية (إطارات 10 مللي ثانية)
+        frame = max(1, self.sample_rate // 100)
+        usable = samples.shape[0] // frame * frame
+        levels = np.sqrt(np.mean(np.square(samples[:usable]).reshape(-1, frame * samples.shape[1]), axis=1))
+        loud = np.flatnonzero(20.0 * np.log10(np.maximum(levels, 1e-10)) > self.silence_db)
+        if not loud.size:
+            raise ValueError("الملف صامت")
+        samples = samples[loud[0] * frame:(loud[-1] + 1) * frame]
+        
+        samples = audio_dsp.normalize_loudness(samples, self.sample_rate, self.loudness)
+        
+        bed_id = hashlib.sha256(path.encode('utf-8')).hexdigest()[:16]
+        os.makedirs(self.library_dir, exist_ok=True)
+        np.save(os.path.join(self.library_dir, f"{bed_id}.npy"), np.ascontiguousarray(samples, dtype=np.float32))
+        
+        entry = {
+            'source': path,
+            'signature': self._signature(path),
+            'tags': self._tags(path),
+            'file': f"{bed_id}.npy",
+            'duration': round(samples.shape[0] / float(self.sample_rate), 2),
+            'channels': int(samples.shape[1])
+        }
+        self._index[bed_id] = entry
+        logger.info(f"تمت إضافة موسيقى خلفية إلى المكتبة: {os.path.basename(path)}")
+        return entry
+    
+    def select(self, query: Optional[str] = None, seed: Optional[int] = None) -> Optional[Dict]:
+        """اختيار خلفية تطابق الاستعلام، أو أي خلفية عند عدم التطابق"""
+        with self._lock:
+            entries = [self._index[key] for key in sorted(self._load_index())]
+        if not entries:
+            return None
+        if query:
+            query = query.lower()
+            matching = [e for e in entries if query in ' '.join(e['tags'])]
+            entries = matching or entries
+        picker = random.Random(seed) if seed is not None else random
+        return picker.choice(entries)
+    
+    def load(self, entry: Dict) -> np.ndarray:
+        """تحميل الخلفية بالربط بالذاكرة دون نسخ - memory-mapped, read only"""
+        return np.load(os.path.join(self.library_dir, entry['file']), mmap_mode='r')
+    
+    def mix(self, narration: np.ndarray, sample_rate: int, query: Optional[str] = None,
+            seed: Optional[int] = None, settings: Optional[Dict] = None) -> np.ndarray:
+        """
+        مزج الخلفية تحت التلاوة مع خفضها أثناء الكلام
+        Mix a bed under the narration, ducked by a sidechain envelope
+        
+        Args:
+            narration: التلاوة (عينات، قنوات) float32
+            sample_rate: معدل العينات للتلاوة
+            query: استعلام اختيار الموسيقى
+            seed: بذرة الاختيار (لنتيجة ثابتة لنفس الحديث)
+            settings: إعدادات MUSIC_BED
+        
+        Returns:
+            المزيج، أو التلاوة كما هي إذا لم تتوفر خلفية
+        """
+        settings = settings if settings is not None else getattr(config, 'MUSIC_BED', {})
+        entry = self.select(query, seed)
+        if entry is None:
+            return narration
+        
+        n = narration.shape[0]
+        bed = self.load(entry)
+        needed = int(np.ceil(n * self.sample_rate / float(sample_rate))) + 1
+        bed = _fit_length(bed, needed, int(settings.get('loop_crossfade', 1.0) * self.sample_rate))
+        if sample_rate != self.sample_rate:
+            bed = signal.resample_poly(bed, sample_rate, self.sample_rate, axis=0)
+        bed = bed[:n]
+        
+        # خفض الموسيقى أثناء الكلام
+        duck = audio_dsp.sidechain_envelope(
+            narration, sample_rate,
+            threshold_db=settings.get('duck_threshold', -40.0),
+            attack_ms=settings.get('duck_attack_ms', 80.0),
+            release_ms=settings.get('duck_release_ms', 600.0)
+        )
+        gain_db = settings.get('volume', -14.0) - settings.get('duck_db', 10.0) * duck
+        gain = audio_dsp.db_to_gain(gain_db)
+        
+        channels = max(narration.shape[1], bed.shape[1])
+        mixed = np.empty((n, channels), dtype=np.float32)
+        np.multiply(bed, gain[:, None], out=mixed, casting='unsafe')
+        mixed = audio_dsp.fade(mixed, sample_rate, settings.get('fade', 2.0), settings.get('fade', 2.0))
+        mixed += narration
+        logger.info(f"مزج الموسيقى الخلفية: {os.path.basename(entry['source'])}")
+        return np.clip(mixed, -1.0, 1.0, out=mixed)
+
+
+def _fit_length(bed: np.ndarray, length: int, crossfade: int) -> np.ndarray:
+    """تكرار الخلفية مع تداخل ناعم عند الحاجة أو قصها - loop with crossfades, or slice"""
+    if bed.shape[0] >= length:
+        return bed[:length]
+    
+    crossfade = min(crossfade, bed.shape[0] // 2)
+    step = bed.shape[0] - crossfade
+    out = np.zeros((length + bed.shape[0], bed.shape[1]), dtype=np.float32)
+    ramp = np.linspace(0.0, 1.0, crossfade, dtype=np.float32)[:, None]
+    for start in range(0, length, step):
+        piece = np.array(bed, dtype=np.float32)
+        if start and crossfade:
+            piece[:crossfade] *= ramp
+            out[start:start + crossfade] *= 1.0 - ramp
+        out[start:start + piece.shape[0]] += piece
+    return out[:length]
+
+
+def mix_music_bed(audio_path: str, query: Optional[str] = None, seed: Optional[int] = None):
+    """
+    فك ترميز التلاوة ومزجها مع خلفية من المكتبة
+    Decode the narration and mix a library bed under it
+    
+    Returns:
+        (samples, sample_rate) أو None إذا لم تتوفر خلفية
+    """
+    settings = getattr(config, 'MUSIC_BED', {})
+    if not settings.get('enabled', False) or not SCIPY_AVAILABLE:
+        return None
+    
+    library = music_library()
+    library.refresh()
+    seed = random.randrange(1 << 30) if seed is None else seed
+    query = query or _seeded_query(seed)
+    if library.select(query, seed) is None:
+        return None
+    
+    narration, sample_rate, _ = audio_dsp.decode(audio_path)
+    return library.mix(narration, sample_rate, query, seed, settings), sample_rate
+
+
+def _seeded_query(seed: int) -> Optional[str]:
+    """استعلام الموسيقى المشتق من البذرة - the music query picked by a seed"""
+    return random.Random(seed).choice(getattr(config, 'PEXELS_MUSIC_QUERIES', [None]))
+
+
+def music_bed_signature(seed: int) -> Optional[Dict]:
+    """
+    هوية الخلفية التي سيختارها mix_music_bed لهذه البذرة (لمفاتيح التخزين)
+    Identity of the bed mix_music_bed would pick for a seed, for cache keys
+    
+    Returns:
+        الملف وتوقيعه وإعدادات المزج، أو None إذا لن تمزج أي خلفية
+    """
+    settings = getattr(config, 'MUSIC_BED', {})
+    if not settings.get('enabled', False) or not SCIPY_AVAILABLE:
+        return None
+    
+    library = music_library()
+    library.refresh()
+    entry = library.select(_seeded_query(seed), seed)
+    if entry is None:
+        return None
+    return {'file': entry['file'], 'signature': entry['signature'], 'settings': settings}
+
+
+_library = None
+_library_lock = threading.Lock()
+
+
+def music_library() -> MusicLibrary:
+    """
+    مكتبة الموسيقى المشتركة لهذه العملية
+    The shared library of this process, created on first use
+    """
+    global _library
+    with _library_lock:
+        if _library is None:
+            settings = getattr(config, 'MUSIC_BED', {})
+            _library = MusicLibrary(
+                source_dir=settings.get('source_folder', 'music'),
+                library_dir=os.path.join(config.CACHE_FOLDER, 'music_beds'),
+                sample_rate=settings.get('sample_rate', 24000),
+                loudness=settings.get('library_loudness', -20.0)
+            )
+        return _library
@@ -8,16 +8,230 @@ import os
 import json
 import time
 import hashlib
+import heapq
+import io
 import asyncio
 import threading
 import logging
+import multiprocessing
+import shutil
+import socket
+import sqlite3
+import uuid
+import sys
+import tarfile
+from collections import OrderedDict
 from typing import Dict, Any, Optional, List
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import config
+from stage_graph import StageGraph
 
 logger = logging.getLogger(__name__)
 
+# حدود الذاكرة لعمليات العمل (غير متوفرة على Windows)
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+
+class CacheIndex:
+    """
+    فهرس التخزين المؤقت في SQLite (وضع WAL)
+    Transactional cache index backed by SQLite in WAL mode
+    
+    Each mutation is one indexed row write instead of a rewrite of the
+    whole index, a crash cannot leave a half-written index, and several
+    threads or worker processes can share the same cache directory.
+    expires_at and last_access are indexed so expiry and eviction scans
+    are range queries. The database is created on first use, not when
+    the index is constructed.
+    """
+    
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS entries ("
+        " key TEXT PRIMARY KEY,"
+        " file_path TEXT NOT NULL,"
+        " created_at REAL NOT NULL,"
+        " expires_at REAL NOT NULL,"
+        " last_access REAL NOT NULL,"
+        " size INTEGER NOT NULL DEFAULT 0)",
+        "CREATE INDEX IF NOT EXISTS idx_entries_expires_at ON entries (expires_at)",
+        "CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access)",
+    )
+    COLUMNS = ('key', 'file_path', 'created_at', 'expires_at', 'last_access', 'size')
+    
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+    
+    def _connect(self) -> sqlite3.Connection:
+        """اتصال لكل خيط (ولكل عملية بعد fork)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    with conn:
+                        for statement in self.SCHEMA:
+                            conn.execute(statement)
+                    self._schema_ready = True
+        return conn
+    
+    def _rows(self, cursor) -> List[Dict]:
+        return [dict(zip(self.COLUMNS, row)) for row in cursor.fetchall()]
+    
+    def get(self, key: str) -> Optional[Dict]:
+        rows = self._rows(self._connect().execute(
+            "SELECT key, file_path, created_at, expires_at, last_access, size FROM entries WHERE key = ?", (key,)
+        ))
+        return rows[0] if rows else None
+    
+    def put(self, key: str, file_path: str, expires_at: float, size: int):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, file_path, created_at, expires_at, last_access, size)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, file_path, now, expires_at, now, size)
+            )
+    
+    def touch(self, key: str):
+        with self._connect() as conn:
+            conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+    
+    def delete(self, key: str) -> Optional[Dict]:
+        """حذف المدخل وإرجاعه (None إذا لم يكن موجوداً)"""
+        with self._connect() as conn:
+            rows = self._rows(conn.execute(
+                "SELECT key, file_path, created_at, expires_at, last_access, size FROM entries WHERE key = ?", (key,)
+            ))
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        return rows[0] if rows else None
+    
+    def expired(self, now: float = None, limit: int = -1) -> List[Dict]:
+        """المدخلات المنتهية بترتيب انتهائها - range scan on expires_at"""
+        return self._rows(self._connect().execute(
+            "SELECT key, file_path, created_at, expires_at, last_access, size FROM entries"
+            " WHERE expires_at <= ? ORDER BY expires_at LIMIT ?", (now or time.time(), limit)
+        ))
+    
+    def all(self) -> List[Dict]:
+        return self._rows(self._connect().execute(
+            "SELECT key, file_path, created_at, expires_at, last_access, size FROM entries"
+        ))
+    
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries")
+    
+    def stats(self) -> Dict:
+        count, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {'items': count, 'bytes': size}
+
+
+class LRUMemoryCache:
+    """
+    طبقة ذاكرة LRU محدودة بعدد البايتات
+    Thread-safe LRU memory tier bounded by total bytes
+    
+    Entries carry the expiry of their disk copy, so an expired item is
+    dropped on access instead of being served stale. Inserting past the
+    byte budget evicts least recently used entries first.
+    """
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    @staticmethod
+    def _sizeof(value: Any) -> int:
+        if isinstance(value, (bytes, bytearray)):
+            return len(value)
+        if isinstance(value, str):
+            return len(value.encode('utf-8'))
+        return sys.getsizeof(value)
+    
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at is not None and time.time() > expires_at:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def put(self, key: str, value: Any, expires_at: float = None) -> bool:
+        """إضافة عنصر؛ العناصر الأكبر من الميزانية كاملة لا تُخزن"""
+        size = self._sizeof(value)
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                return False
+            while self.bytes + size > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            self._entries[key] = (value, size, expires_at)
+            self.bytes += size
+            return True
+    
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+    
+    def pop(self, key: str):
+        with self._lock:
+            self._remove(key)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'items': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+
 class CacheManager:
     """
     مدير التخزين المؤقت لتحسين الأداء
@@ -25,16 +239,27 @@ class CacheManager:
     """
     
     def __init__(self, cache_dir: str = None):
+        """لا يلمس القرص قبل أول استخدام - nothing touches the disk until first use"""
         self.cache_dir = cache_dir or os.path.join(config.TEMP_FOLDER, 'cache')
-        self.memory_cache = {}
-        self.cache_index = {}
-        self.max_size = 100  # Maximum number of items in memory cache
-        
-        # Create cache directory
-        os.makedirs(self.cache_dir, exist_ok=True)
-        
-        # Load cache index
-        self.load_cache_index()
+        performance = getattr(config, 'PERFORMANCE_SETTINGS', {})
+        memory_mb = min(performance.get('memory_cache_mb', 256), performance.get('memory_limit_mb', 2048))
+        self.memory_cache = LRUMemoryCache(int(memory_mb * 1024 * 1024))
+        # الملفات الأكبر من هذا الحد تقرأ من القرص ولا تدخل طبقة الذاكرة
+        self.memory_threshold = int(performance.get('cache_memory_threshold_kb', 256) * 1024)
+        self._index = None
+        self._index_lock = threading.Lock()
+        self.sweeper = None
+    
+    @property
+    def index(self) -> CacheIndex:
+        """فهرس SQLite، يفتح عند أول استخدام - the cache index, opened on first use"""
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    self._index = CacheIndex(os.path.join(self.cache_dir, 'index.db'))
+                    self._migrate_json_index()
+        return self._index
     
     def _generate_key(self, data: Any) -> str:
         """Generate cache key from data"""
@@ -42,37 +267,37 @@ class CacheManager:
             data = json.dumps(data, sort_keys=True)
         return hashlib.md5(str(data).encode()).hexdigest()
     
-    def load_cache_index(self):
-        """Load cache index from file"""
+    def _migrate_json_index(self):
+        """Import entries from the legacy index.json, then remove it"""
+        index_path = os.path.join(self.cache_dir, 'index.json')
+        if not os.path.exists(index_path):
+            return
         try:
-            index_path = os.path.join(self.cache_dir, 'index.json')
-            if os.path.exists(index_path):
-                with open(index_path, 'r', encoding='utf-8') as f:
-                    self.cache_index = json.load(f)
+            with open(index_path, 'r', encoding='utf-8') as f:
+                legacy = json.load(f)
+            for key, info in legacy.items():
+                if os.path.exists(info.get('file_path', '')):
+                    self.index.put(key, info['file_path'], info.get('expires_at', 0), info.get('size', 0))
+            os.remove(index_path)
+            logger.info(f"Migrated {len(legacy)} cache index entries to SQLite")
         except Exception as e:
-            logger.error(f"Error loading cache index: {e}")
-            self.cache_index = {}
-    
-    def save_cache_index(self):
-        """Save cache index to file"""
-        try:
-            index_path = os.path.join(self.cache_dir, 'index.json')
-            with open(index_path, 'w', encoding='utf-8') as f:
-                json.dump(self.cache_index, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logger.error(f"Error saving cache index: {e}")
+            logger.error(f"Error migrating cache index: {e}")
     
     def get(self, key: str) -> Optional[Any]:
-        """Get item from cache"""
+        """
+        Get item from cache
+        
+        Only payloads below memory_threshold are promoted to the memory tier.
+        """
         try:
             # Check memory cache first
-            if key in self.memory_cache:
-                return self.memory_cache[key]
+            data = self.memory_cache.get(key)
+            if data is not None:
+                return data
             
             # Check file cache
-            if key in self.cache_index:
-                cache_info = self.cache_index[key]
-                
+            cache_info = self.index.get(key)
+            if cache_info:
                 # Check if cache is expired
                 if self._is_expired(cache_info):
                     self.delete(key)
@@ -80,12 +305,14 @@ class CacheManager:
                 
                 file_path = cache_info['file_path']
                 if os.path.exists(file_path):
+                    self.index.touch(key)
+                    size = os.path.getsize(file_path)
                     with open(file_path, 'rb') as f:
                         data = f.read()
                     
-                    # Add to memory cache
-                    if len(self.memory_cache) < self.max_size:
-                        self.memory_cache[key] = data
+                    # Promote small payloads to memory cache
+                    if size < self.memory_threshold:
+                        self.memory_cache.put(key, data, cache_info['expires_at'])
                     
                     return data
             
@@ -98,31 +325,34 @@ class CacheManager:
         """Set item in cache"""
         try:
             ttl_seconds = ttl_seconds or config.AI_VIDEO_SETTINGS.get('cache_duration', 3600)
-            
-            # Add to memory cache
-            if len(self.memory_cache) < self.max_size:
-                self.memory_cache[key] = data
+            expires_at = time.time() + ttl_seconds
             
             # Save to file cache
+            os.makedirs(self.cache_dir, exist_ok=True)
             file_path = os.path.join(self.cache_dir, f"{key}.cache")
             
             if isinstance(data, str):
                 data = data.encode('utf-8')
-            elif not isinstance(data, bytes):
+            elif not isinstance(data, (bytes, bytearray, memoryview)):
                 data = str(data).encode('utf-8')
+            size = memoryview(data).nbytes
             
-            with open(file_path, 'wb') as f:
+            # Add small payloads to memory cache
+            if size < self.memory_threshold:
+                self.memory_cache.put(key, bytes(data), expires_at)
+            else:
+                self.memory_cache.pop(key)
+            
+            # كتابة ذرية حتى لا يقرأ عامل آخر ملفاً ناقصاً
+            tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
                 f.write(data)
+            os.replace(tmp_path, file_path)
             
             # Update cache index
-            self.cache_index[key] = {
-                'file_path': file_path,
-                'created_at': time.time(),
-                'expires_at': time.time() + ttl_seconds,
-                'size': len(data)
-            }
-            
-            self.save_cache_index()
+            self.index.put(key, file_path, expires_at, size)
+            if self.sweeper:
+                self.sweeper.schedule('cache', key, expires_at)
             return True
         except Exception as e:
             logger.error(f"Error setting cache: {e}")
@@ -136,17 +366,12 @@ class CacheManager:
         """Delete item from cache"""
         try:
             # Remove from memory
-            if key in self.memory_cache:
-                del self.memory_cache[key]
+            self.memory_cache.pop(key)
             
             # Remove from file cache
-            if key in self.cache_index:
-                cache_info = self.cache_index[key]
-                file_path = cache_info['file_path']
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                del self.cache_index[key]
-                self.save_cache_index()
+            cache_info = self.index.delete(key)
+            if cache_info and os.path.exists(cache_info['file_path']):
+                os.remove(cache_info['file_path'])
             
             return True
         except Exception as e:
@@ -157,74 +382,324 @@ class CacheManager:
         """Clear all cache"""
         try:
             self.memory_cache.clear()
-            for cache_info in self.cache_index.values():
+            for cache_info in self.index.all():
                 file_path = cache_info['file_path']
                 if os.path.exists(file_path):
                     os.remove(file_path)
-            self.cache_index.clear()
-            self.save_cache_index()
+            self.index.clear()
         except Exception as e:
             logger.error(f"Error clearing cache: {e}")
     
+    def expire(self, key: str) -> Any:
+        """
+        Sweeper handler: delete the entry if it is due; returns True when
+        deleted, its current expiry when it was refreshed, False if gone
+        """
+        cache_info = self.index.get(key)
+        if not cache_info:
+            return False
+        if not self._is_expired(cache_info):
+            return cache_info['expires_at']
+        return self.delete(key)
+    
+    def expiry_times(self):
+        """Sweeper discovery: (key, expires_at) for every indexed entry"""
+        return [(row['key'], row['expires_at']) for row in self.index.all()]
+    
     def cleanup_expired(self):
         """Clean up expired cache items"""
         try:
-            expired_keys = []
-            for key, cache_info in self.cache_index.items():
-                if self._is_expired(cache_info):
-                    expired_keys.append(key)
+            # مسح نطاقي على عمود expires_at المفهرس
+            expired = self.index.expired()
+            for cache_info in expired:
+                self.delete(cache_info['key'])
             
-            for key in expired_keys:
-                self.delete(key)
-            
-            logger.info(f"Cleaned up {len(expired_keys)} expired cache items")
+            logger.info(f"Cleaned up {len(expired)} expired cache items")
         except Exception as e:
             logger.error(f"Error cleaning up cache: {e}")
 
 
+class JobCancelled(Exception):
+    """The job was cancelled, or its lease was taken over by another worker"""
+
+
+class JobStore:
+    """
+    سجل المهام الدائم في SQLite (وضع WAL)
+    Durable job table shared by every worker process
+    
+    A job is queued, then claimed by one worker which holds a lease on it
+    and renews the lease with heartbeats while it runs. A job whose lease
+    ran out (its worker crashed, was killed by a reload, or hung) is
+    claimable again, up to max_attempts. Writes from a worker are guarded
+    by its owner id, so a worker that lost its lease cannot overwrite the
+    new owner's progress or result.
+    """
+    
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        " job_id TEXT PRIMARY KEY,"
+        " status TEXT NOT NULL,"
+        " progress INTEGER NOT NULL DEFAULT 0,"
+        " message TEXT NOT NULL DEFAULT '',"
+        " payload TEXT NOT NULL,"
+        " result TEXT,"
+        " error TEXT,"
+        " attempts INTEGER NOT NULL DEFAULT 0,"
+        " owner TEXT,"
+        " lease_until REAL NOT NULL DEFAULT 0,"
+        " heartbeat_at REAL,"
+        " created_at REAL NOT NULL,"
+        " updated_at REAL NOT NULL,"
+        " timings TEXT)",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status_lease ON jobs (status, lease_until)",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs (created_at)",
+    )
+    COLUMNS = ('job_id', 'status', 'progress', 'message', 'payload', 'result', 'error', 'attempts',
+               'owner', 'lease_until', 'heartbeat_at', 'created_at', 'updated_at', 'timings')
+    ACTIVE = ('queued', 'processing')
+    
+    def __init__(self, db_path: str, lease_seconds: float = 120.0, max_attempts: int = 3):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        # قاعدة البيانات تنشأ عند أول استخدام لا عند إنشاء الكائن
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+    
+    def _connect(self) -> sqlite3.Connection:
+        """اتصال لكل خيط (ولكل عملية بعد fork)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    self._create_schema(conn)
+                    self._schema_ready = True
+        return conn
+    
+    def _create_schema(self, conn: sqlite3.Connection):
+        """إنشاء الجداول وترقية السجلات القديمة"""
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+        # سجلات أنشئت قبل إضافة توقيتات المراحل
+        if 'timings' not in {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}:
+            try:
+                conn.execute('ALTER TABLE jobs ADD COLUMN timings TEXT')
+            except sqlite3.OperationalError:
+                pass  # أضافه عامل آخر في نفس اللحظة
+    
+    def _row(self, row) -> Optional[Dict]:
+        if row is None:
+            return None
+        job = dict(zip(self.COLUMNS, row))
+        job['payload'] = json.loads(job['payload'])
+        job['timings'] = json.loads(job['timings']) if job['timings'] else None
+        return job
+    
+    def create(self, job_id: str, payload: Dict, status: str = 'queued', result: str = None):
+        """إضافة مهمة جديدة - queued, or already completed for cache hits"""
+        now = time.time()
+        self._connect().execute(
+            "INSERT INTO jobs (job_id, status, progress, message, payload, result, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, status, 100 if status == 'completed' else 0,
+             'تم إنشاء الفيديو بنجاح' if status == 'completed' else 'بدء توليد الفيديو...',
+             json.dumps(payload, ensure_ascii=False), result, now, now)
+        )
+    
+    def get(self, job_id: str) -> Optional[Dict]:
+        return self._row(self._connect().execute(
+            f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone())
+    
+    def claim(self, owner: str, now: float = None) -> Optional[Dict]:
+        """
+        أخذ أقدم مهمة منتظرة أو يتيمة (انتهى عقدها) بشكل ذري
+        Atomically claim the oldest queued or orphaned job
+        """
+        now = now or time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # المهام التي استنفدت محاولاتها لا تعاد مرة أخرى
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', owner = NULL, updated_at = ?,"
+                " error = 'تجاوزت المهمة عدد المحاولات المسموح', message = 'فشل: توقف العامل عدة مرات'"
+                " WHERE status = 'processing' AND lease_until < ? AND attempts >= ?",
+                (now, now, self.max_attempts)
+            )
+            row = conn.execute(
+                "SELECT job_id FROM jobs WHERE status = 'queued'"
+                " OR (status = 'processing' AND lease_until < ?) ORDER BY created_at LIMIT 1", (now,)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'processing', owner = ?, lease_until = ?, heartbeat_at = ?,"
+                    " attempts = attempts + 1, updated_at = ? WHERE job_id = ?",
+                    (owner, now + self.lease_seconds, now, now, row[0])
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return self.get(row[0]) if row is not None else None
+    
+    def claimable(self, now: float = None) -> int:
+        """عدد المهام المنتظرة أو اليتيمة"""
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' OR (status = 'processing' AND lease_until < ?)",
+            (now or time.time(),)
+        ).fetchone()[0]
+    
+    def heartbeat(self, owner: str, now: float = None) -> int:
+        """تجديد عقود كل مهام العامل الجارية؛ يعيد عددها"""
+        now = now or time.time()
+        return self._connect().execute(
+            "UPDATE jobs SET lease_until = ?, heartbeat_at = ? WHERE owner = ? AND status = 'processing'",
+            (now + self.lease_seconds, now, owner)
+        ).rowcount
+    
+    def update(self, job_id: str, owner: str, progress: int, message: str, timings: Dict = None) -> bool:
+        """تحديث التقدم (وتوقيتات المراحل)؛ False إذا لم تعد المهمة جارية لدى هذا العامل"""
+        return self._connect().execute(
+            "UPDATE jobs SET progress = ?, message = ?, timings = COALESCE(?, timings), updated_at = ?"
+            " WHERE job_id = ? AND owner = ? AND status = 'processing'",
+            (progress, message, json.dumps(timings) if timings is not None else None, time.time(), job_id, owner)
+        ).rowcount > 0
+    
+    def finish(self, job_id: str, owner: str, status: str, result: str = None, error: str = None,
+               message: str = '') -> bool:
+        """إنهاء المهمة (completed أو failed) إذا كانت ما تزال لدى هذا العامل"""
+        return self._connect().execute(
+            "UPDATE jobs SET status = ?, progress = ?, message = ?, result = ?, error = ?, owner = NULL,"
+            " lease_until = 0, updated_at = ? WHERE job_id = ? AND owner = ? AND status = 'processing'",
+            (status, 100 if status == 'completed' else 0, message, result, error, time.time(), job_id, owner)
+        ).rowcount > 0
+    
+    def cancel(self, job_id: str) -> bool:
+        """إلغاء مهمة منتظرة أو جارية (العامل يتوقف عند التحديث التالي)"""
+        return self._connect().execute(
+            "UPDATE jobs SET status = 'cancelled', message = 'تم إلغاء المهمة', owner = NULL, lease_until = 0,"
+            " updated_at = ? WHERE job_id = ? AND status IN ('queued', 'processing')",
+            (time.time(), job_id)
+        ).rowcount > 0
+    
+    def delete(self, job_id: str) -> bool:
+        return self._connect().execute("DELETE FROM jobs WHERE job_id = ?", (job_id,)).rowcount > 0
+    
+    def created_times(self) -> List[tuple]:
+        """(job_id, created_at) لكل المهام"""
+        return self._connect().execute("SELECT job_id, created_at FROM jobs").fetchall()
+    
+    def older_than(self, cutoff: float) -> List[str]:
+        return [row[0] for row in self._connect().execute(
+            "SELECT job_id FROM jobs WHERE created_at < ?", (cutoff,)
+        ).fetchall()]
+    
+    def stats(self) -> Dict:
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+
 class AsyncVideoGenerator:
     """
     مولد الفيديو غير المتزامن لتحسين الأداء
     Async Video Generator for Performance Optimization
+    
+    Jobs live in a JobStore rather than in process memory, so any worker
+    process can answer for any job and a restart loses nothing. One
+    monitor thread renews the leases of running jobs and picks up queued
+    or orphaned jobs. A re-queued job runs again from the start, but the
+    stage caches make already finished stages cheap.
+    
+    JOB_QUEUE['worker_mode'] picks where up to max_parallel_jobs jobs run:
+    'thread' runs them on an executor inside this process; 'process'
+    starts render worker processes (spawned, so they share neither the
+    GIL nor the web server's memory) that claim jobs from the same store.
+    A worker process exits after worker_max_jobs jobs or once its peak RSS
+    passes worker_recycle_rss_mb, and the monitor starts a fresh one while
+    jobs are waiting. worker_memory_limit_mb optionally caps its virtual
+    address space as well.
     """
     
-    def __init__(self):
+    WORKER_CONTEXT = 'spawn'
+    # مدخلات الطلبات تشير إلى ملفات OUTPUT_FOLDER المحلية فلا تصدر مع أرشيف التخزين
+    REQUEST_KEY_PREFIX = 'request_'
+    
+    def __init__(self, artifacts: 'StagedArtifactCache' = None, jobs: 'JobStore' = None):
+        queue_settings = getattr(config, 'JOB_QUEUE', {})
         self.cache = CacheManager()
-        self.active_jobs = {}
-        self.job_progress = {}
-        self.executor = ThreadPoolExecutor(
-            max_workers=config.AI_VIDEO_SETTINGS.get('max_parallel_jobs', 3)
+        self.artifacts = artifacts or StagedArtifactCache()
+        self.jobs = jobs or JobStore(
+            queue_settings.get('db_path', os.path.join(config.CACHE_FOLDER, 'jobs.db')),
+            lease_seconds=queue_settings.get('lease_seconds', 120),
+            max_attempts=queue_settings.get('max_attempts', 3)
         )
+        self._host = socket.gethostname()
+        self.heartbeat_interval = queue_settings.get('heartbeat_interval', 30)
+        self.poll_interval = queue_settings.get('poll_interval', 5)
+        self.sweeper = None
+        self.job_retention = getattr(config, 'CACHE_SWEEPER', {}).get('job_retention_hours', 24) * 3600
+        self.max_workers = config.AI_VIDEO_SETTINGS.get('max_parallel_jobs', 3)
+        self.mode = queue_settings.get('worker_mode', 'thread')
+        self.worker_max_jobs = queue_settings.get('worker_max_jobs', 20)
+        self.worker_memory_limit_mb = queue_settings.get('worker_memory_limit_mb', 0)
+        self.worker_recycle_rss_mb = queue_settings.get('worker_recycle_rss_mb', 0)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._in_flight = 0
+        self._workers = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._monitor = None
+        self._monitor_pid = None
+    
+    @property
+    def owner(self) -> str:
+        """معرف هذا العامل في سجل المهام (يتغير بعد fork)"""
+        return f"{self._host}:{os.getpid()}"
     
     async def generate_video_async(self, hadith_data: Dict, options: Dict = None) -> Dict:
         """
         Generate video asynchronously with progress tracking
         """
         job_id = self._generate_job_id()
-        self.job_progress[job_id] = {
-            'status': 'initializing',
-            'progress': 0,
-            'message': 'بدء توليد الفيديو...',
-            'start_time': time.time()
-        }
+        payload = {'hadith': hadith_data, 'options': options or {}}
         
         try:
-            # Check cache first
-            cache_key = self.cache._generate_key(hadith_data)
+            # Check cache first (the request key covers the options, not just the hadith)
+            cache_key = self._request_key(hadith_data, options)
             cached_result = self.cache.get(cache_key)
-            
+            video_path = None
             if cached_result and config.AI_VIDEO_SETTINGS.get('cache_enabled', True):
+                video_path = self._cached_video(cached_result)
+                if video_path is None:
+                    # الملف الناتج حذف ولم يعد في مخزن المراحل: توليد من جديد
+                    self.cache.delete(cache_key)
+            
+            if video_path:
                 logger.info("استخدام فيديو محفوظ مؤقتاً")
+                self.jobs.create(job_id, payload, status='completed', result=video_path)
+                self._schedule_expiry(job_id)
                 return {
                     'success': True,
                     'job_id': job_id,
-                    'video_path': cached_result.decode('utf-8') if isinstance(cached_result, bytes) else cached_result,
+                    'video_path': video_path,
                     'cached': True
                 }
             
-            # Start async generation
-            future = self.executor.submit(self._generate_video_sync, hadith_data, job_id, options)
-            self.active_jobs[job_id] = future
+            # Queue the job; any worker process may run it
+            self.jobs.create(job_id, payload)
+            self._schedule_expiry(job_id)
+            self.start()
+            self._dispatch()
             
             return {
                 'success': True,
@@ -235,155 +710,633 @@ class AsyncVideoGenerator:
         
         except Exception as e:
             logger.error(f"Error starting async video generation: {e}")
-            self.job_progress[job_id] = {
-                'status': 'failed',
-                'progress': 0,
-                'message': f'فشل في بدء توليد الفيديو: {str(e)}',
-                'error': str(e)
-            }
             return {'success': False, 'error': str(e)}
     
+    def _schedule_expiry(self, job_id: str):
+        if self.sweeper:
+            self.sweeper.schedule('jobs', job_id, time.time() + self.job_retention)
+    
+    def _request_key(self, hadith_data: Dict, options: Dict = None) -> str:
+        """Cache key of a whole request: the hadith and every generation option"""
+        return self.REQUEST_KEY_PREFIX + self.cache._generate_key({'hadith': hadith_data, 'options': options or {}})
+    
+    def _cached_video(self, cached_result: Any) -> Optional[str]:
+        """
+        اسم الفيديو المحفوظ لطلب سابق إذا كان ملفه موجوداً
+        Output filename of a cached request, if the file still exists
+        
+        A missing output (removed by the output retention, or a request
+        entry from another node) is restored from the final stage store
+        when it is still there; otherwise the request has to run again.
+        """
+        value = cached_result.decode('utf-8') if isinstance(cached_result, bytes) else cached_result
+        try:
+            entry = json.loads(value)
+        except ValueError:
+            entry = {'video': value}  # مدخلات قديمة: اسم الملف فقط
+        if not isinstance(entry, dict) or not entry.get('video'):
+            return None
+        
+        output_path = os.path.join(config.OUTPUT_FOLDER, os.path.basename(entry['video']))
+        if os.path.exists(output_path):
+            return entry['video']
+        if entry.get('final_key') and self.artifacts.materialize('final', entry['final_key'], '.mp4', output_path):
+            logger.info("استعادة الفيديو المحفوظ من مخزن المراحل")
+            return entry['video']
+        return None
+    
     def _generate_job_id(self) -> str:
-        """Generate unique job ID"""
-        return f"job_{int(time.time())}_{os.getpid()}"
-    
-    def _update_progress(self, job_id: str, progress: int, message: str = None, status: str = None):
-        """Update job progress"""
-        if job_id in self.job_progress:
-            self.job_progress[job_id].update({
-                'progress': progress,
-                'message': message or self.job_progress[job_id].get('message', ''),
-                'status': status or self.job_progress[job_id].get('status', 'processing'),
-                'updated_at': time.time()
-            })
+        """Generate unique job ID (random, so concurrent submissions never collide)"""
+        return f"job_{uuid.uuid4().hex}"
+    
+    def start(self):
+        """بدء خيط المراقبة (مرة واحدة): نبضات العقود واستئناف المهام اليتيمة"""
+        with self._lock:
+            if self._monitor is not None and self._monitor_pid == os.getpid():
+                return
+            self._monitor_pid = os.getpid()
+            self._stop.clear()
+            self._monitor = threading.Thread(target=self._monitor_loop, name='job-monitor', daemon=True)
+            self._monitor.start()
+    
+    def stop(self):
+        """إيقاف المراقبة وعمليات العمل (مهامها الجارية تعود للطابور بعد انتهاء عقودها)"""
+        self._stop.set()
+        with self._lock:
+            monitor, self._monitor = self._monitor, None
+            workers, self._workers = self._workers, []
+        if monitor:
+            monitor.join(timeout=5)
+        for worker in workers:
+            worker.terminate()
+            worker.join(timeout=5)
+    
+    def _worker_owners(self) -> List[str]:
+        """معرفات عمليات العمل الحية (بعد إزالة المنتهية)"""
+        with self._lock:
+            self._workers = [worker for worker in self._workers if worker.is_alive()]
+            return [f"{self._host}:{worker.pid}" for worker in self._workers]
+    
+    def _monitor_loop(self):
+        next_heartbeat = 0.0
+        while not self._stop.is_set():
+            try:
+                now = time.time()
+                if now >= next_heartbeat:
+                    # عمليات العمل لا تجدد عقودها بنفسها: إذا توقفت هذه العملية تعود مهامها للطابور
+                    for owner in [self.owner] + self._worker_owners():
+                        self.jobs.heartbeat(owner, now)
+                    next_heartbeat = now + self.heartbeat_interval
+                if self.jobs.claimable(now):
+                    self._dispatch()
+            except Exception as e:
+                logger.error(f"Error in job monitor: {e}")
+            self._stop.wait(min(self.heartbeat_interval, self.poll_interval))
+    
+    def _dispatch(self):
+        """Start one worker per free slot; each runs claimable jobs until none are left"""
+        if self.mode == 'process':
+            self._spawn_workers()
+            return
+        with self._lock:
+            free = self.max_workers - self._in_flight
+            self._in_flight += free
+        for _ in range(free):
+            self.executor.submit(self._work)
+    
+    def _spawn_workers(self):
+        """بدء عمليات عمل بقدر المهام المنتظرة (بدء العملية مكلف فلا تبدأ عمليات فارغة)"""
+        self._worker_owners()
+        with self._lock:
+            needed = min(self.max_workers - len(self._workers), self.jobs.claimable())
+            context = multiprocessing.get_context(self.WORKER_CONTEXT)
+            for _ in range(max(needed, 0)):
+                worker = context.Process(
+                    target=_render_worker, name='render-worker', daemon=True,
+                    args=(self.jobs.db_path, self.jobs.lease_seconds, self.jobs.max_attempts,
+                          self.worker_max_jobs, self.worker_memory_limit_mb, self.worker_recycle_rss_mb)
+                )
+                worker.start()
+                self._workers.append(worker)
+    
+    def _work(self):
+        try:
+            self.run_worker()
+        except Exception as e:
+            logger.error(f"Error in job worker: {e}")
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+    
+    def run_worker(self, max_jobs: int = 0, recycle_rss_mb: float = 0) -> int:
+        """
+        تشغيل المهام المتاحة حتى نفادها أو حتى موعد إعادة التدوير
+        Run claimable jobs until none are left, max_jobs ran or the peak
+        RSS passed recycle_rss_mb; returns how many jobs ran
+        """
+        done = 0
+        while not self._stop.is_set():
+            job = self.jobs.claim(self.owner)
+            if job is None:
+                break
+            self._run_job(job)
+            done += 1
+            if max_jobs and done >= max_jobs:
+                logger.info(f"إعادة تدوير عامل العرض بعد {done} مهمة")
+                break
+            if recycle_rss_mb and peak_rss_mb() > recycle_rss_mb:
+                logger.info(f"إعادة تدوير عامل العرض: ذروة الذاكرة {peak_rss_mb():.0f} MB")
+                break
+        return done
+    
+    def _run_job(self, job: Dict):
+        """تشغيل مهمة مأخوذة وتسجيل نتيجتها"""
+        job_id = job['job_id']
+        if job['attempts'] > 1:
+            logger.info(f"استئناف مهمة يتيمة {job_id} (المحاولة {job['attempts']})")
+        try:
+            result = self._generate_video_sync(job['payload']['hadith'], job_id, job['payload']['options'])
+        except JobCancelled:
+            logger.info(f"توقفت المهمة {job_id}: ألغيت أو انتقلت إلى عامل آخر")
+            return
+        except Exception as e:
+            self.jobs.finish(job_id, self.owner, 'failed', error=str(e), message=f'فشل: {str(e)}')
+            return
+        self.jobs.finish(job_id, self.owner, 'completed', result=result, message='تم إنشاء الفيديو بنجاح')
+    
+    def _update_progress(self, job_id: str, progress: int, message: str = None, timings: Dict = None):
+        """Update job progress; raises JobCancelled if this worker no longer owns the job"""
+        if not self.jobs.update(job_id, self.owner, progress, message or '', timings):
+            if self.jobs.get(job_id) is not None:
+                raise JobCancelled(job_id)
+    
+    STAGE_MESSAGES = {
+        'audio': "تم توليد الملف الصوتي بنجاح",
+        'download': "تم تحميل فيديو الخلفية بنجاح",
+        'enhance': "تم تجهيز فيديو الخلفية",
+        'render': "تم إنشاء الفيديو النهائي",
+    }
     
     def _generate_video_sync(self, hadith_data: Dict, job_id: str, options: Dict = None) -> str:
         """
         Synchronous video generation with progress updates
+        
+        The stages run as a StageGraph: TTS and the background download
+        start together on the I/O pool, enhancement and the final render
+        run on the CPU pool as soon as their inputs exist. Progress moves
+        with every finished stage and the per-stage timings are stored
+        with the job.
         """
         try:
-            from main import generate_audio, download_background_video, create_hadith_video
-            
-            # Step 1: Generate audio (30%)
-            self._update_progress(job_id, 10, "توليد الملف الصوتي...")
-            audio_path = os.path.join(config.TEMP_FOLDER, f'audio_{job_id}.mp3')
-            audio_result = generate_audio(None, audio_path, hadith_data=hadith_data)
+            from main import (generate_audio, download_background_video, enhance_background, create_hadith_video,
+                              video_render_signature, job_work_dir)
+            options = options or {}
             
-            if not audio_result:
-                raise Exception("فشل في توليد الصوت")
+            def audio_stage():
+                # the TTS stage is cached by text, voice and enhancement
+                audio_result = generate_audio(None, os.path.join(work_dir, 'audio.mp3'), hadith_data=hadith_data)
+                if not audio_result:
+                    raise Exception("فشل في توليد الصوت")
+                return audio_result
             
-            self._update_progress(job_id, 30, "تم توليد الملف الصوتي بنجاح")
+            def download_stage():
+                background_video = download_background_video(options.get('video_type'), work_dir)
+                if not background_video:
+                    raise Exception("فشل في تحميل فيديو الخلفية")
+                return background_video
             
-            # Step 2: Get background video (60%)
-            self._update_progress(job_id, 40, "تحميل فيديو الخلفية...")
-            video_type = options.get('video_type') if options else None
-            background_video = download_background_video(video_type)
+            def enhance_stage(background_video):
+                # enhancement is cached by source hash and settings
+                return enhance_background(background_video, options.get('enhance_locally', True))
             
-            if not background_video:
-                raise Exception("فشل في تحميل فيديو الخلفية")
-            
-            self._update_progress(job_id, 60, "تم تحميل فيديو الخلفية بنجاح")
-            
-            # Step 3: Create final video (90%)
-            self._update_progress(job_id, 70, "إنشاء الفيديو النهائي...")
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            output_filename = f"hadith_video_{timestamp}_{job_id[-8:]}.mp4"
-            output_path = os.path.join(config.OUTPUT_FOLDER, output_filename)
+            def render_stage(audio_result, background_video):
+                # keyed by the upstream artifacts, not the request
+                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                output_filename = f"hadith_video_{timestamp}_{job_id[-8:]}.mp4"
+                output_path = os.path.join(config.OUTPUT_FOLDER, output_filename)
+                
+                final_key = self.artifacts.render_final(
+                    audio_result, background_video, output_path,
+                    lambda music_seed: video_render_signature(hadith_data, music_seed),
+                    lambda music_seed: create_hadith_video(hadith_data, background_video, audio_result, output_path,
+                                                           music_seed=music_seed, work_dir=work_dir)
+                )
+                if not final_key:
+                    raise Exception("فشل في إنشاء الفيديو النهائي")
+                return {'video': output_filename, 'final_key': final_key}
             
-            video_result = create_hadith_video(hadith_data, background_video, audio_path, output_path)
+            graph = StageGraph()
+            graph.add('audio', audio_stage)
+            graph.add('download', download_stage)
+            graph.add('enhance', enhance_stage, deps=('download',), pool='cpu')
+            graph.add('render', render_stage, deps=('audio', 'enhance'), pool='cpu')
+            finished = []
             
-            if not video_result:
-                raise Exception("فشل في إنشاء الفيديو النهائي")
+            def stage_done(name, result):
+                finished.append(name)
+                self._update_progress(job_id, 10 + 85 * len(finished) // len(graph.stages),
+                                      self.STAGE_MESSAGES[name], graph.report())
             
-            # Cache the result
-            cache_key = self.cache._generate_key(hadith_data)
-            self.cache.set(cache_key, output_filename)
+            # كل الملفات الوسيطة في مجلد خاص بالمهمة يحذف عند انتهائها
+            with job_work_dir(job_id) as work_dir:
+                self._update_progress(job_id, 10, "توليد الملف الصوتي وتحميل فيديو الخلفية...")
+                rendered = graph.run(stage_done)['render']
             
-            self._update_progress(job_id, 100, "تم إنشاء الفيديو بنجاح", "completed")
+            # Cache the result (with the final stage key, to restore a removed output)
+            self.cache.set(self._request_key(hadith_data, options), json.dumps(rendered))
             
-            # Cleanup
-            if os.path.exists(audio_path):
-                os.remove(audio_path)
+            self._update_progress(job_id, 100, "تم إنشاء الفيديو بنجاح", graph.report())
             
-            return output_filename
+            return rendered['video']
             
+        except JobCancelled:
+            raise
         except Exception as e:
             logger.error(f"Error in sync video generation: {e}")
-            self._update_progress(job_id, 0, f"فشل: {str(e)}", "failed")
-            raise e
+            raise
     
     def get_job_status(self, job_id: str) -> Dict:
-        """Get job status and progress"""
-        if job_id not in self.job_progress:
+        """Get job status and progress (from any worker process)"""
+        job = self.jobs.get(job_id)
+        if job is None:
             return {'error': 'Job not found'}
         
-        progress_info = self.job_progress[job_id].copy()
-        
-        # Check if job is completed
-        if job_id in self.active_jobs:
-            future = self.active_jobs[job_id]
-            if future.done():
-                try:
-                    result = future.result()
-                    progress_info.update({
-                        'status': 'completed',
-                        'progress': 100,
-                        'result': result,
-                        'message': 'تم إنشاء الفيديو بنجاح'
-                    })
-                except Exception as e:
-                    progress_info.update({
-                        'status': 'failed',
-                        'progress': 0,
-                        'error': str(e),
-                        'message': f'فشل: {str(e)}'
-                    })
-                
-                # Cleanup completed job
-                del self.active_jobs[job_id]
-        
+        # أي عامل يجيب عن الحالة يستأنف المهام اليتيمة أيضاً
+        self.start()
+        progress_info = {
+            'status': job['status'],
+            'progress': job['progress'],
+            'message': job['message'],
+            'start_time': job['created_at'],
+            'updated_at': job['updated_at'],
+            'attempts': job['attempts']
+        }
+        if job['timings']:
+            progress_info['timings'] = job['timings']
+        if job['status'] == 'completed':
+            progress_info['result'] = job['result']
+        elif job['status'] == 'failed':
+            progress_info['failure'] = job['error']
         return progress_info
     
     def cancel_job(self, job_id: str) -> bool:
-        """Cancel a running job"""
+        """Cancel a queued or running job"""
         try:
-            if job_id in self.active_jobs:
-                future = self.active_jobs[job_id]
-                cancelled = future.cancel()
-                if cancelled:
-                    del self.active_jobs[job_id]
-                    self.job_progress[job_id].update({
-                        'status': 'cancelled',
-                        'message': 'تم إلغاء المهمة'
-                    })
-                return cancelled
-            return False
+            return self.jobs.cancel(job_id)
         except Exception as e:
             logger.error(f"Error cancelling job: {e}")
             return False
     
+    def expire_job(self, job_id: str) -> Any:
+        """
+        Sweeper handler: drop a finished job record once it is older than
+        job_retention; queued and running jobs are checked again later
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            return False
+        due = job['created_at'] + self.job_retention
+        if due > time.time():
+            return due
+        if job['status'] in JobStore.ACTIVE:
+            return time.time() + self.job_retention
+        return self.jobs.delete(job_id)
+    
+    def job_expiry_times(self):
+        """Sweeper discovery: (job_id, due) for every job record"""
+        return [(job_id, created_at + self.job_retention) for job_id, created_at in self.jobs.created_times()]
+    
     def cleanup_old_jobs(self, max_age_hours: int = 24):
         """Clean up old job records"""
         try:
-            cutoff_time = time.time() - (max_age_hours * 3600)
-            old_jobs = []
-            
-            for job_id, progress in self.job_progress.items():
-                start_time = progress.get('start_time', 0)
-                if start_time < cutoff_time:
-                    old_jobs.append(job_id)
-            
+            old_jobs = self.jobs.older_than(time.time() - (max_age_hours * 3600))
             for job_id in old_jobs:
-                if job_id in self.active_jobs:
-                    self.cancel_job(job_id)
-                if job_id in self.job_progress:
-                    del self.job_progress[job_id]
+                self.jobs.cancel(job_id)
+                self.jobs.delete(job_id)
             
             logger.info(f"Cleaned up {len(old_jobs)} old jobs")
         except Exception as e:
             logger.error(f"Error cleaning up jobs: {e}")
 
 
+def peak_rss_mb() -> float:
+    """ذروة ذاكرة هذه العملية بالميغابايت (0 إذا لم تتوفر)"""
+    if not RESOURCE_AVAILABLE:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # كيلوبايت على Linux وبايت على macOS
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def _limit_memory(limit_mb: float):
+    """
+    حد صارم لمساحة العناوين الافتراضية (RLIMIT_AS) لهذه العملية
+    Cap this process's virtual address space
+    
+    This is not an RSS limit: thread stacks and malloc arenas reserve
+    address space long before it is used, so set it well above the real
+    memory budget (worker_recycle_rss_mb bounds RSS). Child processes such
+    as ffmpeg inherit the same limit each, not a share of it. Exceeding it
+    raises MemoryError, which fails the current job only.
+    """
+    if not limit_mb or not RESOURCE_AVAILABLE:
+        return
+    limit = int(limit_mb * 1024 * 1024)
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _render_worker(db_path: str, lease_seconds: float, max_attempts: int, max_jobs: int,
+                   memory_limit_mb: float, recycle_rss_mb: float):
+    """
+    نقطة دخول عملية العمل: حد الذاكرة ثم المهام حتى نفادها أو إعادة التدوير
+    Entry point of a render worker process
+    """
+    _limit_memory(memory_limit_mb)
+    try:
+        # استيراد خط المعالجة مرة واحدة لكل عامل قبل أخذ أي مهمة
+        import main  # noqa: F401
+    except Exception as e:
+        logger.error(f"تعذر تحميل خط المعالجة في عامل العرض: {e}")
+    generator = AsyncVideoGenerator(artifact_cache, JobStore(db_path, lease_seconds, max_attempts))
+    try:
+        done = generator.run_worker(max_jobs, recycle_rss_mb)
+        logger.info(f"انتهى عامل العرض {generator.owner} بعد {done} مهمة")
+    finally:
+        generator.executor.shutdown(wait=False)
+
+
+def hash_file(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Hash file contents (sha256) without loading the whole file"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ContentAddressedStore:
+    """
+    مخزن دائم للملفات الناتجة مفهرس بمحتوى المدخلات
+    Persistent content-addressed store for derived artifacts
+    
+    Keys are derived from the exact inputs (file hashes and canonicalized
+    settings), so a hit is always safe to reuse as-is.
+    """
+    
+    def __init__(self, namespace: str, root_dir: str = None):
+        self.root_dir = root_dir or getattr(config, 'CACHE_FOLDER', 'cache')
+        # المجلد ينشأ عند أول تخزين
+        self.store_dir = os.path.join(self.root_dir, namespace)
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """Build a stable key from strings, numbers and JSON-serializable settings"""
+        canonical = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+    
+    def path_for(self, key: str, ext: str = '') -> str:
+        """Storage path of a key (whether or not it exists yet)"""
+        return os.path.join(self.store_dir, f"{key}{ext}")
+    
+    def get(self, key: str, ext: str = '') -> Optional[str]:
+        """Return the stored file path for a key, or None on a miss"""
+        path = self.path_for(key, ext)
+        if os.path.exists(path):
+            self.hits += 1
+            try:
+                os.utime(path, None)  # track last use for retention
+            except OSError:
+                pass
+            return path
+        self.misses += 1
+        return None
+    
+    def put(self, key: str, source_path: str, ext: str = '', move: bool = False) -> Optional[str]:
+        """
+        Store a file under a key; the write is atomic so readers never see
+        partial files. Without move the file is hard-linked (copied only
+        across filesystems), so a large video is not kept on disk twice.
+        On failure the source is left where it was.
+        """
+        try:
+            os.makedirs(self.store_dir, exist_ok=True)
+            path = self.path_for(key, ext)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            if move:
+                shutil.move(source_path, tmp_path)
+            else:
+                try:
+                    os.link(source_path, tmp_path)
+                except OSError:
+                    shutil.copy2(source_path, tmp_path)
+            try:
+                os.replace(tmp_path, path)
+            except Exception:
+                # إعادة الملف المنقول إلى مكانه حتى يستخدمه المستدعي كما لو لم يخزن
+                if move:
+                    shutil.move(tmp_path, source_path)
+                else:
+                    os.remove(tmp_path)
+                raise
+            return path
+        except Exception as e:
+            logger.error(f"Error storing artifact {key}: {e}")
+            return None
+    
+    def files(self) -> List[str]:
+        """Names of the stored files (none before the first put)"""
+        if not os.path.isdir(self.store_dir):
+            return []
+        return [f for f in os.listdir(self.store_dir) if not f.endswith('.tmp')]
+    
+    def stats(self) -> Dict:
+        """Store statistics"""
+        files = self.files()
+        return {
+            'items': len(files),
+            'size_bytes': sum(os.path.getsize(os.path.join(self.store_dir, f)) for f in files),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+class EnhancedVideoCache:
+    """
+    تخزين دائم لفيديوهات الخلفية المحسنة
+    Persistent cache of locally enhanced background videos
+    
+    Keyed by (source file hash, canonicalized LOCAL_VIDEO_ENHANCEMENT settings).
+    """
+    
+    def __init__(self):
+        self.store = ContentAddressedStore('enhanced_backgrounds')
+    
+    def make_key(self, source_path: str, settings: Dict) -> str:
+        """Cache key for an enhancement of a source video"""
+        return self.store.make_key('enhanced_background', hash_file(source_path), settings or {})
+    
+    def get_or_enhance(self, source_path: str, settings: Dict, enhance_fn) -> str:
+        """
+        Return the cached enhancement of source_path, running enhance_fn(source_path, settings)
+        only on a miss. Falls back to the source video if enhancement fails.
+        """
+        try:
+            key = self.make_key(source_path, settings)
+        except Exception as e:
+            logger.error(f"Error hashing background video: {e}")
+            return enhance_fn(source_path, settings) or source_path
+        
+        cached = self.store.get(key, '.mp4')
+        if cached:
+            logger.info("استخدام فيديو خلفية محسن محفوظ مسبقاً")
+            return cached
+        
+        enhanced_path = enhance_fn(source_path, settings)
+        if not enhanced_path or enhanced_path == source_path or not os.path.exists(enhanced_path):
+            return source_path
+        
+        stored = self.store.put(key, enhanced_path, '.mp4', move=True)
+        return stored or enhanced_path
+
+
+class TTSAudioCache:
+    """
+    تخزين دائم للصوت المولد (بعد التحسين المحلي)
+    Persistent cache of synthesized and locally enhanced speech
+    
+    Keyed by (prepared text, provider, voice settings, LOCAL_AUDIO_ENHANCEMENT
+    settings), so a hit skips both the TTS request and enhance_audio. Word
+    timings, when the provider reports them, are stored under the same key.
+    """
+    
+    def __init__(self):
+        self.store = ContentAddressedStore('tts_audio')
+    
+    def make_key(self, text: str, provider: str, voice_settings: Dict, enhancement_settings: Dict = None) -> str:
+        """Cache key for one synthesis"""
+        return self.store.make_key('tts_audio', text, provider, voice_settings or {}, enhancement_settings)
+    
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached audio file for a key, or None on a miss"""
+        cached = self.store.get(key, '.mp3')
+        if cached:
+            logger.info("استخدام ملف صوتي محفوظ مسبقاً")
+        return cached
+    
+    def put(self, key: str, audio_path: str) -> str:
+        """Store a finished audio file; returns the cached path (or audio_path if storing failed)"""
+        if not audio_path or not os.path.exists(audio_path):
+            return audio_path
+        
+        timings = os.path.splitext(audio_path)[0] + '.timings.json'
+        if os.path.exists(timings):
+            self.store.put(key, timings, '.timings.json', move=True)
+        return self.store.put(key, audio_path, '.mp3', move=True) or audio_path
+
+
+class StagedArtifactCache:
+    """
+    مخزن مراحل خط إنتاج الفيديو
+    Per-stage artifact cache for the video pipeline
+    
+    Every stage (audio, background, overlay, final) has its own
+    content-addressed store keyed by that stage's exact inputs. The final
+    key includes the content hash of the audio and background artifacts
+    instead of the request, so changing only the background re-renders the
+    video but reuses the cached speech and text overlays, and vice versa.
+    """
+    
+    STAGES = ('audio', 'background', 'overlay', 'final')
+    
+    def __init__(self, stores: Dict[str, ContentAddressedStore] = None, root_dir: str = None):
+        stores = stores or {}
+        self.stores = {
+            stage: stores.get(stage) or ContentAddressedStore(f'stage_{stage}', root_dir=root_dir)
+            for stage in self.STAGES
+        }
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+    
+    def key(self, stage: str, *parts: Any) -> str:
+        """Cache key of a stage from its exact inputs"""
+        return self.stores[stage].make_key(stage, *parts)
+    
+    def fingerprint(self, file_path: str) -> str:
+        """
+        Content hash of an upstream artifact, memoized by (path, size, mtime)
+        so a cached file is hashed once per process
+        """
+        stat = os.stat(file_path)
+        memo_key = (os.path.realpath(file_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            cached = self._fingerprints.get(memo_key)
+        if cached is None:
+            cached = hash_file(file_path)
+            with self._lock:
+                self._fingerprints[memo_key] = cached
+        return cached
+    
+    def get(self, stage: str, key: str, ext: str = '') -> Optional[str]:
+        """Return the stored artifact of a stage, or None on a miss"""
+        return self.stores[stage].get(key, ext)
+    
+    def put(self, stage: str, key: str, source_path: str, ext: str = '', move: bool = False) -> Optional[str]:
+        """Store the artifact of a stage"""
+        return self.stores[stage].put(key, source_path, ext, move)
+    
+    def materialize(self, stage: str, key: str, ext: str, dest_path: str) -> Optional[str]:
+        """
+        Place a cached artifact at dest_path (hard link, or copy across devices);
+        returns dest_path on a hit, None on a miss
+        """
+        cached = self.get(stage, key, ext)
+        if not cached:
+            return None
+        try:
+            tmp_path = f"{dest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                os.link(cached, tmp_path)
+            except OSError:
+                shutil.copy2(cached, tmp_path)
+            os.replace(tmp_path, dest_path)
+            return dest_path
+        except Exception as e:
+            logger.error(f"Error materializing {stage} artifact {key}: {e}")
+            return None
+    
+    def render_final(self, audio_path: str, background_path: str, output_path: str, signature, render) -> Optional[str]:
+        """
+        Place the final video for these inputs at output_path, from the
+        final stage store on a hit or by calling render(music_seed) on a
+        miss (the render is then stored). signature(music_seed) returns the
+        render settings that enter the key.
+        
+        Returns:
+            the final stage key, or None if rendering failed
+        """
+        audio_hash = self.fingerprint(audio_path)
+        # بذرة الموسيقى مشتقة من الصوت لتكون النتيجة ثابتة لنفس المدخلات
+        music_seed = int(audio_hash[:8], 16)
+        final_key = self.key('final', audio_hash, self.fingerprint(background_path), signature(music_seed))
+        
+        if self.materialize('final', final_key, '.mp4', output_path):
+            logger.info("استخدام فيديو نهائي محفوظ لنفس الصوت والخلفية")
+            return final_key
+        if not render(music_seed):
+            return None
+        self.put('final', final_key, output_path, '.mp4')
+        return final_key
+    
+    def stats(self) -> Dict:
+        """Per-stage store statistics"""
+        return {stage: store.stats() for stage, store in self.stores.items()}
+
+
 class BackgroundVideoCache:
     """
     تخزين مؤقت لفيديوهات الخلفية لتحسين الأداء
@@ -392,9 +1345,10 @@ class BackgroundVideoCache:
     
     def __init__(self):
         self.cache_dir = os.path.join(config.TEMP_FOLDER, 'bg_videos')
-        os.makedirs(self.cache_dir, exist_ok=True)
         self.cache_info = {}
         self.max_cache_size = 10  # Maximum number of cached videos
+        self.ttl = getattr(config, 'CACHE_SWEEPER', {}).get('bg_video_ttl_hours', 24) * 3600
+        self.sweeper = None
     
     def get_cached_video(self, query: str) -> Optional[str]:
         """Get cached background video"""
@@ -405,7 +1359,7 @@ class BackgroundVideoCache:
             if os.path.exists(cache_path):
                 # Check if cache is still valid (24 hours)
                 cache_age = time.time() - os.path.getmtime(cache_path)
-                if cache_age < 86400:  # 24 hours
+                if cache_age < self.ttl:
                     logger.info(f"استخدام فيديو خلفية محفوظ مؤقتاً: {query}")
                     return cache_path
                 else:
@@ -424,7 +1378,7 @@ class BackgroundVideoCache:
             cache_path = os.path.join(self.cache_dir, f"{cache_key}.mp4")
             
             # Copy video to cache
-            import shutil
+            os.makedirs(self.cache_dir, exist_ok=True)
             shutil.copy2(video_path, cache_path)
             
             # Update cache info
@@ -435,6 +1389,9 @@ class BackgroundVideoCache:
                 'size': os.path.getsize(cache_path)
             }
             
+            if self.sweeper:
+                self.sweeper.schedule('bg_videos', cache_path, time.time() + self.ttl)
+            
             # Cleanup old cache if needed
             self._cleanup_old_cache()
             
@@ -468,7 +1425,372 @@ class BackgroundVideoCache:
             logger.error(f"Error cleaning up cache: {e}")
 
 
+class ExpirySweeper:
+    """
+    مجدول الانتهاء في الخلفية - Background expiry sweeper
+    
+    One daemon thread keeps a min-heap of (due time, kind, key). Each kind
+    (cache items, background videos, job records, temp files, outputs)
+    registers a handler that re-checks one entry and evicts it only if it
+    is really due. The handler returns True when evicted, a new due time
+    when the entry was refreshed, or False when it is already gone. The
+    thread sleeps until the earliest due time, so each wake-up touches
+    exactly the due entries. A periodic discovery pass picks up entries
+    created by other processes or found on disk after a restart.
+    """
+    
+    def __init__(self, rescan_interval: float = 600.0, batch_size: int = 500):
+        self.rescan_interval = rescan_interval
+        self.batch_size = batch_size
+        self._heap = []
+        self._scheduled = {}
+        self._sources = {}
+        self._metrics = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._pid = None
+        self._next_rescan = 0.0
+        self.runs = 0
+        self.last_sweep_ms = 0.0
+    
+    def register(self, kind: str, handler, discover=None):
+        """تسجيل نوع من المدخلات مع دالة الإزالة ودالة الاكتشاف"""
+        self._sources[kind] = (handler, discover)
+        self._metrics.setdefault(kind, {'scheduled': 0, 'evicted': 0, 'rescheduled': 0, 'stale': 0, 'errors': 0})
+    
+    def schedule(self, kind: str, key: str, due: float):
+        """جدولة مدخل؛ يُحتفظ بأقرب موعد فقط لكل مفتاح"""
+        with self._cond:
+            current = self._scheduled.get((kind, key))
+            if current is not None and current <= due:
+                return
+            self._scheduled[(kind, key)] = due
+            heapq.heappush(self._heap, (due, kind, key))
+            self._metrics.setdefault(kind, {'scheduled': 0, 'evicted': 0, 'rescheduled': 0, 'stale': 0, 'errors': 0})
+            self._metrics[kind]['scheduled'] += 1
+            if self._heap[0][0] == due:
+                self._cond.notify()
+    
+    def discover(self):
+        """جمع مواعيد الانتهاء من كل المصادر"""
+        for kind, (_, discover) in list(self._sources.items()):
+            if discover is None:
+                continue
+            try:
+                for key, due in discover():
+                    self.schedule(kind, key, due)
+            except Exception as e:
+                logger.error(f"Error discovering {kind} expiry times: {e}")
+        self._next_rescan = time.time() + self.rescan_interval
+    
+    def sweep(self, now: float = None) -> int:
+        """إزالة المدخلات المستحقة فقط؛ يعيد عدد ما أزيل"""
+        started = time.perf_counter()
+        now = now or time.time()
+        due = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+                when, kind, key = heapq.heappop(self._heap)
+                if self._scheduled.get((kind, key)) == when:
+                    del self._scheduled[(kind, key)]
+                    due.append((kind, key))
+        
+        evicted = 0
+        for kind, key in due:
+            metrics = self._metrics[kind]
+            try:
+                result = self._sources[kind][0](key)
+            except Exception as e:
+                logger.error(f"Error expiring {kind} entry {key}: {e}")
+                metrics['errors'] += 1
+                continue
+            if result is True:
+                metrics['evicted'] += 1
+                evicted += 1
+            elif result:
+                metrics['rescheduled'] += 1
+                self.schedule(kind, key, float(result))
+            else:
+                metrics['stale'] += 1
+        
+        self.runs += 1
+        self.last_sweep_ms = round((time.perf_counter() - started) * 1000, 2)
+        if evicted:
+            logger.info(f"Expiry sweep removed {evicted} entries")
+        return evicted
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                wake = self._next_rescan
+                if self._heap:
+                    wake = min(wake, self._heap[0][0])
+                timeout = wake - time.time()
+                if timeout > 0:
+                    self._cond.wait(timeout)
+                    continue
+            if time.time() >= self._next_rescan:
+                self.discover()
+            self.sweep()
+    
+    def start(self):
+        """بدء الخيط (مرة واحدة في كل عملية؛ الخيط لا ينتقل مع fork)"""
+        with self._cond:
+            if self._running and self._pid == os.getpid():
+                return
+            self._running = True
+            self._pid = os.getpid()
+        self.discover()
+        self._thread = threading.Thread(target=self._run, name='expiry-sweeper', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+    
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                'running': self._running,
+                'pending': len(self._scheduled),
+                'next_due_in': round(self._heap[0][0] - time.time(), 1) if self._heap else None,
+                'runs': self.runs,
+                'last_sweep_ms': self.last_sweep_ms,
+                'kinds': {kind: dict(metrics) for kind, metrics in self._metrics.items()}
+            }
+
+
+def file_expiry_times(root: str, retention_seconds: float, exclude: tuple = (), extensions: tuple = None):
+    """(path, mtime + retention) for files under root, skipping excluded folders"""
+    if not os.path.isdir(root):
+        return []
+    exclude = tuple(os.path.abspath(path) for path in exclude)
+    entries = []
+    for folder, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(folder, d)) not in exclude]
+        for name in files:
+            if extensions and not name.endswith(extensions):
+                continue
+            path = os.path.join(folder, name)
+            try:
+                entries.append((path, os.path.getmtime(path) + retention_seconds))
+            except OSError:
+                continue
+    return entries
+
+
+def expire_file(path: str, retention_seconds: float) -> Any:
+    """Sweeper handler for files: remove once mtime + retention has passed"""
+    try:
+        due = os.path.getmtime(path) + retention_seconds
+    except OSError:
+        return False
+    if due > time.time():
+        return due
+    os.remove(path)
+    return True
+
+
+CACHE_ARCHIVE_VERSION = 1
+
+
+def cache_stores() -> Dict[str, ContentAddressedStore]:
+    """كل مخازن الملفات الدائمة حسب الاسم - every persistent artifact store by namespace"""
+    stores = [
+        tts_audio_cache.store,
+        ContentAddressedStore('tts_phrases'),
+        enhanced_video_cache.store,
+        artifact_cache.stores['overlay'],
+        artifact_cache.stores['final']
+    ]
+    return {os.path.basename(store.store_dir): store for store in stores}
+
+
+def export_cache_archive(archive_path: str, cache: CacheManager = None,
+                         stores: Dict[str, ContentAddressedStore] = None, compress: bool = False) -> Dict:
+    """
+    تصدير محتوى التخزين المؤقت إلى أرشيف واحد
+    Export CacheManager entries and artifact stores into one tar archive
+    
+    Cache entries keep their remaining TTL; expired entries are skipped,
+    and so are request-level entries, which name output files of this
+    node (the final stage store that can rebuild them is exported).
+    Audio and video compress poorly, so gzip is opt-in.
+    
+    Returns:
+        عدد العناصر المصدرة لكل نوع
+    """
+    cache = cache or cache_manager
+    stores = cache_stores() if stores is None else stores
+    now = time.time()
+    manifest = {'version': CACHE_ARCHIVE_VERSION, 'created_at': now, 'entries': [], 'stores': {}}
+    
+    tmp_path = f"{archive_path}.{os.getpid()}.tmp"
+    with tarfile.open(tmp_path, 'w:gz' if compress else 'w') as tar:
+        for row in cache.index.all():
+            if row['expires_at'] <= now or not os.path.exists(row['file_path']):
+                continue
+            if row['key'].startswith(AsyncVideoGenerator.REQUEST_KEY_PREFIX):
+                continue
+            arcname = f"cache/{row['key']}.cache"
+            tar.add(row['file_path'], arcname=arcname)
+            manifest['entries'].append({'key': row['key'], 'file': arcname, 'ttl': row['expires_at'] - now})
+        
+        for namespace, store in stores.items():
+            files = sorted(store.files())
+            for name in files:
+                tar.add(os.path.join(store.store_dir, name), arcname=f"stores/{namespace}/{name}")
+            manifest['stores'][namespace] = files
+        
+        payload = json.dumps(manifest, ensure_ascii=False).encode('utf-8')
+        info = tarfile.TarInfo('manifest.json')
+        info.size = len(payload)
+        info.mtime = int(now)
+        tar.addfile(info, io.BytesIO(payload))
+    os.replace(tmp_path, archive_path)
+    
+    counts = {'entries': len(manifest['entries'])}
+    counts.update({namespace: len(files) for namespace, files in manifest['stores'].items()})
+    return counts
+
+
+def import_cache_archive(archive_path: str, cache: CacheManager = None,
+                         stores: Dict[str, ContentAddressedStore] = None, overwrite: bool = False) -> Dict:
+    """
+    استيراد أرشيف مصدر لتشغيل عقدة جديدة بتخزين دافئ
+    Import an exported archive so a fresh node starts with warm caches
+    
+    Existing entries and files are kept unless overwrite is set; store
+    namespaces unknown to this node are skipped.
+    
+    Returns:
+        عدد العناصر المستوردة لكل نوع
+    """
+    cache = cache or cache_manager
+    stores = cache_stores() if stores is None else stores
+    now = time.time()
+    counts = {'entries': 0, 'skipped': 0}
+    
+    with tarfile.open(archive_path, 'r:*') as tar:
+        manifest = json.load(tar.extractfile('manifest.json'))
+        if manifest.get('version') != CACHE_ARCHIVE_VERSION:
+            raise ValueError(f"Unsupported cache archive version: {manifest.get('version')}")
+        
+        for entry in manifest['entries']:
+            key = entry['key']
+            if os.path.basename(key) != key or (cache.index.get(key) and not overwrite):
+                counts['skipped'] += 1
+                continue
+            file_path = os.path.join(cache.cache_dir, f"{key}.cache")
+            _extract_member(tar, entry['file'], file_path)
+            expires_at = now + entry['ttl']
+            cache.memory_cache.pop(key)
+            cache.index.put(key, file_path, expires_at, os.path.getsize(file_path))
+            if cache.sweeper:
+                cache.sweeper.schedule('cache', key, expires_at)
+            counts['entries'] += 1
+        
+        for namespace, files in manifest['stores'].items():
+            store = stores.get(namespace)
+            if store is None:
+                counts['skipped'] += len(files)
+                continue
+            counts[namespace] = 0
+            os.makedirs(store.store_dir, exist_ok=True)
+            for name in files:
+                path = os.path.join(store.store_dir, name)
+                if os.path.basename(name) != name or (os.path.exists(path) and not overwrite):
+                    counts['skipped'] += 1
+                    continue
+                _extract_member(tar, f"stores/{namespace}/{name}", path)
+                counts[namespace] += 1
+    
+    return counts
+
+
+def _extract_member(tar: tarfile.TarFile, arcname: str, dest_path: str):
+    """نسخ عضو من الأرشيف إلى مساره بكتابة ذرية - atomic streamed extraction"""
+    tmp_path = f"{dest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    source = tar.extractfile(arcname)
+    if source is None:
+        raise ValueError(f"Not a regular file in cache archive: {arcname}")
+    with source, open(tmp_path, 'wb') as f:
+        shutil.copyfileobj(source, f, 1024 * 1024)
+    os.replace(tmp_path, dest_path)
+
+
 # Singletons
 cache_manager = CacheManager()
-async_video_generator = AsyncVideoGenerator()
-bg_video_cache = BackgroundVideoCache()
\ No newline at end of file
+bg_video_cache = BackgroundVideoCache()
+enhanced_video_cache = EnhancedVideoCache()
+tts_audio_cache = TTSAudioCache()
+artifact_cache = StagedArtifactCache({
+    'audio': tts_audio_cache.store,
+    'background': enhanced_video_cache.store
+})
+async_video_generator = AsyncVideoGenerator(artifact_cache)
+
+_sweeper_settings = getattr(config, 'CACHE_SWEEPER', {})
+expiry_sweeper = ExpirySweeper(
+    rescan_interval=_sweeper_settings.get('rescan_interval', 600),
+    batch_size=_sweeper_settings.get('batch_size', 500)
+)
+
+
+def _register_sweeps(sweeper: ExpirySweeper):
+    """ربط كل مصادر الانتهاء بالمجدول - wire every expiry source to the sweeper"""
+    temp_retention = _sweeper_settings.get('temp_retention_hours', 6) * 3600
+    output_retention = _sweeper_settings.get('output_retention_hours')
+    stage_retention = _sweeper_settings.get('final_stage_retention_hours', 72) * 3600
+    
+    for owner in (cache_manager, async_video_generator, bg_video_cache):
+        owner.sweeper = sweeper
+    
+    sweeper.register('cache', cache_manager.expire, cache_manager.expiry_times)
+    sweeper.register('jobs', async_video_generator.expire_job, async_video_generator.job_expiry_times)
+    sweeper.register(
+        'bg_videos',
+        lambda path: expire_file(path, bg_video_cache.ttl),
+        lambda: file_expiry_times(bg_video_cache.cache_dir, bg_video_cache.ttl, extensions=('.mp4',))
+    )
+    sweeper.register(
+        'temp',
+        lambda path: expire_file(path, temp_retention),
+        lambda: file_expiry_times(config.TEMP_FOLDER, temp_retention,
+                                  exclude=(cache_manager.cache_dir, bg_video_cache.cache_dir))
+    )
+    sweeper.register(
+        'final_videos',
+        lambda path: expire_file(path, stage_retention),
+        lambda: file_expiry_times(artifact_cache.stores['final'].store_dir, stage_retention)
+    )
+    if output_retention:
+        sweeper.register(
+            'outputs',
+            lambda path: expire_file(path, output_retention * 3600),
+            lambda: file_expiry_times(config.OUTPUT_FOLDER, output_retention * 3600)
+        )
+
+
+_register_sweeps(expiry_sweeper)
+
+
+def start_background_services():
+    """
+    بدء المنظف ومراقب المهام مرة واحدة في كل عملية
+    Start the expiry sweeper and the job monitor, once per process
+    
+    Called on the first request (job submissions included), so they run
+    under any WSGI server and in each of its worker processes, not only
+    when main.py is run directly.
+    """
+    if _sweeper_settings.get('enabled', True):
+        expiry_sweeper.start()
+    async_video_generator.start()
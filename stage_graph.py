@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+جدولة مراحل المعالجة كرسم موجه غير دوري
+Stage-level DAG scheduler for the video pipeline
+
+A job declares its stages (speech synthesis, background download,
+enhancement, rendering), what each one depends on and whether it is
+network-bound ('io') or CPU-bound ('cpu'). Every stage starts as soon as
+its inputs are ready, so TTS and the background download overlap instead
+of running back to back, while the heavy stages share a small CPU pool.
+Each run records when every stage was queued and started and how long
+it took.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_pools = None
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+
+def stage_pools() -> Dict[str, ThreadPoolExecutor]:
+    """
+    مجمعا الخيوط المشتركان (io و cpu) لهذه العملية
+    Shared per-process pools, created on first use (and again after fork)
+    """
+    global _pools, _pools_pid
+    with _pools_lock:
+        if _pools is None or _pools_pid != os.getpid():
+            settings = getattr(config, 'STAGE_SCHEDULER', {})
+            _pools = {
+                'io': ThreadPoolExecutor(max_workers=settings.get('io_workers', 8), thread_name_prefix='stage-io'),
+                'cpu': ThreadPoolExecutor(max_workers=settings.get('cpu_workers', 2), thread_name_prefix='stage-cpu'),
+            }
+            _pools_pid = os.getpid()
+        return _pools
+
+
+class StageGraph:
+    """
+    منفذ مراحل بسيط: كل مرحلة تعمل فور انتهاء المراحل التي تعتمد عليها
+    Minimal DAG executor; a stage runs once all of its dependencies finished
+    """
+    
+    def __init__(self, pools: Optional[Dict[str, ThreadPoolExecutor]] = None,
+                 clock: Callable[[], float] = time.perf_counter):
+        self.pools = pools
+        self.clock = clock
+        self.stages = OrderedDict()
+        self.timings = {}
+        self.elapsed = 0.0
+    
+    def add(self, name: str, func: Callable, deps: Iterable[str] = (), pool: str = 'io') -> 'StageGraph':
+        """
+        إضافة مرحلة؛ تستدعى func بنتائج المراحل deps بنفس الترتيب
+        Add a stage; func is called with the results of deps, in order
+        """
+        if name in self.stages:
+            raise ValueError(f"duplicate stage: {name}")
+        self.stages[name] = (func, tuple(deps), pool)
+        return self
+    
+    def run(self, on_done: Optional[Callable[[str, Any], None]] = None) -> Dict[str, Any]:
+        """
+        تشغيل كل المراحل وإرجاع نتائجها حسب الاسم
+        Run every stage and return the results by stage name
+        
+        on_done(name, result) is called on the calling thread after each
+        stage. If a stage or on_done raises, no further stage starts, the
+        stages already running are awaited (they may still be writing into
+        the job's work dir) and the exception is re-raised.
+        """
+        pools = self.pools or stage_pools()
+        for name, (_, deps, pool) in self.stages.items():
+            unknown = [dep for dep in deps if dep not in self.stages]
+            if unknown:
+                raise ValueError(f"stage {name} depends on unknown stages {unknown}")
+            if pool not in pools:
+                raise ValueError(f"stage {name} uses unknown pool {pool}")
+        
+        started = self.clock()
+        pending = OrderedDict(self.stages)
+        running = {}
+        results = {}
+        self.timings = {}
+        try:
+            while pending or running:
+                ready = [name for name, (_, deps, _) in pending.items() if all(dep in results for dep in deps)]
+                for name in ready:
+                    func, deps, pool = pending.pop(name)
+                    future = pools[pool].submit(self._timed, name, pool, started, self.clock(), func,
+                                                [results[dep] for dep in deps])
+                    running[future] = name
+                if not running:
+                    raise ValueError(f"dependency cycle between stages {list(pending)}")
+                
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    results[name] = future.result()
+                    if on_done:
+                        on_done(name, results[name])
+        except BaseException:
+            wait(running)
+            raise
+        finally:
+            self.elapsed = round(self.clock() - started, 3)
+        
+        logger.info(f"مدة المراحل: {self.report()}")
+        return results
+    
+    def _timed(self, name: str, pool: str, started: float, submitted: float, func: Callable, args: list) -> Any:
+        """تشغيل مرحلة وتسجيل بدايتها وانتظارها لخيط متاح ومدتها"""
+        begin = self.clock()
+        try:
+            return func(*args)
+        finally:
+            self.timings[name] = {
+                'pool': pool,
+                'start': round(begin - started, 3),
+                'queued': round(begin - submitted, 3),
+                'seconds': round(self.clock() - begin, 3),
+            }
+    
+    def report(self) -> Dict:
+        """المدة الكلية ومدة كل مرحلة - total and per-stage timings"""
+        return {'total': self.elapsed, 'stages': dict(self.timings)}
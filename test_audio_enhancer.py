@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+اختبار تحسين الصوت - Audio Enhancement Tests
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pydub = pytest.importorskip('pydub')
+pytest.importorskip('scipy')
+
+import audio_dsp
+from audio_enhancer import AudioEnhancer
+
+
+def _signal(sample_rate=16000, seconds=2.0, channels=1):
+    """ضوضاء هادئة مع مقطع عالٍ في المنتصف"""
+    rng = np.random.default_rng(0)
+    samples = rng.normal(0, 0.02, (int(sample_rate * seconds), channels)).astype(np.float32)
+    samples[sample_rate // 2:sample_rate] *= 10
+    return np.clip(samples, -0.99, 0.99)
+
+
+def _segment(samples, sample_rate):
+    data = (samples * 32767).astype(np.int16)
+    return pydub.AudioSegment(data.tobytes(), frame_rate=sample_rate, sample_width=2, channels=samples.shape[1])
+
+
+def _rms(samples):
+    return float(np.sqrt(np.mean(np.square(samples))))
+
+
+@pytest.mark.parametrize('sample_width, raw, expected', [
+    (1, bytes([0, 128, 255]), [-1.0, 0.0, 127 / 128]),
+    (3, bytes([0, 0, 0x80, 0, 0, 0, 0xff, 0xff, 0x7f]), [-1.0, 0.0, (2 ** 23 - 1) / 2 ** 23]),
+])
+def test_decode_handles_unsigned_8bit_and_packed_24bit(monkeypatch, sample_width, raw, expected):
+    segment = SimpleNamespace(raw_data=raw, sample_width=sample_width, channels=1, frame_rate=8000)
+    monkeypatch.setattr(audio_dsp.AudioSegment, 'from_file', lambda path: segment)
+    
+    samples, sample_rate, width = audio_dsp.decode('speech.wav')
+    assert samples[:, 0].tolist() == pytest.approx(expected)
+    assert (sample_rate, width) == (8000, sample_width)
+
+
+def test_decode_rejects_unknown_sample_width(monkeypatch):
+    segment = SimpleNamespace(raw_data=bytes(10), sample_width=5, channels=1, frame_rate=8000)
+    monkeypatch.setattr(audio_dsp.AudioSegment, 'from_file', lambda path: segment)
+    with pytest.raises(ValueError):
+        audio_dsp.decode('speech.wav')
+
+
+def test_compressor_matches_pydub_gain_reduction():
+    from pydub.effects import compress_dynamic_range
+    
+    samples = _signal()
+    reference = compress_dynamic_range(_segment(samples, 16000), threshold=-20, ratio=4)
+    reference = np.frombuffer(reference.raw_data, np.int16) / 32768.0
+    
+    compressed = audio_dsp.compress(samples.copy(), 16000, threshold_db=-20, ratio=4)
+    
+    loud = slice(8000 + 400, 16000 - 400)
+    assert _rms(compressed[loud]) == pytest.approx(_rms(reference[loud]), rel=0.05)
+    # الجزء الهادئ تحت العتبة لا يتأثر
+    np.testing.assert_allclose(compressed[-4000:], samples[-4000:], atol=1e-6)
+
+
+def test_fades_match_pydub():
+    samples = _signal()
+    segment = _segment(samples, 16000)
+    samples = np.frombuffer(segment.raw_data, np.int16).astype(np.float32)[:, None] / 32768.0
+    
+    reference = segment.fade_in(500).fade_out(300)
+    reference = np.frombuffer(reference.raw_data, np.int16) / 32768.0
+    result = audio_dsp.fade(samples.copy(), 16000, 0.5, 0.3)
+    assert np.abs(reference - result[:, 0]).max() < 1e-3
+
+
+def test_equalizer_bank_honors_configured_gains():
+    from scipy import signal
+    
+    eq = {
+        'low_shelf': {'freq': 100, 'gain': 2},
+        'mid': {'freq': 1000, 'gain': 1},
+        'high_shelf': {'freq': 8000, 'gain': 1.5},
+    }
+    sos = audio_dsp.design_equalizer(48000, audio_dsp.equalizer_bands(eq))
+    assert sos.shape == (3, 6)
+    assert audio_dsp.design_equalizer(48000, audio_dsp.equalizer_bands(eq)) is sos
+    
+    freqs, response = signal.sosfreqz(sos, worN=[20, 1000, 20000], fs=48000)
+    gains = 20 * np.log10(np.abs(response))
+    # الرفوف تحافظ على الصوت بدلاً من قطع ما فوق 100 هرتز
+    assert gains == pytest.approx([2.0, 1.0, 1.5], abs=0.1)
+    
+    # نطاق الرف العالي يتجاوز نايكويست عند 16 كيلوهرتز فيتم تجاهله
+    assert audio_dsp.design_equalizer(16000, audio_dsp.equalizer_bands(eq)).shape == (2, 6)
+
+
+def test_loudness_normalization_hits_target_under_peak_ceiling():
+    pytest.importorskip('pyloudnorm')
+    t = np.arange(16000 * 3) / 16000.0
+    tone = (0.05 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)[:, None]
+    
+    quiet = audio_dsp.normalize_loudness(tone.copy(), 16000, target_lufs=-16.0, peak_ceiling_db=0.0)
+    assert audio_dsp.integrated_loudness(quiet, 16000) == pytest.approx(-16.0, abs=0.1)
+    
+    limited = audio_dsp.normalize_loudness(tone.copy(), 16000, target_lufs=-3.0, peak_ceiling_db=-1.0)
+    assert audio_dsp.peak_db(limited) == pytest.approx(-1.0, abs=0.01)
+
+
+def test_reverb_overlap_add_matches_direct_convolution():
+    from scipy import signal
+    
+    samples = _signal(seconds=3.0, channels=2)
+    engine = audio_dsp.ReverbEngine(16000, room_size=0.2, wet=0.5)
+    assert engine.block_size < samples.shape[0]
+    
+    ir = audio_dsp.impulse_response(16000, 0.2)
+    expected = 0.5 * samples + 0.5 * signal.fftconvolve(samples, ir, axes=0)[:samples.shape[0]]
+    
+    result = engine.apply(samples.copy())
+    np.testing.assert_allclose(result, expected, atol=1e-4)
+    # الطيف محسوب مرة واحدة لكل غرفة
+    assert audio_dsp.ReverbEngine(16000, room_size=0.2)._spectrum is engine._spectrum
+
+
+def test_reverb_reloads_impulse_file_replaced_under_same_path(tmp_path, monkeypatch):
+    # كل بايت في الملف عينة واحدة: طول الاستجابة = حجم الملف
+    monkeypatch.setattr(audio_dsp, 'decode', lambda path: (
+        np.frombuffer(open(path, 'rb').read(), np.uint8).astype(np.float32)[:, None], 16000, 2))
+    impulse = tmp_path / 'hall.wav'
+    impulse.write_bytes(bytes(range(1, 101)))
+    assert audio_dsp.ReverbEngine(16000, impulse_path=str(impulse)).taps == 100
+    
+    impulse.write_bytes(bytes(range(1, 201)))
+    assert audio_dsp.ReverbEngine(16000, impulse_path=str(impulse)).taps == 200
+
+
+def test_streaming_noise_gate_matches_whole_file_per_channel():
+    rng = np.random.default_rng(1)
+    sample_rate = 16000
+    t = np.arange(sample_rate * 12) / float(sample_rate)
+    samples = rng.normal(0, 0.01, (t.size, 2)).astype(np.float32)
+    samples[sample_rate:, 0] += (0.3 * np.sin(2 * np.pi * 300 * t[sample_rate:])).astype(np.float32)
+    
+    gate = audio_dsp.SpectralGate(sample_rate, strength=0.7, block_seconds=2.0)
+    streamed = gate.process(samples, workers=3)
+    
+    whole = audio_dsp.SpectralGate(sample_rate, strength=0.7, block_seconds=60.0)
+    whole.threshold = gate.threshold
+    np.testing.assert_allclose(streamed, whole.process(samples), atol=1e-5)
+    
+    # الضوضاء تنخفض في القناتين، والنغمة تبقى فوق الضوضاء في قناتها فقط
+    assert _rms(streamed[:, 1]) < 0.4 * _rms(samples[:, 1])
+    assert _rms(streamed[sample_rate:, 0]) > 10 * _rms(streamed[sample_rate:, 1])
+
+
+def test_enhance_decodes_and_encodes_once(tmp_path, monkeypatch):
+    source = str(tmp_path / 'voice.wav')
+    audio_dsp.encode(_signal(channels=2), 16000, source)
+    
+    calls = []
+    for name in ('decode', 'encode'):
+        original = getattr(audio_dsp, name)
+        monkeypatch.setattr(audio_dsp, name, lambda *a, _f=original, _n=name: calls.append(_n) or _f(*a))
+    
+    output = AudioEnhancer({'noise_reduction': True}).enhance(source, str(tmp_path / 'out.wav'))
+    
+    assert calls == ['decode', 'encode']
+    result = pydub.AudioSegment.from_file(output)
+    assert (result.channels, result.frame_rate, len(result)) == (2, 16000, 2000)
+    assert -20 < result.max_dBFS < 0
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+اختبار محرك Ken Burns - Ken Burns Engine Tests
+"""
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+
+from ken_burns import KenBurnsEngine
+
+
+def _gradient(width=320, height=180):
+    y, x = np.mgrid[0:height, 0:width]
+    return np.stack([x * 255 // width, y * 255 // height, (x + y) % 256], -1).astype(np.uint8)
+
+
+def _legacy_frame(frame, zoom, x1=None):
+    """القص ثم التحجيم كما في التنفيذ القديم"""
+    h, w = frame.shape[:2]
+    new_h, new_w = int(h / zoom), int(w / zoom)
+    y1 = (h - new_h) // 2
+    x1 = (w - new_w) // 2 if x1 is None else x1
+    return cv2.resize(frame[y1:y1 + new_h, x1:x1 + new_w], (w, h), interpolation=cv2.INTER_LINEAR)
+
+
+def test_matrices_cover_zoom_range():
+    engine = KenBurnsEngine(320, 180, zoom=1.2)
+    matrices = engine.matrices(5)
+    
+    assert matrices.shape == (5, 2, 3)
+    np.testing.assert_allclose(matrices[0], [[1, 0, 0], [0, 1, 0]], atol=1e-6)
+    np.testing.assert_allclose(matrices[-1, 0, 0], 1 / 1.2, rtol=1e-6)
+    
+    zoom_out = KenBurnsEngine(320, 180, zoom=1.2, direction='zoom_out').matrices(5)
+    np.testing.assert_allclose(zoom_out[::-1], matrices, atol=1e-4)
+
+
+def test_render_matches_crop_and_resize():
+    frame = _gradient()
+    engine = KenBurnsEngine(320, 180, zoom=1.25)
+    rendered = engine.render(frame, engine.matrices(2)[-1])
+    
+    diff = np.abs(rendered.astype(np.int16) - _legacy_frame(frame, 1.25).astype(np.int16))
+    assert diff[2:-2, 2:-2].mean() < 1.5
+
+
+def test_pan_moves_crop_window_across_frame():
+    frame = _gradient()
+    engine = KenBurnsEngine(320, 180, direction='pan_left', pan_zoom=1.1)
+    first, last = engine.matrices(3)[[0, -1]]
+    
+    # تكبير ثابت مع انتقال النافذة من اليسار إلى اليمين
+    assert first[0, 0] == pytest.approx(last[0, 0])
+    assert last[0, 2] > first[0, 2]
+    
+    rendered = engine.render(frame, last).astype(np.int16)
+    expected = _legacy_frame(frame, 1.1, x1=320 - int(320 / 1.1)).astype(np.int16)
+    assert np.abs(rendered - expected)[2:-2, 2:-2].mean() < 3
+
+
+def test_pan_moves_by_fractions_of_a_pixel():
+    stripes = np.zeros((180, 320, 3), dtype=np.uint8)
+    stripes[:, ::2] = 200
+    engine = KenBurnsEngine(320, 180)
+    
+    # إزاحة نصف بكسل: كل عمود متوسط عمودين متجاورين بدلاً من التقريب
+    half = np.array([[1, 0, 0.5], [0, 1, 0]], dtype=np.float32)
+    assert np.abs(engine.render(stripes, half)[:, :-1].astype(np.int16) - 100).max() <= 1
+    
+    # تحريك بطيء (أقل من بكسل لكل إطار) لا يكرر أي إطار
+    pan = KenBurnsEngine(320, 180, direction='pan_left', pan_zoom=1.1)
+    frames = [pan.render(stripes, matrix) for matrix in pan.matrices(60)]
+    assert all(not np.array_equal(a, b) for a, b in zip(frames, frames[1:]))
+
+
+def test_image_clip_frames_stay_valid_after_later_frames():
+    source = _gradient(640, 360)
+    engine = KenBurnsEngine(320, 180, zoom=1.1)
+    clip = engine.image_clip(source, duration=1.0, fps=10)
+    
+    first = clip.get_frame(0)
+    assert first.shape == (180, 320, 3)
+    assert np.abs(first.astype(np.int16) - cv2.resize(source, (320, 180)).astype(np.int16)).mean() < 2
+    
+    snapshot = first.copy()
+    last = clip.get_frame(1.0)
+    assert last is not first
+    np.testing.assert_array_equal(first, snapshot)
+
+
+@pytest.mark.parametrize('direction', list(KenBurnsEngine.DIRECTIONS))
+def test_builtin_directions_render_without_warp_affine(direction, monkeypatch):
+    engine = KenBurnsEngine(320, 180, zoom=1.15, direction=direction, pan_zoom=1.1)
+    source = engine._prescale(_gradient(480, 270))
+    matrices = engine.matrices(40, (source.shape[1], source.shape[0]))
+    expected = [cv2.warpAffine(source, matrix, (320, 180), flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                               borderMode=cv2.BORDER_REPLICATE) for matrix in matrices]
+    
+    # كل الإطارات عبر cv2.resize، وبفارق ضئيل عن warpAffine
+    monkeypatch.setattr(cv2, 'warpAffine', None)
+    for matrix, reference in zip(matrices, expected):
+        diff = np.abs(engine.render(source, matrix).astype(np.int16) - reference.astype(np.int16))
+        assert diff.mean() < 0.5
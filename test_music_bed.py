@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+اختبار الموسيقى الخلفية - Music Bed Tests
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('pydub')
+pytest.importorskip('scipy')
+
+import audio_dsp
+from music_bed import MusicLibrary
+
+
+def _tone(freq, seconds, sample_rate, amplitude=0.3, channels=1):
+    t = np.arange(int(seconds * sample_rate)) / float(sample_rate)
+    tone = (amplitude * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+    return np.repeat(tone[:, None], channels, axis=1)
+
+
+def _library(tmp_path):
+    source = tmp_path / 'music' / 'relaxing piano'
+    source.mkdir(parents=True)
+    # صمت في البداية والنهاية يُقص عند الإدخال
+    bed = np.concatenate([np.zeros((4410, 2), np.float32), _tone(220, 1.5, 44100, channels=2),
+                          np.zeros((4410, 2), np.float32)])
+    audio_dsp.encode(bed, 44100, str(source / 'calm.wav'))
+    return MusicLibrary(str(tmp_path / 'music'), str(tmp_path / 'library'), sample_rate=16000)
+
+
+def test_scan_ingests_once_as_trimmed_memory_mapped_bed(tmp_path):
+    library = _library(tmp_path)
+    
+    assert library.scan() == 1
+    assert library.scan() == 0
+    
+    entry = library.select('relaxing piano')
+    assert entry['tags'] == ['relaxing piano', 'calm']
+    bed = library.load(entry)
+    assert isinstance(bed, np.memmap)
+    assert bed.shape == (24000, 2)
+    assert os.path.exists(os.path.join(str(tmp_path / 'library'), 'index.json'))
+
+
+def test_refresh_rescans_only_when_a_folder_changes(tmp_path):
+    library = _library(tmp_path)
+    
+    assert library.refresh() == 1
+    assert library.refresh() == 0
+    
+    # ملف جديد في مجلد استعلام يغير زمن تعديله
+    audio_dsp.encode(_tone(330, 1.0, 16000), 16000, str(tmp_path / 'music' / 'relaxing piano' / 'more.wav'))
+    assert library.refresh() == 1
+    assert library.refresh() == 0
+
+
+def test_mix_loops_bed_and_ducks_under_speech(tmp_path):
+    library = _library(tmp_path)
+    library.scan()
+    
+    sample_rate = 16000
+    narration = np.zeros((sample_rate * 6, 1), np.float32)
+    narration[sample_rate * 2:sample_rate * 4] = _tone(1000, 2, sample_rate)
+    settings = {'volume': -14.0, 'duck_db': 10.0, 'fade': 0.0, 'duck_release_ms': 100.0}
+    
+    mixed = library.mix(narration, sample_rate, 'relaxing piano', settings=settings)
+    music = mixed - narration
+    
+    def level(start, end):
+        return 20 * np.log10(np.sqrt(np.mean(np.square(music[int(start * sample_rate):int(end * sample_rate)]))))
+    
+    assert mixed.shape == (sample_rate * 6, 2)
+    # الخلفية (1.5 ثانية) تتكرر لتغطي التلاوة كاملة
+    assert level(5.0, 5.8) > -60
+    assert level(2.5, 3.5) == pytest.approx(level(0.5, 1.5) - 10, abs=1.0)
@@ -0,0 +1,649 @@
+# -*- coding: utf-8 -*-
+"""
+اختبار نظام التخزين المؤقت - Performance Manager Tests
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import asyncio
+import shutil
+import threading
+import multiprocessing
+from contextlib import contextmanager
+
+import pytest
+
+import config
+import performance_manager
+from performance_manager import (AsyncVideoGenerator, CacheManager, ContentAddressedStore, EnhancedVideoCache,
+                                 ExpirySweeper, JobCancelled, JobStore, LRUMemoryCache, StagedArtifactCache,
+                                 TTSAudioCache, expire_file, export_cache_archive, file_expiry_times,
+                                 import_cache_archive)
+
+
+@pytest.fixture(autouse=True)
+def _isolated_folders(tmp_path, monkeypatch):
+    """المخازن المنشأة بالإعدادات الافتراضية تكتب في مجلد الاختبار لا في المستودع"""
+    monkeypatch.setattr(config, 'TEMP_FOLDER', str(tmp_path / 'temp'))
+    monkeypatch.setattr(config, 'OUTPUT_FOLDER', str(tmp_path / 'outputs'))
+    monkeypatch.setattr(config, 'CACHE_FOLDER', str(tmp_path / 'cache'))
+    monkeypatch.setitem(config.JOB_QUEUE, 'db_path', str(tmp_path / 'cache' / 'jobs.db'))
+
+
+def test_stores_create_no_files_until_first_use(tmp_path, monkeypatch):
+    """المخازن الافتراضية تفتح ملفاتها عند أول استخدام فقط"""
+    monkeypatch.chdir(tmp_path)
+    cache = CacheManager('cache_dir')
+    jobs = JobStore('jobs/jobs.db')
+    artifacts = StagedArtifactCache(root_dir='stages')
+    assert artifacts.stats()['final']['items'] == 0
+    assert sorted(os.listdir(tmp_path)) == []
+    
+    assert cache.set('key', 'value') and jobs.stats() == {}
+    assert sorted(os.listdir(tmp_path)) == ['cache_dir', 'jobs']
+
+
+def test_store_key_ignores_settings_order():
+    """المفتاح لا يتأثر بترتيب الإعدادات"""
+    a = ContentAddressedStore.make_key('x', {'brightness': 1.05, 'contrast': 1.1})
+    b = ContentAddressedStore.make_key('x', {'contrast': 1.1, 'brightness': 1.05})
+    c = ContentAddressedStore.make_key('x', {'contrast': 1.2, 'brightness': 1.05})
+    assert a == b
+    assert a != c
+
+
+def test_enhanced_video_cache_skips_enhancement_on_hit(tmp_path):
+    """إعادة استخدام الفيديو المحسن بدون إعادة التحسين"""
+    cache = EnhancedVideoCache()
+    cache.store = ContentAddressedStore('enhanced_backgrounds', root_dir=str(tmp_path))
+    
+    source = tmp_path / 'background.mp4'
+    source.write_bytes(b'video-bytes')
+    calls = []
+    
+    def fake_enhance(path, settings):
+        calls.append(path)
+        out = tmp_path / 'background_enhanced.mp4'
+        out.write_bytes(b'enhanced-bytes')
+        return str(out)
+    
+    settings = {'enabled': True, 'contrast': 1.1}
+    first = cache.get_or_enhance(str(source), settings, fake_enhance)
+    second = cache.get_or_enhance(str(source), dict(settings), fake_enhance)
+    
+    assert first == second
+    assert len(calls) == 1
+    with open(first, 'rb') as f:
+        assert f.read() == b'enhanced-bytes'
+    
+    # تغيير الإعدادات يعني مفتاحاً جديداً
+    cache.get_or_enhance(str(source), {'enabled': True, 'contrast': 1.3}, fake_enhance)
+    assert len(calls) == 2
+
+
+def test_enhanced_video_cache_falls_back_to_source(tmp_path):
+    """عند فشل التحسين يُستخدم الفيديو الأصلي"""
+    cache = EnhancedVideoCache()
+    cache.store = ContentAddressedStore('enhanced_backgrounds', root_dir=str(tmp_path))
+    source = tmp_path / 'background.mp4'
+    source.write_bytes(b'video-bytes')
+    
+    result = cache.get_or_enhance(str(source), {}, lambda path, settings: path)
+    assert result == str(source)
+    assert cache.store.files() == []
+
+
+def test_tts_audio_cache_roundtrip(tmp_path):
+    """الصوت المخزن يُعاد لنفس النص والصوت والإعدادات فقط"""
+    cache = TTSAudioCache()
+    cache.store = ContentAddressedStore('tts_audio', root_dir=str(tmp_path))
+    voice = {'voice': 'ar-SA-HamedNeural', 'rate': '-15%', 'pitch': '-2Hz'}
+    key = cache.make_key('نص الحديث', 'edge_tts', voice, {'enabled': True})
+    
+    assert cache.get(key) is None
+    audio = tmp_path / 'audio_enhanced.mp3'
+    audio.write_bytes(b'mp3-bytes')
+    stored = cache.put(key, str(audio))
+    
+    assert cache.get(key) == stored
+    with open(stored, 'rb') as f:
+        assert f.read() == b'mp3-bytes'
+    
+    assert cache.make_key('نص الحديث', 'edge_tts', dict(voice, rate='-10%'), {'enabled': True}) != key
+    assert cache.make_key('نص الحديث', 'gtts', voice, {'enabled': True}) != key
+    assert cache.make_key('نص الحديث', 'edge_tts', voice, None) != key
+
+
+def test_cache_manager_index_roundtrip_and_expiry(tmp_path):
+    """الفهرس في SQLite: قراءة وكتابة وانتهاء بمسح نطاقي"""
+    cache = CacheManager(str(tmp_path))
+    cache.set('fresh', 'data', ttl_seconds=3600)
+    cache.set('stale', b'old', ttl_seconds=1)
+    cache.memory_cache.clear()
+    
+    assert cache.get('fresh') == b'data'
+    assert cache.index.get('fresh')['size'] == 4
+    
+    cache.index.put('stale', cache.index.get('stale')['file_path'], time.time() - 1, 3)
+    assert [row['key'] for row in cache.index.expired()] == ['stale']
+    cache.cleanup_expired()
+    assert cache.index.get('stale') is None
+    assert not os.path.exists(os.path.join(str(tmp_path), 'stale.cache'))
+    assert cache.index.stats() == {'items': 1, 'bytes': 4}
+
+
+def test_cache_manager_migrates_legacy_json_index(tmp_path):
+    legacy_file = tmp_path / 'old.cache'
+    legacy_file.write_bytes(b'legacy')
+    with open(tmp_path / 'index.json', 'w', encoding='utf-8') as f:
+        json.dump({'old': {'file_path': str(legacy_file), 'created_at': 0,
+                           'expires_at': time.time() + 60, 'size': 6}}, f)
+    
+    cache = CacheManager(str(tmp_path))
+    
+    assert cache.get('old') == b'legacy'
+    assert not os.path.exists(tmp_path / 'index.json')
+
+
+def _write_entries(cache_dir, worker):
+    cache = CacheManager(cache_dir)
+    for i in range(20):
+        cache.set(f'{worker}-{i}', f'value-{i}')
+
+
+def test_cache_manager_is_shared_by_worker_processes(tmp_path):
+    workers = [multiprocessing.Process(target=_write_entries, args=(str(tmp_path), w)) for w in range(3)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join(30)
+    
+    assert all(process.exitcode == 0 for process in workers)
+    cache = CacheManager(str(tmp_path))
+    assert cache.index.stats()['items'] == 60
+    assert cache.get('2-19') == b'value-19'
+
+
+def test_memory_tier_evicts_by_bytes_and_honors_ttl():
+    memory = LRUMemoryCache(max_bytes=10)
+    memory.put('a', b'1234')
+    memory.put('b', b'5678')
+    assert memory.get('a') == b'1234'
+    
+    # 'b' هو الأقدم استخداماً فيُطرد أولاً
+    memory.put('c', b'90')
+    memory.put('d', b'xy')
+    assert 'b' not in memory and memory.bytes == 8
+    assert not memory.put('huge', b'x' * 11)
+    
+    memory.put('old', b'z', expires_at=time.time() - 1)
+    assert memory.get('old') is None
+    assert memory.stats()['evictions'] == 1
+    assert memory.stats()['expirations'] == 1
+
+
+def test_cache_manager_promotes_disk_hits_to_memory(tmp_path):
+    cache = CacheManager(str(tmp_path))
+    cache.set('key', b'payload')
+    cache.memory_cache.clear()
+    
+    assert cache.get('key') == b'payload'
+    assert cache.get('key') == b'payload'
+    stats = cache.memory_cache.stats()
+    assert (stats['misses'], stats['hits'], stats['bytes']) == (1, 1, 7)
+
+
+def test_sweeper_evicts_exactly_the_due_entries(tmp_path):
+    cache = CacheManager(str(tmp_path))
+    sweeper = ExpirySweeper()
+    sweeper.register('cache', cache.expire, cache.expiry_times)
+    cache.sweeper = sweeper
+    
+    now = time.time()
+    cache.set('short', 'a', ttl_seconds=10)
+    cache.set('long', 'b', ttl_seconds=3600)
+    cache.set('refreshed', 'c', ttl_seconds=10)
+    cache.index.put('refreshed', cache.index.get('refreshed')['file_path'], now + 7200, 1)
+    # انتهت صلاحيته فعلياً (الفهرس هو المرجع عند الإزالة)
+    cache.index.put('short', cache.index.get('short')['file_path'], now - 1, 1)
+    
+    assert sweeper.sweep(now + 5) == 0
+    assert sweeper.sweep(now + 60) == 1
+    assert cache.index.get('short') is None
+    assert cache.index.get('long') and cache.index.get('refreshed')
+    
+    metrics = sweeper.stats()['kinds']['cache']
+    assert (metrics['evicted'], metrics['rescheduled']) == (1, 1)
+    assert sweeper.stats()['pending'] == 2
+
+
+def test_sweeper_thread_removes_old_files(tmp_path):
+    old = tmp_path / 'old.mp3'
+    new = tmp_path / 'new.mp3'
+    old.write_bytes(b'x')
+    new.write_bytes(b'y')
+    os.utime(old, (time.time() - 7200, time.time() - 7200))
+    
+    sweeper = ExpirySweeper(rescan_interval=3600)
+    sweeper.register('temp', lambda path: expire_file(path, 3600),
+                     lambda: file_expiry_times(str(tmp_path), 3600))
+    sweeper.start()
+    try:
+        deadline = time.time() + 5
+        while old.exists() and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        sweeper.stop()
+    
+    assert not old.exists() and new.exists()
+    assert sweeper.stats()['kinds']['temp']['evicted'] == 1
+
+
+def test_sweeper_starts_once_per_process(tmp_path):
+    sweeper = ExpirySweeper(rescan_interval=3600)
+    try:
+        sweeper.start()
+        first = sweeper._thread
+        sweeper.start()
+        assert sweeper._thread is first
+        
+        # بعد fork: الحالة موروثة لكن الخيط غير موجود في العملية الجديدة
+        sweeper._pid = -1
+        sweeper.start()
+        assert sweeper._thread is not first and sweeper._thread.is_alive()
+    finally:
+        sweeper.stop()
+
+
+def _fake_pipeline(tmp_path, renders):
+    """وحدة main وهمية: صوت ثابت وخلفية حسب النوع وعدّاد لمرات التركيب"""
+    def generate_audio(text, output_path, hadith_data=None):
+        with open(output_path, 'wb') as f:
+            f.write(hadith_data['text'].encode('utf-8'))
+        return output_path
+    
+    def download_background_video(video_type=None, work_dir=None):
+        path = os.path.join(work_dir, f'{video_type}.mp4')
+        with open(path, 'wb') as f:
+            f.write(f'{video_type}'.encode('utf-8'))
+        return path
+    
+    def enhance_background(background, enhance_locally=True):
+        path = background.replace('.mp4', f'_{enhance_locally}.mp4')
+        with open(background, 'rb') as src, open(path, 'wb') as f:
+            f.write(src.read() + f':{enhance_locally}'.encode('utf-8'))
+        return path
+    
+    def create_hadith_video(hadith_data, background, audio, output_path, music_seed=None, work_dir=None):
+        assert os.path.dirname(background) == os.path.dirname(audio) == work_dir
+        renders.append(os.path.basename(background))
+        with open(output_path, 'wb') as f:
+            f.write(b'video')
+        return output_path
+    
+    @contextmanager
+    def job_work_dir(job_id=None):
+        work_dir = tmp_path / 'jobs' / job_id
+        work_dir.mkdir(parents=True)
+        try:
+            yield str(work_dir)
+        finally:
+            shutil.rmtree(work_dir)
+    
+    return types.SimpleNamespace(
+        generate_audio=generate_audio,
+        download_background_video=download_background_video,
+        enhance_background=enhance_background,
+        create_hadith_video=create_hadith_video,
+        job_work_dir=job_work_dir,
+        video_render_signature=lambda hadith_data, music_seed=None: {'text': hadith_data['text']}
+    )
+
+
+def test_staged_cache_rerenders_only_when_an_input_changes(tmp_path, monkeypatch):
+    renders = []
+    monkeypatch.setitem(sys.modules, 'main', _fake_pipeline(tmp_path, renders))
+    monkeypatch.setattr(config, 'TEMP_FOLDER', str(tmp_path))
+    monkeypatch.setattr(config, 'OUTPUT_FOLDER', str(tmp_path))
+    
+    generator = AsyncVideoGenerator(StagedArtifactCache(root_dir=str(tmp_path / 'stages')),
+                                    JobStore(str(tmp_path / 'jobs.db')))
+    generator.cache = CacheManager(str(tmp_path / 'requests'))
+    hadith = {'text': 'إنما الأعمال بالنيات'}
+    
+    generator.jobs.create('job_1', {})
+    generator.jobs.claim(generator.owner)
+    first = generator._generate_video_sync(hadith, 'job_1', {'video_type': 'nature'})
+    # الصوت والتحميل بدآ معاً وتوقيت كل مرحلة محفوظ مع المهمة
+    timings = generator.get_job_status('job_1')['timings']
+    assert set(timings['stages']) == {'audio', 'download', 'enhance', 'render'}
+    assert timings['stages']['enhance']['pool'] == timings['stages']['render']['pool'] == 'cpu'
+    generator.stop()
+    # نفس الصوت والخلفية: الفيديو النهائي من مخزن المراحل دون تركيب جديد
+    second = generator._generate_video_sync(hadith, 'job_2', {'video_type': 'nature'})
+    assert renders == ['nature_True.mp4']
+    assert (tmp_path / second).read_bytes() == (tmp_path / first).read_bytes() == b'video'
+    
+    # تغيير الخلفية أو خيار التحسين فقط يعيد التركيب
+    generator._generate_video_sync(hadith, 'job_3', {'video_type': 'sky'})
+    generator._generate_video_sync(hadith, 'job_4', {'video_type': 'sky', 'enhance_locally': False})
+    assert renders == ['nature_True.mp4', 'sky_True.mp4', 'sky_False.mp4']
+    assert generator.artifacts.stats()['final']['items'] == 3
+
+
+def test_request_key_covers_generation_options(tmp_path):
+    generator = AsyncVideoGenerator(StagedArtifactCache(root_dir=str(tmp_path)), JobStore(str(tmp_path / 'jobs.db')))
+    hadith = {'text': 'إنما الأعمال بالنيات'}
+    
+    assert generator._request_key(hadith, {'video_type': 'nature'}) == generator._request_key(hadith, {'video_type': 'nature'})
+    assert generator._request_key(hadith, {'video_type': 'nature'}) != generator._request_key(hadith, {'video_type': 'sky'})
+    assert generator._request_key(hadith) != generator._request_key(hadith, {'enhance_locally': False})
+
+
+def test_cached_request_is_restored_or_rerun_when_its_output_is_gone(tmp_path, monkeypatch):
+    renders = []
+    monkeypatch.setitem(sys.modules, 'main', _fake_pipeline(tmp_path, renders))
+    monkeypatch.setattr(config, 'OUTPUT_FOLDER', str(tmp_path / 'output'))
+    os.makedirs(config.OUTPUT_FOLDER)
+    
+    generator = AsyncVideoGenerator(StagedArtifactCache(root_dir=str(tmp_path / 'stages')),
+                                    JobStore(str(tmp_path / 'jobs.db')))
+    generator.cache = CacheManager(str(tmp_path / 'requests'))
+    hadith = {'text': 'إنما الأعمال بالنيات'}
+    output = generator._generate_video_sync(hadith, 'job_1', {})
+    try:
+        # الإخراج حذف لكن مخزن المراحل ما زال يحويه
+        os.remove(os.path.join(config.OUTPUT_FOLDER, output))
+        started = asyncio.run(generator.generate_video_async(hadith))
+        assert started['cached'] and started['video_path'] == output
+        assert os.path.exists(os.path.join(config.OUTPUT_FOLDER, output))
+        
+        # لا الإخراج ولا المرحلة النهائية: يعاد التوليد بدل نتيجة لا وجود لها
+        os.remove(os.path.join(config.OUTPUT_FOLDER, output))
+        shutil.rmtree(generator.artifacts.stores['final'].store_dir)
+        started = asyncio.run(generator.generate_video_async(hadith))
+        assert started['status'] == 'processing'
+        deadline = time.time() + 5
+        while generator.jobs.get(started['job_id'])['status'] != 'completed' and time.time() < deadline:
+            time.sleep(0.02)
+        assert len(renders) == 2
+    finally:
+        generator.stop()
+
+
+def test_stage_fingerprint_is_memoized_and_tracks_changes(tmp_path, monkeypatch):
+    artifacts = StagedArtifactCache(root_dir=str(tmp_path))
+    path = tmp_path / 'audio.mp3'
+    path.write_bytes(b'speech')
+    calls = []
+    original = performance_manager.hash_file
+    monkeypatch.setattr(performance_manager, 'hash_file', lambda p: calls.append(p) or original(p))
+    
+    first = artifacts.fingerprint(str(path))
+    assert artifacts.fingerprint(str(path)) == first
+    assert len(calls) == 1
+    
+    path.write_bytes(b'other speech')
+    assert artifacts.fingerprint(str(path)) != first
+
+
+def test_render_final_renders_once_per_inputs(tmp_path):
+    """المسار المتزامن وغير المتزامن يشتركان في مخزن المرحلة النهائية"""
+    artifacts = StagedArtifactCache(root_dir=str(tmp_path / 'stages'))
+    audio, background = tmp_path / 'audio.mp3', tmp_path / 'background.mp4'
+    audio.write_bytes(b'speech')
+    background.write_bytes(b'background')
+    seeds = []
+    
+    def render(output_path):
+        def run(music_seed):
+            seeds.append(music_seed)
+            with open(output_path, 'wb') as f:
+                f.write(b'video')
+            return output_path
+        return run
+    
+    outputs = [str(tmp_path / f'out_{i}.mp4') for i in range(2)]
+    keys = [artifacts.render_final(str(audio), str(background), out, lambda seed: {'seed': seed}, render(out))
+            for out in outputs]
+    
+    assert keys[0] and keys[0] == keys[1]
+    assert len(seeds) == 1
+    assert open(outputs[1], 'rb').read() == b'video'
+    assert artifacts.render_final(str(audio), str(background), str(tmp_path / 'failed.mp4'),
+                                  lambda seed: {'other': True}, lambda seed: None) is None
+
+
+def test_large_entries_are_read_from_disk_not_kept_in_ram(tmp_path):
+    cache = CacheManager(str(tmp_path))
+    cache.memory_threshold = 1024
+    payload = os.urandom(4096)
+    
+    cache.set('small', b'filename.mp4')
+    cache.set('large', payload)
+    assert 'small' in cache.memory_cache and 'large' not in cache.memory_cache
+    
+    assert cache.get('large') == payload
+    assert 'large' not in cache.memory_cache
+    assert cache.get('small') == b'filename.mp4'
+
+
+def test_artifact_put_links_instead_of_copying(tmp_path):
+    store = ContentAddressedStore('final_videos', root_dir=str(tmp_path / 'store'))
+    source = tmp_path / 'video.mp4'
+    source.write_bytes(b'video-bytes' * 100)
+    
+    stored = store.put('key', str(source), '.mp4')
+    assert source.exists() and open(stored, 'rb').read() == source.read_bytes()
+    assert os.path.samefile(stored, str(source))
+
+
+def test_artifact_put_restores_moved_source_on_failure(tmp_path, monkeypatch):
+    store = ContentAddressedStore('tts_audio', root_dir=str(tmp_path / 'store'))
+    source = tmp_path / 'speech.mp3'
+    source.write_bytes(b'speech')
+    
+    def failing_replace(src, dst):
+        raise OSError('disk full')
+    
+    monkeypatch.setattr(os, 'replace', failing_replace)
+    assert store.put('key', str(source), '.mp3', move=True) is None
+    assert source.read_bytes() == b'speech'
+    assert os.listdir(store.store_dir) == []
+
+
+def test_cache_archive_roundtrip_starts_a_fresh_node_warm(tmp_path):
+    source_cache = CacheManager(str(tmp_path / 'old' / 'cache'))
+    source_store = ContentAddressedStore('tts_audio', root_dir=str(tmp_path / 'old'))
+    source_cache.set('search', '[{"id": "1"}]', ttl_seconds=3600)
+    # مدخل طلب يشير إلى ملف إخراج محلي فلا يصدر
+    source_cache.set(AsyncVideoGenerator.REQUEST_KEY_PREFIX + 'abc', '{"video": "x.mp4"}', ttl_seconds=3600)
+    source_cache.set('expired', 'x', ttl_seconds=3600)
+    source_cache.index.put('expired', source_cache.index.get('expired')['file_path'], time.time() - 1, 1)
+    audio = tmp_path / 'audio.mp3'
+    audio.write_bytes(b'speech')
+    source_store.put('abc', str(audio), '.mp3')
+    
+    archive = str(tmp_path / 'caches.tar')
+    exported = export_cache_archive(archive, source_cache, {'tts_audio': source_store})
+    assert exported == {'entries': 1, 'tts_audio': 1}
+    
+    fresh_cache = CacheManager(str(tmp_path / 'new' / 'cache'))
+    fresh_store = ContentAddressedStore('tts_audio', root_dir=str(tmp_path / 'new'))
+    imported = import_cache_archive(archive, fresh_cache, {'tts_audio': fresh_store})
+    assert (imported['entries'], imported['tts_audio']) == (1, 1)
+    assert fresh_cache.get('search') == b'[{"id": "1"}]'
+    assert fresh_cache.get('expired') is None
+    assert 3500 < fresh_cache.index.get('search')['expires_at'] - time.time() <= 3600
+    with open(fresh_store.get('abc', '.mp3'), 'rb') as f:
+        assert f.read() == b'speech'
+    
+    # الاستيراد الثاني لا يستبدل الموجود إلا عند الطلب
+    assert import_cache_archive(archive, fresh_cache, {'tts_audio': fresh_store})['skipped'] == 2
+    assert import_cache_archive(archive, fresh_cache, {'tts_audio': fresh_store}, overwrite=True)['entries'] == 1
+
+
+def test_job_store_reclaims_orphaned_jobs_until_max_attempts(tmp_path):
+    jobs = JobStore(str(tmp_path / 'jobs.db'), lease_seconds=60, max_attempts=2)
+    jobs.create('job_1', {'hadith': {'text': 'x'}, 'options': {}})
+    now = time.time()
+    
+    claimed = jobs.claim('worker-a', now)
+    assert (claimed['job_id'], claimed['status'], claimed['attempts']) == ('job_1', 'processing', 1)
+    assert jobs.claim('worker-b', now + 30) is None
+    assert jobs.heartbeat('worker-a', now + 30) == 1
+    assert jobs.claim('worker-b', now + 80) is None
+    
+    # توقف العامل الأول: بعد انتهاء العقد يأخذ عامل آخر المهمة
+    taken = jobs.claim('worker-b', now + 200)
+    assert (taken['owner'], taken['attempts']) == ('worker-b', 2)
+    assert not jobs.update('job_1', 'worker-a', 50, 'stale')
+    assert not jobs.finish('job_1', 'worker-a', 'completed', result='stale.mp4')
+    
+    # استنفدت محاولاتها
+    assert jobs.claim('worker-c', now + 400) is None
+    assert jobs.get('job_1')['status'] == 'failed'
+
+
+def test_queued_jobs_run_and_any_worker_reports_status(tmp_path, monkeypatch):
+    renders = []
+    monkeypatch.setitem(sys.modules, 'main', _fake_pipeline(tmp_path, renders))
+    monkeypatch.setattr(config, 'TEMP_FOLDER', str(tmp_path))
+    monkeypatch.setattr(config, 'OUTPUT_FOLDER', str(tmp_path))
+    db_path = str(tmp_path / 'jobs.db')
+    
+    generator = AsyncVideoGenerator(StagedArtifactCache(root_dir=str(tmp_path / 'stages')), JobStore(db_path))
+    generator.cache = CacheManager(str(tmp_path / 'requests'))
+    other_worker = AsyncVideoGenerator(generator.artifacts, JobStore(db_path))
+    try:
+        started = asyncio.run(generator.generate_video_async({'text': 'إنما الأعمال بالنيات'}, {'video_type': 'sky'}))
+        job_id = started['job_id']
+        
+        deadline = time.time() + 5
+        while generator.jobs.get(job_id)['status'] != 'completed' and time.time() < deadline:
+            time.sleep(0.02)
+        
+        status = other_worker.get_job_status(job_id)
+        assert status['status'] == 'completed' and status['progress'] == 100
+        assert (tmp_path / status['result']).read_bytes() == b'video'
+        assert other_worker.get_job_status('missing') == {'error': 'Job not found'}
+    finally:
+        generator.stop()
+        other_worker.stop()
+
+
+def test_cancel_stops_a_running_job_at_its_next_update(tmp_path):
+    jobs = JobStore(str(tmp_path / 'jobs.db'))
+    generator = AsyncVideoGenerator(StagedArtifactCache(root_dir=str(tmp_path)), jobs)
+    jobs.create('job_1', {'hadith': {}, 'options': {}})
+    jobs.claim(generator.owner)
+    
+    generator._update_progress('job_1', 10, 'audio')
+    assert generator.cancel_job('job_1')
+    with pytest.raises(JobCancelled):
+        generator._update_progress('job_1', 30, 'audio done')
+    assert generator.get_job_status('job_1')['status'] == 'cancelled'
+    generator.stop()
+
+
+def test_concurrent_jobs_get_unique_ids_and_private_work_dirs(tmp_path, monkeypatch):
+    renders = []
+    monkeypatch.setitem(sys.modules, 'main', _fake_pipeline(tmp_path, renders))
+    monkeypatch.setattr(config, 'OUTPUT_FOLDER', str(tmp_path))
+    
+    generator = AsyncVideoGenerator(StagedArtifactCache(root_dir=str(tmp_path / 'stages')),
+                                    JobStore(str(tmp_path / 'jobs.db')))
+    generator.cache = CacheManager(str(tmp_path / 'requests'))
+    job_ids = {generator._generate_job_id() for _ in range(1000)}
+    assert len(job_ids) == 1000
+    
+    # مهام في نفس الثانية ومن نفس العملية لا تتشارك الملفات
+    results = {}
+    threads = [
+        threading.Thread(target=lambda job_id=job_id, kind=kind: results.update(
+            {job_id: generator._generate_video_sync({'text': kind}, job_id, {'video_type': kind})}))
+        for job_id, kind in zip(list(job_ids)[:4], ['nature', 'sky', 'sea', 'desert'])
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert len(set(results.values())) == 4
+    assert sorted(renders) == ['desert_True.mp4', 'nature_True.mp4', 'sea_True.mp4', 'sky_True.mp4']
+    assert os.listdir(tmp_path / 'jobs') == []
+
+
+def test_worker_recycles_after_max_jobs(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'main', _fake_pipeline(tmp_path, []))
+    monkeypatch.setattr(config, 'OUTPUT_FOLDER', str(tmp_path))
+    
+    jobs = JobStore(str(tmp_path / 'jobs.db'))
+    generator = AsyncVideoGenerator(StagedArtifactCache(root_dir=str(tmp_path / 'stages')), jobs)
+    generator.cache = CacheManager(str(tmp_path / 'requests'))
+    for i in range(3):
+        jobs.create(f'job_{i}', {'hadith': {'text': f'حديث {i}'}, 'options': {}})
+    
+    assert generator.run_worker(max_jobs=2) == 2
+    assert jobs.stats() == {'completed': 2, 'queued': 1}
+    # حد ذاكرة أقل من الاستهلاك الحالي: إعادة تدوير بعد كل مهمة
+    assert generator.run_worker(recycle_rss_mb=1) == 1
+    assert jobs.stats() == {'completed': 3}
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='fork start method')
+def test_process_workers_run_jobs_outside_the_server_process(tmp_path, monkeypatch):
+    pipeline = _fake_pipeline(tmp_path, [])
+    
+    def create_hadith_video(hadith_data, background, audio, output_path, music_seed=None, work_dir=None):
+        with open(output_path, 'w') as f:
+            f.write(str(os.getpid()))
+        return output_path
+    pipeline.create_hadith_video = create_hadith_video
+    monkeypatch.setitem(sys.modules, 'main', pipeline)
+    monkeypatch.setattr(config, 'TEMP_FOLDER', str(tmp_path))
+    monkeypatch.setattr(config, 'OUTPUT_FOLDER', str(tmp_path))
+    monkeypatch.setattr(performance_manager, 'artifact_cache', StagedArtifactCache(root_dir=str(tmp_path / 'stages')))
+    
+    jobs = JobStore(str(tmp_path / 'jobs.db'))
+    generator = AsyncVideoGenerator(performance_manager.artifact_cache, jobs)
+    # fork يرث الوحدة الوهمية؛ الإنتاج يستخدم spawn
+    generator.WORKER_CONTEXT = 'fork'
+    generator.mode, generator.max_workers, generator.worker_max_jobs = 'process', 2, 1
+    for i in range(3):
+        jobs.create(f'job_{i}', {'hadith': {'text': f'حديث {i}'}, 'options': {}})
+    try:
+        generator._dispatch()
+        assert len(generator._workers) == 2
+        
+        deadline = time.time() + 10
+        while jobs.stats().get('completed', 0) < 3 and time.time() < deadline:
+            generator._dispatch()
+            time.sleep(0.05)
+        
+        pids = {(tmp_path / jobs.get(f'job_{i}')['result']).read_text() for i in range(3)}
+        # عامل لكل مهمة (إعادة تدوير بعد مهمة واحدة) وليس عملية الخادم
+        assert len(pids) == 3 and str(os.getpid()) not in pids
+    finally:
+        generator.stop()
+    assert generator._workers == []
+
+
+def test_render_worker_starts_in_a_spawned_interpreter(tmp_path, monkeypatch):
+    """مسار الإنتاج: مفسر جديد يستورد الوحدات وخط المعالجة من الصفر"""
+    pytest.importorskip('moviepy')
+    db_path = str(tmp_path / 'jobs.db')
+    JobStore(db_path).stats()
+    # المفسر الجديد يقرأ الإعدادات الأصلية: مجلداته النسبية تنشأ في مجلد الاختبار
+    monkeypatch.chdir(tmp_path)
+    
+    worker = multiprocessing.get_context('spawn').Process(
+        target=performance_manager._render_worker, args=(db_path, 60, 3, 1, 0, 0)
+    )
+    worker.start()
+    worker.join(120)
+    assert worker.exitcode == 0
+
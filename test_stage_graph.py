@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+اختبار جدولة المراحل - Stage Graph Tests
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from stage_graph import StageGraph
+
+
+class _FakeClock:
+    """ساعة يتحكم بها الاختبار"""
+    def __init__(self):
+        self.now = 100.0
+    
+    def __call__(self):
+        return self.now
+    
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class _CountingPool(ThreadPoolExecutor):
+    """مجمع يعلن عند وصول عدد معين من المراحل إلى طابوره"""
+    def __init__(self, max_workers, expected):
+        super().__init__(max_workers=max_workers)
+        self.expected = expected
+        self.submitted = threading.Event()
+        self._count = 0
+    
+    def submit(self, *args, **kwargs):
+        future = super().submit(*args, **kwargs)
+        self._count += 1
+        if self._count >= self.expected:
+            self.submitted.set()
+        return future
+
+
+@pytest.fixture
+def pools():
+    pools = {'io': ThreadPoolExecutor(max_workers=4), 'cpu': _CountingPool(max_workers=1, expected=2)}
+    yield pools
+    for pool in pools.values():
+        pool.shutdown(wait=True)
+
+
+def test_independent_stages_overlap(pools):
+    # لا تعبر المرحلتان الحاجز إلا إذا عملتا في الوقت نفسه
+    both_running = threading.Barrier(2, timeout=5)
+    
+    def stage(value):
+        def run():
+            both_running.wait()
+            return value
+        return run
+    
+    graph = StageGraph(pools)
+    graph.add('audio', stage('audio.mp3'))
+    graph.add('download', stage('background.mp4'))
+    graph.add('render', lambda audio, background: f'{audio}+{background}', deps=('audio', 'download'), pool='cpu')
+    
+    results = graph.run()
+    
+    assert results['render'] == 'audio.mp3+background.mp4'
+    assert graph.report()['stages']['render']['pool'] == 'cpu'
+
+
+def test_cpu_pool_limits_concurrency_and_records_queueing(pools):
+    clock = _FakeClock()
+    lock = threading.Lock()
+    active = []
+    peak = []
+    
+    def stage(name):
+        def run():
+            with lock:
+                active.append(name)
+                peak.append(len(active))
+            # المرحلة الثانية في الطابور قبل أن "تستغرق" الأولى ثانية
+            assert pools['cpu'].submitted.wait(5)
+            clock.advance(1.0)
+            with lock:
+                active.remove(name)
+            return name
+        return run
+    
+    graph = StageGraph(pools, clock=clock)
+    for name in ('a', 'b'):
+        graph.add(name, stage(name), pool='cpu')
+    
+    graph.run()
+    
+    # خيط واحد في مجمع cpu: إحدى المرحلتين انتظرت الأخرى كاملة
+    assert max(peak) == 1
+    assert sorted(t['queued'] for t in graph.timings.values()) == [0.0, 1.0]
+    assert graph.elapsed == 2.0
+
+
+def test_failure_stops_new_stages_and_waits_for_running_ones(pools):
+    audio_failed = threading.Event()
+    finished = threading.Event()
+    rendered = []
+    
+    def slow_download():
+        assert audio_failed.wait(5)
+        finished.set()
+        return 'background.mp4'
+    
+    def failing_audio():
+        audio_failed.set()
+        raise RuntimeError('tts down')
+    
+    graph = StageGraph(pools)
+    graph.add('audio', failing_audio)
+    graph.add('download', slow_download)
+    graph.add('render', lambda *inputs: rendered.append(inputs), deps=('audio', 'download'), pool='cpu')
+    
+    with pytest.raises(RuntimeError, match='tts down'):
+        graph.run()
+    assert finished.is_set() and rendered == []
+
+
+def test_on_done_runs_in_dependency_order(pools):
+    order = []
+    graph = StageGraph(pools)
+    graph.add('render', lambda audio: audio + 1, deps=('audio',), pool='cpu')
+    graph.add('audio', lambda: 1)
+    
+    assert graph.run(lambda name, result: order.append((name, result))) == {'audio': 1, 'render': 2}
+    assert order == [('audio', 1), ('render', 2)]
+
+
+def test_unknown_dependency_is_rejected(pools):
+    graph = StageGraph(pools)
+    graph.add('render', lambda audio: audio, deps=('audio',))
+    with pytest.raises(ValueError):
+        graph.run()
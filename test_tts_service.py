@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+اختبار خدمة تحويل النص إلى كلام - TTS Service Tests
+"""
+
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pydub = pytest.importorskip('pydub')
+
+from performance_manager import ContentAddressedStore
+import tts_service
+from tts_service import (EdgeTTSService, ProviderRouter, SegmentedSynthesizer, group_phrases, load_timings,
+                         save_timings)
+
+
+def _fake_tts(calls):
+    """توليد وهمي: مدة المقطع 100 مللي ثانية لكل حرف"""
+    lock = threading.Lock()
+    
+    def synthesize(text, path):
+        with lock:
+            calls.append(text)
+        pydub.AudioSegment.silent(duration=100 * len(text), frame_rate=24000).export(path, format='wav')
+        return path
+    return synthesize
+
+
+def _segments():
+    return [
+        {'text': 'مقدمة', 'cacheable': True, 'pause_after': 0.5},
+        {'text': 'نص الحديث', 'cacheable': False, 'pause_after': 0.5},
+        {'text': 'رواه', 'cacheable': True, 'pause_after': 0},
+        {'text': 'أبو هريرة', 'cacheable': True, 'pause_after': 0.5},
+    ]
+
+
+def test_segments_are_joined_with_pauses(tmp_path):
+    calls = []
+    store = ContentAddressedStore('tts_phrases', root_dir=str(tmp_path / 'cache'))
+    synthesizer = SegmentedSynthesizer(_fake_tts(calls), 'fake', {'voice': 'a'}, phrase_store=store)
+    
+    output = synthesizer.synthesize(_segments(), str(tmp_path / 'audio.wav'))
+    
+    audio = pydub.AudioSegment.from_file(output)
+    text_ms = 100 * sum(len(s['text']) for s in _segments())
+    # وقفتان فقط: لا وقفة بين البادئة والاسم ولا بعد المقطع الأخير
+    assert len(audio) == text_ms + 1000
+    assert sorted(calls) == sorted(s['text'] for s in _segments())
+    assert sorted(os.listdir(tmp_path)) == ['audio.wav', 'cache']
+
+
+def test_constant_phrases_are_synthesized_once(tmp_path):
+    calls = []
+    store = ContentAddressedStore('tts_phrases', root_dir=str(tmp_path / 'cache'))
+    synthesizer = SegmentedSynthesizer(_fake_tts(calls), 'fake', {'voice': 'a'}, phrase_store=store)
+    
+    synthesizer.synthesize(_segments(), str(tmp_path / 'first.wav'))
+    calls.clear()
+    synthesizer.synthesize(_segments(), str(tmp_path / 'second.wav'))
+    assert calls == ['نص الحديث']
+    
+    # صوت مختلف يعني عبارات مختلفة
+    other = SegmentedSynthesizer(_fake_tts(calls), 'fake', {'voice': 'b'}, phrase_store=store)
+    calls.clear()
+    other.synthesize(_segments(), str(tmp_path / 'third.wav'))
+    assert len(calls) == 4
+
+
+def test_failed_segment_raises_and_cleans_up(tmp_path):
+    def synthesize(text, path):
+        if text == 'نص الحديث':
+            return None
+        pydub.AudioSegment.silent(duration=100, frame_rate=24000).export(path, format='wav')
+        return path
+    
+    synthesizer = SegmentedSynthesizer(synthesize, 'fake', {}, phrase_store=False)
+    with pytest.raises(RuntimeError):
+        synthesizer.synthesize(_segments(), str(tmp_path / 'audio.wav'))
+    assert os.listdir(tmp_path) == []
+
+
+class _FakeCommunicate:
+    """بديل edge_tts.Communicate يسجل التزامن وحلقة الأحداث المستخدمة"""
+    active = 0
+    peak = 0
+    loops = set()
+    
+    def __init__(self, text, voice, rate=None, pitch=None, boundary=None):
+        self.text = text
+    
+    async def stream(self):
+        cls = _FakeCommunicate
+        cls.loops.add(id(asyncio.get_running_loop()))
+        cls.active += 1
+        cls.peak = max(cls.peak, cls.active)
+        await asyncio.sleep(0.05)
+        cls.active -= 1
+        for i, word in enumerate(self.text.split()):
+            yield {'type': 'audio', 'data': word.encode('utf-8')}
+            yield {'type': 'WordBoundary', 'offset': i * 5000000, 'duration': 4000000, 'text': word}
+
+
+def test_edge_tts_service_multiplexes_requests_on_one_loop(tmp_path, monkeypatch):
+    class FakeEdgeTTS:
+        Communicate = _FakeCommunicate
+    monkeypatch.setattr(tts_service, 'edge_tts', FakeEdgeTTS, raising=False)
+    
+    service = EdgeTTSService(max_concurrency=3, timeout=10)
+    try:
+        paths = [str(tmp_path / f'{i}.mp3') for i in range(8)]
+        # طلبات من عدة خيوط كما في Flask والعمال غير المتزامنين
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda p: service.synthesize(os.path.basename(p), p, 'v', '+0%', '+0Hz'), paths))
+        
+        assert results == paths
+        assert all(os.path.exists(p) for p in paths)
+        assert load_timings(paths[0])['words'] == [{'text': '0.mp3', 'start': 0.0, 'end': 0.4}]
+        assert len(_FakeCommunicate.loops) == 1
+        assert _FakeCommunicate.peak == 3
+    finally:
+        service.shutdown()
+
+
+def test_joined_segments_keep_shifted_word_timings(tmp_path):
+    def synthesize(text, path):
+        words = text.split()
+        pydub.AudioSegment.silent(duration=500 * len(words), frame_rate=24000).export(path, format='wav')
+        save_timings(path, {'words': [
+            {'text': w, 'start': i * 0.5, 'end': i * 0.5 + 0.4} for i, w in enumerate(words)
+        ]})
+        return path
+    
+    segments = [
+        {'text': 'قال رسول الله', 'cacheable': False, 'pause_after': 1.0},
+        {'text': 'إنما الأعمال بالنيات', 'cacheable': False, 'pause_after': 0},
+    ]
+    output = SegmentedSynthesizer(synthesize, 'fake', {}, phrase_store=False).synthesize(
+        segments, str(tmp_path / 'audio.wav'))
+    
+    timings = load_timings(output)
+    assert [s['start'] for s in timings['segments']] == [0.0, 2.5]
+    assert timings['words'][3] == {'text': 'إنما', 'start': 2.5, 'end': 2.9}
+    assert timings['words'][-1]['end'] == 3.9
+
+
+def test_group_phrases_breaks_on_length_and_punctuation():
+    tokens = 'إنما الأعمال بالنيات، وإنما لكل امرئ ما نوى'.split()
+    words = [{'text': t.strip('،'), 'start': float(i), 'end': i + 0.5} for i, t in enumerate(tokens)]
+    
+    phrases = group_phrases(words, max_chars=30, tokens=tokens)
+    
+    assert [p['text'] for p in phrases] == ['إنما الأعمال بالنيات،', 'وإنما لكل امرئ ما نوى']
+    assert (phrases[1]['start'], phrases[1]['end']) == (3.0, 7.5)
+
+
+class _FakeClock:
+    """ساعة يتحكم بها الاختبار"""
+    def __init__(self):
+        self.now = 100.0
+    
+    def __call__(self):
+        return self.now
+    
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def _provider(calls=None, ok=True, started=None, release=None, clock=None, takes=0.0):
+    """مزود وهمي؛ ينتظر release إن وجد ويقدم الساعة الوهمية بمقدار takes"""
+    def synthesize(path):
+        if calls is not None:
+            calls.append(path)
+        if started is not None:
+            started.set()
+        if release is not None:
+            assert release.wait(5)
+        if clock is not None:
+            clock.advance(takes)
+        if not ok:
+            raise RuntimeError('provider down')
+        with open(path, 'wb') as f:
+            f.write(b'audio')
+        return path
+    return synthesize
+
+
+def _join_attempt(name):
+    for thread in threading.enumerate():
+        if thread.name == f'tts-{name}':
+            thread.join(5)
+
+
+def _run_in_background(router, attempts, output):
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(router.run, attempts, output)
+    executor.shutdown(wait=False)
+    return future
+
+
+def test_router_hedges_slow_provider_when_opted_in(tmp_path):
+    clock = _FakeClock()
+    router = ProviderRouter(default_delay=5, hedge=True, clock=clock, poll_interval=0.005)
+    slow_started, release = threading.Event(), threading.Event()
+    fast_calls = []
+    output = str(tmp_path / 'audio.mp3')
+    
+    future = _run_in_background(router, [('slow', _provider(started=slow_started, release=release)),
+                                         ('fast', _provider(fast_calls))], output)
+    assert slow_started.wait(5)
+    clock.advance(6)
+    
+    assert future.result(5) == ('fast', output)
+    release.set()
+    _join_attempt('slow')
+    # نتيجة المزود البطيء تحذف بعد وصولها
+    assert os.listdir(tmp_path) == ['audio.mp3']
+    assert router.stats()['slow']['requests'] == 1
+
+
+def test_router_waits_for_preferred_provider_within_its_timeout(tmp_path):
+    clock = _FakeClock()
+    router = ProviderRouter(default_delay=5, attempt_timeout=60, clock=clock, poll_interval=0.005)
+    slow_started, release = threading.Event(), threading.Event()
+    fallback_calls = []
+    output = str(tmp_path / 'audio.mp3')
+    attempts = [('edge_tts', _provider(started=slow_started, release=release)), ('gtts', _provider(fallback_calls))]
+    
+    # تجاوز مهلة التحوط وحدها لا يبدأ المزود الأقل جودة
+    future = _run_in_background(router, attempts, output)
+    assert slow_started.wait(5)
+    clock.advance(30)
+    release.set()
+    assert future.result(5) == ('edge_tts', output)
+    assert fallback_calls == []
+    
+    # تجاوز المهلة الكاملة ينتقل إليه
+    slow_started.clear()
+    release.clear()
+    future = _run_in_background(router, attempts, output)
+    assert slow_started.wait(5)
+    clock.advance(61)
+    assert future.result(5) == ('gtts', output)
+    release.set()
+    _join_attempt('edge_tts')
+
+
+def test_router_records_latency_from_attempt_start(tmp_path):
+    clock = _FakeClock()
+    router = ProviderRouter(clock=clock)
+    
+    router.run([('edge_tts', _provider(clock=clock, takes=3.0))], str(tmp_path / 'audio.mp3'))
+    
+    assert router.stats()['edge_tts']['p50'] == 3.0
+
+
+def test_router_fails_over_immediately_and_demotes_failing_provider(tmp_path):
+    router = ProviderRouter(default_delay=30)
+    calls = []
+    attempts = [('broken', _provider(ok=False)), ('backup', _provider(calls))]
+    
+    for i in range(ProviderRouter.MIN_SAMPLES):
+        assert router.run(attempts, str(tmp_path / f'{i}.mp3'))[0] == 'backup'
+    assert router.order(['broken', 'backup']) == ['backup', 'broken']
+    
+    stats = router.stats()
+    assert stats['broken']['errors'] == ProviderRouter.MIN_SAMPLES
+    assert stats['backup']['histogram']['0.5'] == stats['backup']['histogram']['+Inf'] == len(calls)
+    assert stats['backup']['hedge_delay'] == router.min_delay
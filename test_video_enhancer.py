@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+اختبار تحسين الفيديو - Video Enhancer Tests
+"""
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+
+from video_enhancer import AdaptiveColorCorrector, VideoEnhancer, VideoStabilizer
+
+
+def _shaky_frames(width=320, height=180, count=60, seed=1):
+    """إطارات مهتزة مع حركة أفقية بطيئة"""
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 255, (height + 40, width + 40, 3), dtype=np.uint8)
+    base = cv2.GaussianBlur(base, (0, 0), 2)
+    frames = []
+    for i in range(count):
+        dx, dy = rng.integers(-4, 5, 2)
+        x = 20 + int(dx) + i // 4
+        y = 20 + int(dy)
+        frames.append(np.ascontiguousarray(base[y:y + height, x:x + width]))
+    return frames
+
+
+def _jitter(frames):
+    """تباين الإزاحة بين الإطارات المتتالية"""
+    shifts = []
+    for prev, curr in zip(frames, frames[1:]):
+        a = cv2.cvtColor(prev, cv2.COLOR_BGR2GRAY).astype(np.float32)
+        b = cv2.cvtColor(curr, cv2.COLOR_BGR2GRAY).astype(np.float32)
+        (sx, sy), _ = cv2.phaseCorrelate(a, b)
+        shifts.append((sx, sy))
+    return float(np.var(np.array(shifts), axis=0).sum())
+
+
+def test_stabilizer_preserves_frame_count_and_size():
+    frames = _shaky_frames(count=30)
+    stabilizer = VideoStabilizer(320, 180, radius=5, analysis_width=160)
+    output = []
+    for frame in frames:
+        output.extend(stabilizer.push(frame))
+        # المسار المحفوظ لا يتجاوز نافذة التنعيم
+        assert len(stabilizer._trajectory) <= 2 * 5 + 1
+    output.extend(stabilizer.flush())
+    
+    assert len(output) == len(frames)
+    assert all(frame.shape == (180, 320, 3) for frame in output)
+
+
+def test_stabilizer_reduces_jitter():
+    frames = _shaky_frames()
+    stabilizer = VideoStabilizer(320, 180, radius=8, analysis_width=320, crop=1.1)
+    output = []
+    for frame in frames:
+        output.extend(stabilizer.push(frame))
+    output.extend(stabilizer.flush())
+    
+    assert _jitter(output) < _jitter(frames) * 0.5
+
+
+def _natural_frame(width=960, height=540, seed=2):
+    """إطار بتدرجات وأشكال مشابه للخلفيات الطبيعية"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    frame = np.stack([x / width * 120 + 40, y / height * 100 + 60, (x + y) / (width + height) * 80 + 50], -1)
+    frame = frame.astype(np.uint8)
+    for _ in range(20):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        color = tuple(int(c) for c in rng.integers(30, 200, 3))
+        cv2.circle(frame, center, int(rng.integers(10, 80)), color, -1)
+    return cv2.GaussianBlur(frame, (0, 0), 1.5)
+
+
+def test_proxy_color_correction_approximates_full_resolution():
+    frame = _natural_frame()
+    full = VideoEnhancer({'color_analysis_mode': 'full'})._color_correction(frame).astype(np.int16)
+    proxy = AdaptiveColorCorrector(analysis_width=480).apply(frame).astype(np.int16)
+    
+    assert proxy.shape == frame.shape
+    # أقرب إلى نتيجة CLAHE الكاملة من الإطار الأصلي، بدون انحراف في السطوع العام
+    assert np.abs(proxy - full).mean() < np.abs(frame.astype(np.int16) - full).mean()
+    assert abs(proxy.mean() - full.mean()) < 5
+
+
+def test_proxy_color_correction_reanalyzes_on_interval_and_scene_change():
+    frames = _shaky_frames(count=10)
+    corrector = AdaptiveColorCorrector(interval=4)
+    for frame in frames:
+        corrector.apply(frame)
+    assert corrector.analyses == 3
+    
+    corrector.apply(np.full_like(frames[0], 250))
+    assert corrector.analyses == 4
+
+
+def test_preview_samples_frames_into_contact_sheet(tmp_path):
+    source = str(tmp_path / 'source.mp4')
+    writer = cv2.VideoWriter(source, cv2.VideoWriter_fourcc(*'mp4v'), 24, (320, 180))
+    for frame in _shaky_frames(count=48):
+        writer.write(frame)
+    writer.release()
+    
+    enhancer = VideoEnhancer({'denoise': False, 'sharpening': True, 'color_correction': True})
+    result = enhancer.preview(source, str(tmp_path / 'preview.jpg'), max_frames=4, scale=0.5)
+    
+    sheet = cv2.imread(result)
+    # أربع بلاطات (أصلي | محسن) بنصف الدقة في شبكة 2x2
+    assert sheet.shape[:2] == (2 * 90, 2 * 2 * 160)
+    # كل إطار معاين يمر بتحليل الألوان المصغر نفسه الذي يطبقه التحسين الكامل
+    assert enhancer._color_corrector.analyses == 4
@@ -0,0 +1,572 @@
+# -*- coding: utf-8 -*-
+"""
+خدمة تحويل النص إلى كلام - Text-to-Speech Service
+
+Speech is synthesized per segment (intro, hadith text, narrator prefix,
+narrator, ...) instead of as one long string. Segments are synthesized
+concurrently; fixed phrases such as the intro and the prefixes are kept in
+a permanent phrase store so they are only ever billed once. The segments
+are then joined with the configured pauses.
+
+Edge TTS requests run on one long-lived background event loop
+(EdgeTTSService), so Flask threads and worker threads submit coroutines to
+it instead of creating and tearing down a loop per job.
+
+Word timings reported by Edge TTS are kept in a JSON sidecar next to each
+audio file (see timings_path) and survive segment joining and caching, so
+the video can show the text phrase by phrase in sync with the reading.
+
+ProviderRouter races providers instead of waiting for each one to time out:
+a hedged request to the next provider goes out after the previous one's
+p95 latency, and the first good result wins.
+"""
+
+import os
+import json
+import asyncio
+import logging
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# محاولة استيراد pydub لدمج المقاطع
+try:
+    from pydub import AudioSegment
+    PYDUB_AVAILABLE = True
+except ImportError:
+    PYDUB_AVAILABLE = False
+    logger.warning("pydub غير متوفر - التوليد المجزأ للصوت معطل")
+
+try:
+    import edge_tts
+    EDGE_TTS_AVAILABLE = True
+except ImportError:
+    EDGE_TTS_AVAILABLE = False
+    logger.warning("edge-tts غير متوفر")
+
+try:
+    from performance_manager import ContentAddressedStore
+    PHRASE_STORE_AVAILABLE = True
+except ImportError:
+    PHRASE_STORE_AVAILABLE = False
+
+
+PHRASE_BREAK_CHARS = '.,;:!?،؛؟'
+
+
+def timings_path(audio_path: str) -> str:
+    """مسار ملف التوقيتات المرافق للصوت - Sidecar path holding word timings"""
+    return os.path.splitext(audio_path)[0] + '.timings.json'
+
+
+def save_timings(audio_path: str, timings: Dict):
+    """حفظ توقيتات الكلمات بجانب الملف الصوتي"""
+    with open(timings_path(audio_path), 'w', encoding='utf-8') as f:
+        json.dump(timings, f, ensure_ascii=False)
+
+
+def load_timings(audio_path: str) -> Optional[Dict]:
+    """
+    قراءة توقيتات الكلمات إن وجدت
+    Load {'words': [...], 'segments': [...]} timings, times in seconds
+    """
+    path = timings_path(audio_path) if audio_path else None
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"تعذر قراءة توقيتات الصوت: {e}")
+        return None
+
+
+def copy_timings(source_audio: str, target_audio: str):
+    """نقل التوقيتات مع الصوت عند إنتاج نسخة جديدة منه (مثل التحسين المحلي)"""
+    if source_audio == target_audio:
+        return
+    timings = load_timings(source_audio)
+    if timings:
+        save_timings(target_audio, timings)
+
+
+def group_phrases(words: List[Dict], max_chars: int = 60, tokens: List[str] = None) -> List[Dict]:
+    """
+    تجميع الكلمات في عبارات قصيرة للعرض المتزامن
+    Group timed words into display phrases
+    
+    Args:
+        words: كلمات بتوقيتاتها
+        max_chars: أقصى طول للعبارة
+        tokens: كلمات النص الأصلي (بعلامات الترقيم) إذا طابق عددها عدد الكلمات
+        
+    Returns:
+        عبارات بالشكل {'text', 'start', 'end'}
+    """
+    if tokens is None or len(tokens) != len(words):
+        tokens = [w['text'] for w in words]
+    
+    phrases = []
+    current = []
+    for word, token in zip(words, tokens):
+        current.append((word, token))
+        length = sum(len(t) + 1 for _, t in current)
+        if length >= max_chars or (token[-1:] in PHRASE_BREAK_CHARS and length >= max_chars // 2):
+            phrases.append(current)
+            current = []
+    if current:
+        phrases.append(current)
+    
+    return [{
+        'text': ' '.join(t for _, t in phrase),
+        'start': phrase[0][0]['start'],
+        'end': phrase[-1][0]['end']
+    } for phrase in phrases]
+
+
+class SegmentedSynthesizer:
+    """
+    توليد الصوت على شكل مقاطع متوازية ثم دمجها
+    Synthesize speech segments in parallel and join them with pauses
+    
+    Each segment is a dict:
+        text        - النص المراد قراءته
+        cacheable   - عبارة ثابتة أو متكررة تُحفظ بشكل دائم
+        pause_after - مدة الصمت بعد المقطع (ثانية)
+    """
+    
+    def __init__(self, synthesize_fn: Callable[[str, str], Optional[str]], provider: str,
+                 voice_settings: Dict, max_workers: int = 4, phrase_store=None):
+        """
+        Args:
+            synthesize_fn: دالة توليد مقطع واحد (النص، مسار الحفظ) -> المسار أو None
+            provider: اسم المزود (جزء من مفتاح التخزين)
+            voice_settings: إعدادات الصوت (جزء من مفتاح التخزين)
+            max_workers: أقصى عدد من المقاطع المولدة في نفس الوقت
+            phrase_store: مخزن العبارات الثابتة (اختياري)
+        """
+        self.synthesize_fn = synthesize_fn
+        self.provider = provider
+        self.voice_settings = voice_settings or {}
+        self.max_workers = max(1, int(max_workers))
+        if phrase_store is None and PHRASE_STORE_AVAILABLE:
+            phrase_store = ContentAddressedStore('tts_phrases')
+        self.phrase_store = phrase_store
+    
+    @staticmethod
+    def is_available() -> bool:
+        """التحقق من توفر أدوات الدمج"""
+        return PYDUB_AVAILABLE
+    
+    def synthesize(self, segments: List[Dict], output_path: str) -> Optional[str]:
+        """
+        توليد المقاطع ودمجها في ملف واحد
+        Synthesize all segments and write the joined audio to output_path
+        
+        Raises:
+            RuntimeError: إذا فشل توليد أي مقطع
+        """
+        segments = [s for s in segments if s.get('text', '').strip()]
+        if not segments:
+            return None
+        
+        base, ext = os.path.splitext(output_path)
+        paths = [None] * len(segments)
+        pending = []
+        
+        for i, segment in enumerate(segments):
+            if segment.get('cacheable') and self.phrase_store:
+                cached = self.phrase_store.get(self._phrase_key(segment['text']), ext)
+                if cached:
+                    paths[i] = cached
+                    continue
+            pending.append(i)
+        
+        try:
+            if pending:
+                logger.info(f"توليد {len(pending)} من {len(segments)} مقطع صوتي بالتوازي...")
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(pending))) as executor:
+                    futures = {
+                        i: executor.submit(self.synthesize_fn, segments[i]['text'], f"{base}_seg{i}{ext}")
+                        for i in pending
+                    }
+                for i, future in futures.items():
+                    result = future.result()
+                    if not result or not os.path.exists(result):
+                        raise RuntimeError(f"فشل توليد المقطع الصوتي: {segments[i]['text'][:30]}")
+                    if segments[i].get('cacheable') and self.phrase_store:
+                        key = self._phrase_key(segments[i]['text'])
+                        if os.path.exists(timings_path(result)):
+                            self.phrase_store.put(key, timings_path(result), '.timings.json', move=True)
+                        result = self.phrase_store.put(key, result, ext, move=True) or result
+                    paths[i] = result
+            
+            return self._join(segments, paths, output_path)
+        finally:
+            for i in pending:
+                temp_path = f"{base}_seg{i}{ext}"
+                for path in (temp_path, timings_path(temp_path)):
+                    if os.path.exists(path):
+                        os.remove(path)
+    
+    def _phrase_key(self, text: str) -> str:
+        """مفتاح العبارة في المخزن الدائم"""
+        return self.phrase_store.make_key('tts_phrase', text.strip(), self.provider, self.voice_settings)
+    
+    @staticmethod
+    def _join(segments: List[Dict], paths: List[str], output_path: str) -> str:
+        """دمج المقاطع مع فترات الصمت وإزاحة توقيتات الكلمات"""
+        combined = None
+        words, spans = [], []
+        for segment, path in zip(segments, paths):
+            audio = AudioSegment.from_file(path)
+            offset = len(combined) / 1000.0 if combined is not None else 0.0
+            # pydub يوحد معدل العينات وعدد القنوات عند الدمج
+            combined = audio if combined is None else combined + audio
+            
+            timings = load_timings(path)
+            if timings:
+                words.extend(dict(w, start=round(w['start'] + offset, 3), end=round(w['end'] + offset, 3))
+                             for w in timings.get('words', []))
+            spans.append({'text': segment['text'], 'start': round(offset, 3),
+                          'end': round(offset + len(audio) / 1000.0, 3)})
+            
+            pause = segment.get('pause_after', 0)
+            if pause > 0 and segment is not segments[-1]:
+                combined += AudioSegment.silent(duration=int(pause * 1000), frame_rate=combined.frame_rate)
+        
+        combined.export(output_path, format=os.path.splitext(output_path)[1][1:] or 'mp3')
+        if words:
+            save_timings(output_path, {'words': words, 'segments': spans})
+        return output_path
+
+
+def synthesize_segments(segments: List[Dict], output_path: str, synthesize_fn: Callable[[str, str], Optional[str]],
+                        provider: str, voice_settings: Dict) -> Optional[str]:
+    """
+    وظيفة مساعدة للتوليد المجزأ حسب إعدادات AUDIO_READING
+    Helper for segmented synthesis using AUDIO_READING settings
+    """
+    audio_settings = getattr(config, 'AUDIO_READING', {})
+    synthesizer = SegmentedSynthesizer(
+        synthesize_fn, provider, voice_settings,
+        max_workers=audio_settings.get('max_parallel_segments', 4)
+    )
+    return synthesizer.synthesize(segments, output_path)
+
+
+class EdgeTTSService:
+    """
+    خدمة Edge TTS بحلقة أحداث دائمة في الخلفية
+    Edge TTS client running on a single long-lived event loop
+    
+    Any thread may submit synthesis requests; they are multiplexed on the
+    background loop with at most `max_concurrency` in flight at once.
+    """
+    
+    def __init__(self, max_concurrency: int = 4, timeout: float = 60):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.timeout = timeout
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+    
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        """تشغيل حلقة الأحداث عند أول طلب"""
+        with self._lock:
+            if self._loop is None or not self._thread.is_alive():
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+                
+                def run():
+                    asyncio.set_event_loop(loop)
+                    self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+                
+                self._thread = threading.Thread(target=run, name='edge-tts-loop', daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+            return self._loop
+    
+    async def _synthesize(self, text: str, output_path: str, voice: str, rate: str, pitch: str) -> str:
+        words = []
+        async with self._semaphore:
+            communicate = self._communicate(text, voice, rate, pitch)
+            with open(output_path, 'wb') as f:
+                async for chunk in communicate.stream():
+                    if chunk['type'] == 'audio':
+                        f.write(chunk['data'])
+                    elif chunk['type'] == 'WordBoundary':
+                        # الإزاحة والمدة بوحدات 100 نانوثانية
+                        start = chunk['offset'] / 1e7
+                        words.append({
+                            'text': chunk['text'],
+                            'start': round(start, 3),
+                            'end': round(start + chunk['duration'] / 1e7, 3)
+                        })
+        
+        if words:
+            save_timings(output_path, {
+                'words': words,
+                'segments': [{'text': text, 'start': 0.0, 'end': words[-1]['end']}]
+            })
+        return output_path
+    
+    @staticmethod
+    def _communicate(text: str, voice: str, rate: str, pitch: str):
+        """edge-tts 7 يرسل حدود الجمل افتراضياً، فنطلب حدود الكلمات صراحة"""
+        try:
+            return edge_tts.Communicate(text, voice, rate=rate, pitch=pitch, boundary='WordBoundary')
+        except TypeError:
+            # edge-tts 6 يرسل حدود الكلمات دائماً
+            return edge_tts.Communicate(text, voice, rate=rate, pitch=pitch)
+    
+    def submit(self, text: str, output_path: str, voice: str = None,
+               rate: str = None, pitch: str = None) -> Future:
+        """
+        إرسال طلب توليد دون انتظار النتيجة
+        Submit a synthesis request; returns a concurrent.futures.Future
+        """
+        voice = voice or getattr(config, 'EDGE_TTS_VOICE', 'ar-SA-HamedNeural')
+        rate = rate or getattr(config, 'EDGE_TTS_RATE', '-15%')
+        pitch = pitch or getattr(config, 'EDGE_TTS_PITCH', '-2Hz')
+        loop = self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(
+            self._synthesize(text, output_path, voice, rate, pitch), loop
+        )
+    
+    def synthesize(self, text: str, output_path: str, voice: str = None,
+                   rate: str = None, pitch: str = None) -> str:
+        """
+        توليد ملف صوتي وانتظار اكتماله
+        Synthesize to output_path, blocking the calling thread only
+        """
+        future = self.submit(text, output_path, voice, rate, pitch)
+        try:
+            return future.result(timeout=self.timeout)
+        except Exception:
+            future.cancel()
+            raise
+    
+    def shutdown(self):
+        """إيقاف حلقة الأحداث"""
+        with self._lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._thread.join(timeout=5)
+                self._loop.close()
+                self._loop = None
+                self._thread = None
+
+
+# Singleton
+edge_tts_service = EdgeTTSService(
+    max_concurrency=getattr(config, 'EDGE_TTS_MAX_CONCURRENCY', 4),
+    timeout=getattr(config, 'EDGE_TTS_TIMEOUT', 60)
+)
+
+
+class ProviderRouter:
+    """
+    موجه مزودي تحويل النص إلى كلام مع طلبات تحوطية
+    Routes one synthesis across TTS providers with hedged requests
+    
+    Providers are tried in preference order, which is also quality order.
+    The next one starts as soon as the previous attempt fails, or once it
+    has been running longer than attempt_timeout. With hedge enabled (an
+    opt-in, since the next provider is a lower quality one) it starts
+    already after the hedge delay: the p95 of the provider's recent
+    successful latencies, clamped to [min_delay, max_delay], or
+    default_delay until enough samples exist.
+    
+    Each attempt runs on its own thread and its clock starts when it
+    starts running, so concurrent jobs never queue behind each other's
+    slow attempts and queueing never counts as provider latency. The
+    first good result wins; attempts still running are left to finish
+    and their files are discarded. Providers whose rolling error rate
+    reaches error_threshold are moved to the end of the order.
+    """
+    
+    HISTOGRAM_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60)
+    MIN_SAMPLES = 5
+    
+    def __init__(self, window: int = 50, min_delay: float = 1.0, max_delay: float = 20.0,
+                 default_delay: float = 8.0, error_threshold: float = 0.5, hedge: bool = False,
+                 attempt_timeout: float = 60.0, clock: Callable[[], float] = time.monotonic,
+                 poll_interval: float = 1.0):
+        self.window = window
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.default_delay = default_delay
+        self.error_threshold = error_threshold
+        self.hedge = hedge
+        self.attempt_timeout = attempt_timeout
+        self.clock = clock
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._recent = {}
+        self._totals = {}
+    
+    def record(self, provider: str, seconds: float, ok: bool):
+        """تسجيل زمن ونتيجة طلب واحد"""
+        with self._lock:
+            self._recent.setdefault(provider, deque(maxlen=self.window)).append((seconds, ok))
+            totals = self._totals.setdefault(provider, {
+                'requests': 0, 'errors': 0, 'histogram': [0] * (len(self.HISTOGRAM_BUCKETS) + 1)
+            })
+            totals['requests'] += 1
+            if not ok:
+                totals['errors'] += 1
+                return
+            bucket = sum(1 for bound in self.HISTOGRAM_BUCKETS if seconds > bound)
+            totals['histogram'][bucket] += 1
+    
+    def _latencies(self, provider: str) -> List[float]:
+        return [seconds for seconds, ok in self._recent.get(provider, ()) if ok]
+    
+    def _error_rate(self, provider: str) -> float:
+        recent = self._recent.get(provider, ())
+        return sum(1 for _, ok in recent if not ok) / len(recent) if recent else 0.0
+    
+    def hedge_delay(self, provider: str) -> float:
+        """مهلة إرسال الطلب التحوطي بعد بدء هذا المزود"""
+        with self._lock:
+            latencies = self._latencies(provider)
+        if len(latencies) < self.MIN_SAMPLES:
+            return self.default_delay
+        p95 = sorted(latencies)[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+        return min(self.max_delay, max(self.min_delay, p95))
+    
+    def order(self, providers: List[str]) -> List[str]:
+        """ترتيب التفضيل مع تأخير المزودين كثيري الأخطاء"""
+        with self._lock:
+            failing = {name for name in providers
+                       if len(self._recent.get(name, ())) >= self.MIN_SAMPLES
+                       and self._error_rate(name) >= self.error_threshold}
+        return [name for name in providers if name not in failing] + [name for name in providers if name in failing]
+    
+    def stats(self) -> Dict:
+        """إحصائيات الزمن لكل مزود مع مدرج تراكمي - per-provider latency stats"""
+        with self._lock:
+            result = {}
+            for provider, totals in self._totals.items():
+                latencies = sorted(self._latencies(provider))
+                cumulative = 0
+                histogram = {}
+                for bound, count in zip(self.HISTOGRAM_BUCKETS + (float('inf'),), totals['histogram']):
+                    cumulative += count
+                    histogram['+Inf' if bound == float('inf') else str(bound)] = cumulative
+                result[provider] = {
+                    'requests': totals['requests'],
+                    'errors': totals['errors'],
+                    'recent_error_rate': round(self._error_rate(provider), 3),
+                    'p50': latencies[len(latencies) // 2] if latencies else None,
+                    'p95': latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if latencies else None,
+                    'histogram': histogram
+                }
+        for provider in result:
+            result[provider]['hedge_delay'] = self.hedge_delay(provider)
+        return result
+    
+    def run(self, attempts: List[Tuple[str, Callable[[str], Optional[str]]]],
+            output_path: str, hedge: Optional[bool] = None) -> Tuple[Optional[str], Optional[str]]:
+        """
+        تشغيل المحاولات وإرجاع أول نتيجة ناجحة
+        Run the attempts and return (provider, path) of the first good result
+        
+        Args:
+            attempts: قائمة (اسم المزود، دالة) بترتيب التفضيل؛ تستقبل الدالة
+                      مساراً خاصاً بالمحاولة وتعيد مسار الملف أو None
+            output_path: مسار الإخراج النهائي للنتيجة الفائزة
+            hedge: بدء المزود التالي بعد مهلة التحوط دون انتظار attempt_timeout
+                   (الافتراضي من إعدادات الموجه)
+        
+        Returns:
+            (provider, path) أو (None, None) إذا فشلت كل المحاولات
+        """
+        hedge = self.hedge if hedge is None else hedge
+        functions = dict(attempts)
+        pending = self.order([name for name, _ in attempts])
+        base, ext = os.path.splitext(output_path)
+        events = queue.Queue()
+        state = {'winner': None}
+        
+        def attempt(name: str):
+            path = f"{base}.{name}{ext}"
+            started = self.clock()
+            events.put(('started', name, started))
+            try:
+                result = functions[name](path)
+            except Exception as e:
+                logger.warning(f"فشل مزود الصوت {name}: {str(e)}")
+                result = None
+            ok = bool(result) and os.path.exists(result)
+            self.record(name, self.clock() - started, ok)
+            with self._lock:
+                won = ok and state['winner'] is None
+                if won:
+                    state['winner'] = name
+            if ok and not won and result == path:
+                # نتيجة متأخرة بعد فوز مزود آخر
+                for leftover in (path, timings_path(path)):
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+            events.put(('done', name, result if won else None))
+        
+        def launch(name: str):
+            threading.Thread(target=attempt, args=(name,), name=f'tts-{name}', daemon=True).start()
+        
+        launch(pending.pop(0))
+        active = 1
+        deadline = None
+        while active:
+            # المهلة تحسب من بدء تشغيل آخر محاولة فعلياً
+            timeout = None
+            if pending and deadline is not None:
+                timeout = min(max(0.0, deadline - self.clock()), self.poll_interval)
+            try:
+                kind, name, value = events.get(timeout=timeout)
+            except queue.Empty:
+                if self.clock() < deadline:
+                    continue
+                logger.info(f"{'إرسال طلب تحوطي' if hedge else 'انتهت المهلة، الانتقال'} إلى {pending[0]}")
+                deadline = None
+                launch(pending.pop(0))
+                active += 1
+                continue
+            
+            if kind == 'started':
+                deadline = value + (self.hedge_delay(name) if hedge else self.attempt_timeout)
+                continue
+            active -= 1
+            if value:
+                return name, self._place(value, f"{base}.{name}{ext}", output_path)
+            if pending and state['winner'] is None:
+                deadline = None
+                launch(pending.pop(0))
+                active += 1
+        return None, None
+    
+    @staticmethod
+    def _place(result: str, attempt_path: str, output_path: str) -> str:
+        """نقل ملف المحاولة الفائزة (مع التوقيتات) إلى مسار الإخراج"""
+        if result != attempt_path:
+            return result
+        os.replace(result, output_path)
+        if os.path.exists(timings_path(result)):
+            os.replace(timings_path(result), timings_path(output_path))
+        return output_path
+
+
+# Singleton
+tts_router = ProviderRouter(**getattr(config, 'TTS_ROUTER', {}))
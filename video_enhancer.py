@@ -4,9 +4,12 @@
 """
 
 import os
+import math
+import itertools
 import logging
 import numpy as np
-from typing import Optional, Tuple
+from collections import deque
+from typing import List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +31,228 @@ except ImportError:
     logger.warning("moviepy غير متوفر")
 
 
+class VideoStabilizer:
+    """
+    تثبيت الفيديو أثناء القراءة المتدفقة للإطارات
+    Streaming video stabilizer
+    
+    Motion is estimated on downscaled grayscale frames (sparse Lucas-Kanade
+    optical flow + partial affine fit). The camera trajectory is smoothed with
+    a centered moving average, so each frame is emitted `radius` frames late;
+    only that window of full-resolution frames is kept in memory.
+    """
+    
+    def __init__(self, width: int, height: int, radius: int = 12,
+                 analysis_width: int = 320, crop: float = 1.04, max_corners: int = 200):
+        self.width = width
+        self.height = height
+        self.radius = max(1, int(radius))
+        self.crop = max(1.0, float(crop))
+        self.max_corners = max_corners
+        
+        self.analysis_scale = min(1.0, analysis_width / float(width)) if width else 1.0
+        self.analysis_size = (
+            max(1, int(round(width * self.analysis_scale))),
+            max(1, int(round(height * self.analysis_scale)))
+        )
+        
+        self._prev_gray = None
+        self._frames = deque()       # إطارات بانتظار الإخراج
+        # المسار التراكمي (dx, dy, da): تكفي نافذة التنعيم حول الإطار التالي
+        self._trajectory = deque(maxlen=2 * self.radius + 1)
+        self._pushed = 0
+        self._next_output = 0
+    
+    def push(self, frame: np.ndarray) -> List[np.ndarray]:
+        """
+        إضافة إطار وإرجاع الإطارات الجاهزة للإخراج
+        Add a frame and return the frames that are ready to be written
+        """
+        motion = self._estimate_motion(frame)
+        if self._trajectory:
+            last = self._trajectory[-1]
+            self._trajectory.append((last[0] + motion[0], last[1] + motion[1], last[2] + motion[2]))
+        else:
+            self._trajectory.append((0.0, 0.0, 0.0))
+        self._pushed += 1
+        self._frames.append(frame)
+        
+        ready = []
+        while self._pushed - self._next_output > self.radius:
+            ready.append(self._emit())
+        return ready
+    
+    def flush(self) -> List[np.ndarray]:
+        """
+        إخراج الإطارات المتبقية في نهاية الفيديو
+        Emit the remaining buffered frames at end of stream
+        """
+        ready = []
+        while self._frames:
+            ready.append(self._emit())
+        return ready
+    
+    def _estimate_motion(self, frame: np.ndarray) -> Tuple[float, float, float]:
+        """تقدير الحركة بين الإطار السابق والحالي على نسخة مصغرة"""
+        small = cv2.resize(frame, self.analysis_size, interpolation=cv2.INTER_LINEAR)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        prev_gray, self._prev_gray = self._prev_gray, gray
+        
+        if prev_gray is None:
+            return 0.0, 0.0, 0.0
+        
+        try:
+            prev_pts = cv2.goodFeaturesToTrack(
+                prev_gray, maxCorners=self.max_corners, qualityLevel=0.01, minDistance=8, blockSize=3
+            )
+            if prev_pts is None or len(prev_pts) < 6:
+                return 0.0, 0.0, 0.0
+            
+            curr_pts, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, prev_pts, None)
+            valid = status.reshape(-1) == 1
+            if valid.sum() < 6:
+                return 0.0, 0.0, 0.0
+            
+            matrix, _ = cv2.estimateAffinePartial2D(prev_pts[valid], curr_pts[valid])
+            if matrix is None:
+                return 0.0, 0.0, 0.0
+            
+            # تحويل الإزاحة إلى وحدات الدقة الكاملة
+            dx = matrix[0, 2] / self.analysis_scale
+            dy = matrix[1, 2] / self.analysis_scale
+            da = math.atan2(matrix[1, 0], matrix[0, 0])
+            return dx, dy, da
+        except cv2.error:
+            return 0.0, 0.0, 0.0
+    
+    def _emit(self) -> np.ndarray:
+        """تصحيح الإطار التالي في الطابور وفق المسار المنعم"""
+        index = self._next_output
+        self._next_output += 1
+        frame = self._frames.popleft()
+        
+        # رقم أقدم إطار ما زال مساره محفوظاً
+        first = self._pushed - len(self._trajectory)
+        start = max(0, index - self.radius) - first
+        end = min(self._pushed, index + self.radius + 1) - first
+        window = list(itertools.islice(self._trajectory, start, end))
+        smoothed = [sum(values) / len(window) for values in zip(*window)]
+        actual = self._trajectory[index - first]
+        
+        return self._warp(frame, smoothed[0] - actual[0], smoothed[1] - actual[1], smoothed[2] - actual[2])
+    
+    def _warp(self, frame: np.ndarray, dx: float, dy: float, da: float) -> np.ndarray:
+        """تطبيق التصحيح والتكبير حول المركز في عملية warpAffine واحدة"""
+        cx, cy = self.width / 2.0, self.height / 2.0
+        cos_a = math.cos(da) * self.crop
+        sin_a = math.sin(da) * self.crop
+        tx, ty = dx - cx, dy - cy
+        matrix = np.array([
+            [cos_a, -sin_a, cos_a * tx - sin_a * ty + cx],
+            [sin_a, cos_a, sin_a * tx + cos_a * ty + cy]
+        ], dtype=np.float32)
+        return cv2.warpAffine(frame, matrix, (self.width, self.height),
+                              flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
+
+
+class AdaptiveColorCorrector:
+    """
+    تصحيح الألوان بتحليل منخفض الدقة وتطبيق كامل الدقة
+    Analysis-at-low-res, apply-at-full-res colour correction
+    
+    CLAHE on the LAB luminance is run on a downscaled proxy only every
+    `interval` frames or on a scene change. The result is summarised as one
+    tone curve per BGR channel, so full-resolution frames only pay for a
+    single cv2.LUT instead of two colour-space conversions plus CLAHE.
+    Curves are blended over time between analyses to avoid flicker.
+    """
+    
+    def __init__(self, analysis_width: int = 480, interval: int = 30,
+                 scene_change_threshold: float = 0.4, smoothing: float = 0.25,
+                 clip_limit: float = 2.0, tile_grid: Tuple[int, int] = (8, 8)):
+        self.analysis_width = analysis_width
+        self.interval = max(1, int(interval))
+        self.scene_change_threshold = scene_change_threshold
+        self.smoothing = min(1.0, max(0.0, smoothing))
+        self.clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid)
+        
+        self._lut = None               # منحنيات الألوان الحالية (256, 3)
+        self._reference_hist = None    # مدرج المشهد عند آخر تحليل
+        self._frames_since_analysis = 0
+        self.analyses = 0
+    
+    def apply(self, frame: np.ndarray) -> np.ndarray:
+        """
+        تطبيق التصحيح على إطار كامل الدقة
+        Apply the current correction to a full-resolution frame
+        """
+        hist = self._scene_histogram(frame)
+        scene_changed = (
+            self._reference_hist is not None and
+            cv2.compareHist(self._reference_hist, hist, cv2.HISTCMP_BHATTACHARYYA) > self.scene_change_threshold
+        )
+        
+        if self._lut is None or scene_changed or self._frames_since_analysis >= self.interval:
+            new_lut = self._analyze(frame)
+            if self._lut is None or scene_changed:
+                self._lut = new_lut
+            else:
+                self._lut = (1 - self.smoothing) * self._lut + self.smoothing * new_lut
+            self._reference_hist = hist
+            self._frames_since_analysis = 0
+        
+        self._frames_since_analysis += 1
+        lut = np.clip(np.rint(self._lut), 0, 255).astype(np.uint8).reshape(1, 256, 3)
+        return cv2.LUT(frame, lut)
+    
+    def prime(self, frame: np.ndarray):
+        """
+        تحليل إطار مستقل دون مزجه مع المنحنيات السابقة
+        Analyse one frame on its own, replacing the current curves
+        
+        Used for previews of frames far apart, where blending with the
+        previous analysis would mix unrelated scenes.
+        """
+        self._lut = self._analyze(frame)
+        self._reference_hist = self._scene_histogram(frame)
+        self._frames_since_analysis = 0
+    
+    def _scene_histogram(self, frame: np.ndarray) -> np.ndarray:
+        """مدرج تكراري صغير لاكتشاف تغير المشهد"""
+        h, w = frame.shape[:2]
+        tiny = cv2.resize(frame, (64, max(1, int(64 * h / w))), interpolation=cv2.INTER_LINEAR)
+        gray = cv2.cvtColor(tiny, cv2.COLOR_BGR2GRAY)
+        hist = cv2.calcHist([gray], [0], None, [32], [0, 256])
+        return cv2.normalize(hist, hist).astype(np.float32)
+    
+    def _analyze(self, frame: np.ndarray) -> np.ndarray:
+        """حساب منحنيات الألوان من CLAHE على نسخة مصغرة"""
+        self.analyses += 1
+        h, w = frame.shape[:2]
+        scale = min(1.0, self.analysis_width / float(w))
+        # أخذ عينات بدون تنعيم يحافظ على المدرج التكراري الذي يعتمد عليه CLAHE
+        proxy = cv2.resize(frame, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_NEAREST)
+        
+        lab = cv2.cvtColor(proxy, cv2.COLOR_BGR2LAB)
+        lab[:, :, 0] = self.clahe.apply(lab[:, :, 0])
+        corrected = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+        
+        values = np.arange(256)
+        lut = np.empty((256, 3), dtype=np.float32)
+        for channel in range(3):
+            source = proxy[:, :, channel].ravel()
+            target = corrected[:, :, channel].ravel()
+            counts = np.bincount(source, minlength=256)
+            sums = np.bincount(source, weights=target, minlength=256)
+            present = counts > 0
+            if present.sum() < 2:
+                lut[:, channel] = values
+                continue
+            curve = np.interp(values, values[present], sums[present] / counts[present])
+            lut[:, channel] = np.maximum.accumulate(curve)
+        return lut
+
+
 class VideoEnhancer:
     """
     فئة لتحسين جودة الفيديو محلياً
@@ -44,6 +269,7 @@ class VideoEnhancer:
         """
         self.settings = settings or {}
         self.enabled = self.settings.get('enabled', True)
+        self._color_corrector = None
     
     def enhance(self, input_path: str, output_path: Optional[str] = None) -> str:
         """
@@ -96,20 +322,32 @@ class VideoEnhancer:
             
             frame_count = 0
             
+            # التثبيت يتم في نفس تمرير القراءة مع تأخير بطول نافذة التنعيم
+            stabilizer = self._create_stabilizer(width, height)
+            self._color_corrector = self._create_color_corrector()
+            
             while True:
                 ret, frame = cap.read()
                 if not ret:
                     break
                 
-                # تحسين الإطار
-                enhanced_frame = self._enhance_frame(frame)
+                ready_frames = stabilizer.push(frame) if stabilizer else [frame]
                 
-                out.write(enhanced_frame)
-                frame_count += 1
-                
-                if frame_count % 100 == 0:
-                    progress = (frame_count / total_frames) * 100
-                    logger.info(f"تقدم تحسين الفيديو: {progress:.1f}%")
+                for ready_frame in ready_frames:
+                    # تحسين الإطار
+                    enhanced_frame = self._enhance_frame(ready_frame)
+                    
+                    out.write(enhanced_frame)
+                    frame_count += 1
+                    
+                    if frame_count % 100 == 0:
+                        progress = (frame_count / total_frames) * 100
+                        logger.info(f"تقدم تحسين الفيديو: {progress:.1f}%")
+            
+            if stabilizer:
+                for ready_frame in stabilizer.flush():
+                    out.write(self._enhance_frame(ready_frame))
+                    frame_count += 1
             
             # إغلاق الملفات
             cap.release()
@@ -127,6 +365,36 @@ class VideoEnhancer:
             logger.error(traceback.format_exc())
             return input_path
     
+    def _create_stabilizer(self, width: int, height: int) -> Optional[VideoStabilizer]:
+        """
+        إنشاء مثبت الفيديو حسب الإعدادات
+        Create a stabilizer from settings (None when disabled)
+        """
+        if not self.settings.get('stabilization', True):
+            return None
+        
+        return VideoStabilizer(
+            width,
+            height,
+            radius=self.settings.get('stabilization_radius', 12),
+            analysis_width=self.settings.get('stabilization_analysis_width', 320),
+            crop=self.settings.get('stabilization_crop', 1.04)
+        )
+    
+    def _create_color_corrector(self) -> Optional[AdaptiveColorCorrector]:
+        """
+        إنشاء مصحح الألوان المعتمد على التحليل المصغر
+        Create the proxy-analysis colour corrector (None for full-resolution mode)
+        """
+        if self.settings.get('color_analysis_mode', 'proxy') != 'proxy':
+            return None
+        
+        return AdaptiveColorCorrector(
+            analysis_width=self.settings.get('color_analysis_width', 480),
+            interval=self.settings.get('color_analysis_interval', 30),
+            scene_change_threshold=self.settings.get('scene_change_threshold', 0.4)
+        )
+    
     def _enhance_frame(self, frame: np.ndarray) -> np.ndarray:
         """
         تحسين إطار واحد من الفيديو
@@ -180,6 +448,13 @@ class VideoEnhancer:
         تصحيح الألوان تلقائياً
         Auto color correction
         """
+        if self._color_corrector is not None:
+            try:
+                return self._color_corrector.apply(frame)
+            except Exception as e:
+                logger.error(f"خطأ في تصحيح الألوان التكيفي: {str(e)}")
+                self._color_corrector = None
+        
         try:
             # تحويل إلى LAB
             lab = cv2.cvtColor(frame, cv2.COLOR_BGR2LAB)
@@ -350,6 +625,109 @@ class VideoEnhancer:
             logger.error(f"خطأ في تحسين الفيديو (MoviePy): {str(e)}")
             return input_path
     
+    def preview(self, input_path: str, output_path: Optional[str] = None, mode: str = 'sheet',
+                max_frames: int = 8, stride: Optional[int] = None, scale: float = 0.25,
+                side_by_side: bool = True) -> Optional[str]:
+        """
+        معاينة سريعة للتحسين على إطارات متباعدة فقط
+        Quick enhancement preview on sampled frames only
+        
+        Args:
+            input_path: مسار الفيديو الأصلي
+            output_path: مسار ملف المعاينة (اختياري)
+            mode: 'sheet' لصورة مجمعة JPEG أو 'clip' لمقطع قصير منخفض الجودة
+            max_frames: أقصى عدد للإطارات المعاينة
+            stride: المسافة بين الإطارات (افتراضياً توزيع متساوٍ على كامل الفيديو)
+            scale: نسبة تصغير الإطارات قبل التحسين
+            side_by_side: عرض الإطار الأصلي بجانب المحسن
+        
+        Returns:
+            مسار ملف المعاينة أو None
+        """
+        if not CV2_AVAILABLE or not os.path.exists(input_path):
+            return None
+        
+        cap = cv2.VideoCapture(input_path)
+        if not cap.isOpened():
+            logger.error("فشل في فتح الفيديو للمعاينة")
+            return None
+        
+        try:
+            fps = cap.get(cv2.CAP_PROP_FPS) or 24
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            if total_frames <= 0:
+                return None
+            
+            if stride:
+                indices = list(range(0, total_frames, max(1, int(stride))))[:max_frames]
+            else:
+                count = max(1, min(max_frames, total_frames))
+                indices = sorted(set(np.linspace(0, total_frames - 1, count).astype(int).tolist()))
+            
+            # الإطارات المتباعدة لا تسمح بتثبيت أو مزج زمني، لذا يحلل كل إطار مستقلاً
+            # بنفس مصحح الألوان المستخدم في التحسين الكامل
+            corrector = self._create_color_corrector()
+            self._color_corrector = corrector
+            
+            tiles = []
+            for index in indices:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+                ret, frame = cap.read()
+                if not ret:
+                    continue
+                
+                # التحليل على الإطار بدقته الكاملة كما في التحسين الفعلي
+                if corrector is not None and self.settings.get('color_correction', True):
+                    corrector.prime(frame)
+                
+                if scale < 1.0:
+                    h, w = frame.shape[:2]
+                    frame = cv2.resize(frame, (max(2, int(w * scale)) // 2 * 2, max(2, int(h * scale)) // 2 * 2),
+                                       interpolation=cv2.INTER_AREA)
+                
+                enhanced = self._enhance_frame(frame)
+                tile = np.hstack([frame, enhanced]) if side_by_side else enhanced
+                cv2.putText(tile, f"#{index}  {index / fps:.1f}s", (10, 30), cv2.FONT_HERSHEY_SIMPLEX,
+                            0.8, (255, 255, 255), 2, cv2.LINE_AA)
+                tiles.append(tile)
+            
+            if not tiles:
+                return None
+            
+            if not output_path:
+                base = os.path.splitext(input_path)[0]
+                output_path = f"{base}_preview." + ('mp4' if mode == 'clip' else 'jpg')
+            
+            if mode == 'clip':
+                h, w = tiles[0].shape[:2]
+                out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), 2, (w, h))
+                for tile in tiles:
+                    out.write(tile)
+                out.release()
+            else:
+                cv2.imwrite(output_path, self._contact_sheet(tiles), [cv2.IMWRITE_JPEG_QUALITY, 80])
+            
+            logger.info(f"تم إنشاء معاينة التحسين: {output_path} ({len(tiles)} إطار)")
+            return output_path
+        
+        except Exception as e:
+            logger.error(f"خطأ في معاينة التحسين: {str(e)}")
+            return None
+        finally:
+            cap.release()
+    
+    @staticmethod
+    def _contact_sheet(tiles: List[np.ndarray]) -> np.ndarray:
+        """ترتيب الإطارات في شبكة"""
+        columns = max(1, int(math.ceil(math.sqrt(len(tiles)))))
+        rows = int(math.ceil(len(tiles) / float(columns)))
+        h, w = tiles[0].shape[:2]
+        sheet = np.zeros((rows * h, columns * w, 3), dtype=np.uint8)
+        for i, tile in enumerate(tiles):
+            r, c = divmod(i, columns)
+            sheet[r * h:(r + 1) * h, c * w:(c + 1) * w] = tile
+        return sheet
+    
     def apply_ken_burns(self, clip, zoom: float = 1.1) -> 'VideoFileClip':
         """
         تطبيق تأثير Ken Burns (تكبير وتحريك)
@@ -359,29 +737,10 @@ class VideoEnhancer:
             return clip
         
         try:
-            duration = clip.duration
+            from ken_burns import KenBurnsEngine
             
-            def zoom_effect(get_frame, t):
-                frame = get_frame(t)
-                zoom_factor = 1 + (zoom - 1) * (t / duration)
-                
-                h, w = frame.shape[:2]
-                new_h, new_w = int(h / zoom_factor), int(w / zoom_factor)
-                
-                y1 = (h - new_h) // 2
-                x1 = (w - new_w) // 2
-                
-                cropped = frame[y1:y1+new_h, x1:x1+new_w]
-                
-                if CV2_AVAILABLE:
-                    return cv2.resize(cropped, (w, h), interpolation=cv2.INTER_LINEAR)
-                else:
-                    from PIL import Image
-                    img = Image.fromarray(cropped)
-                    img = img.resize((w, h), Image.Resampling.LANCZOS)
-                    return np.array(img)
-            
-            return clip.fl(zoom_effect)
+            width, height = clip.size
+            return KenBurnsEngine(width, height, zoom).apply_to_clip(clip)
             
         except Exception as e:
             logger.error(f"خطأ في تطبيق Ken Burns: {str(e)}")